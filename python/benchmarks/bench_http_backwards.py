@@ -0,0 +1,113 @@
+"""
+Latency of a serverless backwards invocation against a local fake daemon.
+
+Compares a storage get sent with a new `httpx.Client` per call, as backwards invocations used
+to be sent, with the same get sent through `StorageInvocation` and the pooled client. The fake
+daemon runs in its own process and keeps connections alive.
+
+Usage:
+    python benchmarks/bench_http_backwards.py [iterations]
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+RESPONSE = "".join(
+    json.dumps({"session_id": "session", "event": "backwards_response", "data": data}) + "\n"
+    for data in (
+        {"backwards_request_id": "", "event": "response", "message": "", "data": {"data": "76616c7565"}},
+        {"backwards_request_id": "", "event": "end", "message": "", "data": None},
+    )
+).encode()
+
+
+def serve_daemon():
+    # imported here so that selectors is not imported before gevent patches it in the benchmark process
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class FakeDaemonHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):  # noqa: N802
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(RESPONSE)))
+            self.end_headers()
+            self.wfile.write(RESPONSE)
+
+        def log_message(self, format, *args):  # noqa: A002
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDaemonHandler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+def measure(name: str, iterations: int, func):
+    # warm up, the first call opens the pooled connection
+    func()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+    print(f"{name:>22}: p50 {p50:6.3f} ms, p99 {p99:6.3f} ms")
+
+
+def main():
+    if sys.argv[1:] == ["--daemon"]:
+        serve_daemon()
+        return
+
+    from queue import Queue
+    from unittest.mock import MagicMock
+
+    # httpcore imports trio when it is installed, which fails once gevent patched select
+    import httpcore  # noqa: F401
+    import httpx
+
+    # imported here so that the fake daemon process is not monkey patched by gevent
+    from dify_plugin.config.config import InstallMethod
+    from dify_plugin.core.runtime import Session
+    from dify_plugin.core.server.serverless.response_writer import ServerlessResponseWriter
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    daemon = subprocess.Popen([sys.executable, __file__, "--daemon"], stdout=subprocess.PIPE)  # noqa: S603
+    assert daemon.stdout
+    url = f"http://127.0.0.1:{int(daemon.stdout.readline())}"
+    session = Session(
+        session_id="session",
+        executor=MagicMock(),
+        reader=MagicMock(),
+        writer=ServerlessResponseWriter(Queue()),
+        install_method=InstallMethod.Serverless,
+        dify_plugin_daemon_url=url,
+    )
+    payload = json.dumps({"type": "storage", "request": {"opt": "get", "key": "key"}})
+
+    def new_client():
+        with (
+            httpx.Client() as client,
+            client.stream("POST", f"{url}/backwards-invocation/transaction", content=payload) as response,
+        ):
+            for _ in response.iter_lines():
+                pass
+
+    def pooled_client():
+        assert session.storage.get("key") == b"value"
+
+    try:
+        measure("new client per call", iterations, new_client)
+        measure("pooled client", iterations, pooled_client)
+    finally:
+        daemon.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Throughput of line framing on large frames.
+
+Compares the previous `buffer += data; buffer.split(b"\\n")` approach against `LineFramer`
+by feeding 10 MB frames in 64 KB reads, which is how stdin and sockets deliver them.
+
+Usage:
+    python benchmarks/bench_line_framer.py
+"""
+
+import time
+
+from dify_plugin.core.utils.line_framer import LineFramer
+
+FRAME_SIZE = 10 * 1024 * 1024
+READ_SIZE = 65536
+FRAMES = 5
+
+
+def split_framing(chunks: list[bytes]) -> int:
+    buffer = b""
+    frames = 0
+    for data in chunks:
+        buffer += data
+        if data.find(b"\n") == -1:
+            continue
+        lines = buffer.split(b"\n")
+        buffer = lines[-1]
+        frames += len(lines) - 1
+    return frames
+
+
+def line_framer(chunks: list[bytes]) -> int:
+    framer = LineFramer()
+    frames = 0
+    for data in chunks:
+        frames += len(framer.feed(data))
+    return frames
+
+
+def main():
+    stream = (b"x" * (FRAME_SIZE - 1) + b"\n") * FRAMES
+    chunks = [stream[i : i + READ_SIZE] for i in range(0, len(stream), READ_SIZE)]
+    total_mb = len(stream) / 1024 / 1024
+
+    for name, func in (("split", split_framing), ("line_framer", line_framer)):
+        start = time.perf_counter()
+        frames = func(chunks)
+        elapsed = time.perf_counter() - start
+        assert frames == FRAMES
+        print(f"{name:>12}: {elapsed:.3f}s, {total_mb / elapsed:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Dispatch overhead of the request router.
+
+Compares the previous linear scan over filter routes against the `(type, action)` table with
+the routes registered by `Plugin`, for the first and the last registered action, and the cost
+of building the request model with `annotation(**data)` against the precompiled validator.
+
+Usage:
+    python benchmarks/bench_router_dispatch.py
+"""
+
+import time
+from unittest.mock import MagicMock
+
+from pydantic import TypeAdapter
+
+from dify_plugin.core.entities.plugin.request import (
+    AgentActions,
+    EndpointActions,
+    ModelActions,
+    PluginInvokeType,
+    ToolActions,
+    ToolInvokeRequest,
+)
+from dify_plugin.core.server.router import Router
+
+ITERATIONS = 200000
+
+ROUTES = [
+    (PluginInvokeType.Tool, ToolActions.InvokeTool),
+    (PluginInvokeType.Tool, ToolActions.ValidateCredentials),
+    (PluginInvokeType.Agent, AgentActions.InvokeAgentStrategy),
+    *((PluginInvokeType.Model, action) for action in ModelActions if action != ModelActions.GetAIModelSchemas),
+    (PluginInvokeType.Endpoint, EndpointActions.InvokeEndpoint),
+    (PluginInvokeType.Model, ModelActions.GetAIModelSchemas),
+]
+
+TOOL_REQUEST = {
+    "type": "tool",
+    "action": "invoke_tool",
+    "user_id": "user",
+    "provider": "provider",
+    "tool": "tool",
+    "credentials": {},
+    "tool_parameters": {"query": "dify"},
+}
+
+
+def handler(session, request: dict):
+    return request
+
+
+def make_filter(invoke_type: str, action: str):
+    return lambda data: data.get("type") == invoke_type and data.get("action") == action
+
+
+def measure(name: str, func):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>28}: {elapsed / ITERATIONS * 1e6:.3f} us/request")
+
+
+def main():
+    session = MagicMock()
+    linear = Router(MagicMock(), None)
+    table = Router(MagicMock(), None)
+    for invoke_type, action in ROUTES:
+        linear.register_route(handler, make_filter(str(invoke_type), str(action)))
+        table.register_route(handler, invoke_type=invoke_type, action=action)
+
+    first = {"type": "tool", "action": "invoke_tool"}
+    last = {"type": "model", "action": "get_ai_model_schemas"}
+    for name, data in (("first route", first), ("last route", last)):
+        measure(f"linear, {name}", lambda data=data: linear.dispatch(session, data))
+        measure(f"table, {name}", lambda data=data: table.dispatch(session, data))
+
+    validate = TypeAdapter(ToolInvokeRequest).validate_python
+    measure("annotation(**data)", lambda: ToolInvokeRequest(**TOOL_REQUEST))
+    measure("precompiled validator", lambda: validate(TOOL_REQUEST))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Load test of the serverless `/invoke` endpoint.
+
+Starts a serverless server whose requests burn a few milliseconds of CPU and stream a chunk
+back, once with a single worker process and once with the pre-forked workers, and reports
+the throughput and latency of concurrent clients. Pass the url of a running plugin to load
+it instead, with a json file holding the `data` of the requests.
+
+Usage:
+    python benchmarks/bench_serverless_invoke.py [--workers N] [--concurrency N] [--requests N]
+    python benchmarks/bench_serverless_invoke.py --url http://127.0.0.1:8080 --payload request.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# pure python work of a request, in loop iterations
+WORK = 100000
+
+
+def serve(port: int, workers: int):
+    from dify_plugin.config.config import DifyPluginEnv
+    from dify_plugin.core.server.io_server import IOServer
+    from dify_plugin.core.server.serverless.request_reader import ServerlessRequestReader
+
+    class BurnServer(IOServer):
+        def _execute_request(self, session_id, data, reader, writer, *args, **kwargs):
+            total = sum(i * i for i in range(WORK))
+            writer.session_message(session_id=session_id, data=writer.stream_object({"total": total}))
+
+    reader = ServerlessRequestReader(host="127.0.0.1", port=port, workers=workers)
+    BurnServer(DifyPluginEnv(), reader, None).run()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str):
+    import httpx
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            httpx.get(f"{url}/health").raise_for_status()
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def load(name: str, url: str, data: dict, concurrency: int, requests: int):
+    import httpx
+
+    def invoke(client: httpx.Client) -> float:
+        body = {"event": "request", "session_id": str(uuid.uuid4()), "data": data}
+        start = time.perf_counter()
+        with client.stream("POST", f"{url}/invoke", json=body, timeout=60) as response:
+            response.raise_for_status()
+            for _ in response.iter_bytes():
+                pass
+        return time.perf_counter() - start
+
+    def run_client(count: int) -> list[float]:
+        with httpx.Client() as client:
+            return [invoke(client) for _ in range(count)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+        latencies = sorted(latency for result in pool.map(run_client, counts) for latency in result)
+    elapsed = time.perf_counter() - start
+
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+    print(f"{name:>12}: {requests / elapsed:8.1f} req/s, p50 {p50:8.2f} ms, p99 {p99:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--url", help="url of a running serverless plugin")
+    parser.add_argument("--payload", help="json file with the data of the requests sent to --url")
+    parser.add_argument("--serve", type=int, nargs=2, metavar=("PORT", "WORKERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(*args.serve)
+        return
+
+    if args.url:
+        with open(args.payload) as f:
+            data = json.load(f)
+        wait_ready(args.url)
+        load("plugin", args.url, data, args.concurrency, args.requests)
+        return
+
+    data = {"type": "burn", "action": "burn"}
+    for workers in dict.fromkeys((1, args.workers)):
+        port = free_port()
+        server = subprocess.Popen(  # noqa: S603
+            [sys.executable, __file__, "--serve", str(port), str(workers)],
+            # the access log of every request goes to stderr
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            url = f"http://127.0.0.1:{port}"
+            wait_ready(url)
+            load(f"{workers} worker(s)", url, data, args.concurrency, args.requests)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Time to first byte of the serverless `/invoke` endpoint.
+
+Compares requests queued for the event loop and written chunk by chunk with Nagle's algorithm
+enabled, as the serverless runtime used to handle them, with requests dispatched into the
+scheduler by the connection serving them and written with coalescing and TCP_NODELAY. Every
+session streams 100 small messages.
+
+Usage:
+    python benchmarks/bench_serverless_ttfb.py [iterations]
+"""
+
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+MESSAGES = 100
+
+
+def serve(port: int, direct: bool):
+    from dify_plugin.config.config import DifyPluginEnv
+    from dify_plugin.core.server.io_server import IOServer
+    from dify_plugin.core.server.serverless.request_reader import ServerlessRequestReader
+
+    class StreamServer(IOServer):
+        def _execute_request(self, session_id, data, reader, writer, *args, **kwargs):
+            for index in range(MESSAGES):
+                writer.session_message(session_id=session_id, data=writer.stream_object({"index": index}))
+
+    class QueuedRequestReader(ServerlessRequestReader):
+        def set_dispatcher(self, dispatch):
+            # keep requests on the request queue consumed by the event loop
+            pass
+
+        def listen(self):
+            sock = super().listen()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+            return sock
+
+    reader_class = ServerlessRequestReader if direct else QueuedRequestReader
+    reader = reader_class(host="127.0.0.1", port=port, workers=1, coalesce_bytes=65536 if direct else 0)
+    StreamServer(DifyPluginEnv(), reader, None).run()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(name: str, url: str, iterations: int):
+    import httpx
+
+    with httpx.Client() as client:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                client.get(f"{url}/health").raise_for_status()
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        ttfb = []
+        total = []
+        for _ in range(iterations):
+            body = {"event": "request", "session_id": str(uuid.uuid4()), "data": {}}
+            start = time.perf_counter()
+            with client.stream("POST", f"{url}/invoke", json=body) as response:
+                chunks = response.iter_raw()
+                next(chunks)
+                ttfb.append(time.perf_counter() - start)
+                for _ in chunks:
+                    pass
+            total.append(time.perf_counter() - start)
+
+    ttfb.sort()
+    total.sort()
+    print(f"{name:>8}: p50 ttfb {ttfb[len(ttfb) // 2] * 1e3:6.3f} ms, p50 total {total[len(total) // 2] * 1e3:6.3f} ms")
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), sys.argv[3] == "direct")
+        return
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    for mode in ("queued", "direct"):
+        port = free_port()
+        server = subprocess.Popen(  # noqa: S603
+            [sys.executable, __file__, "--serve", str(port), mode],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            measure(mode, f"http://127.0.0.1:{port}", iterations)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-request cost of creating a `Session`.
+
+Compares a session whose invocation facades are all created, as every session used to do, with
+a session which only uses the storage, and a session which uses none of them.
+
+Usage:
+    python benchmarks/bench_session.py
+"""
+
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from dify_plugin.core.runtime import Session
+
+ITERATIONS = 100000
+
+
+def create_session() -> Session:
+    return Session(
+        session_id="session",
+        executor=EXECUTOR,
+        reader=READER,
+        writer=WRITER,
+        install_method=None,
+    )
+
+
+def all_invocations():
+    session = create_session()
+    return session.model, session.tool, session.app, session.workflow_node, session.storage, session.file
+
+
+def storage_only():
+    return create_session().storage
+
+
+def no_invocation():
+    return create_session()
+
+
+EXECUTOR = ThreadPoolExecutor(max_workers=1)
+READER = MagicMock()
+WRITER = MagicMock()
+
+
+def main():
+    for name, func in (
+        ("all invocations", all_invocations),
+        ("storage only", storage_only),
+        ("no invocation", no_invocation),
+    ):
+        # warm up the imports of the invocations
+        func()
+
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            func()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        session = func()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del session
+
+        print(f"{name:>16}: {elapsed / ITERATIONS * 1e6:.2f} us/session, {size} bytes/session")
+
+
+if __name__ == "__main__":
+    main()
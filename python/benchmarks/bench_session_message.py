@@ -0,0 +1,51 @@
+"""
+Serialization cost of a streamed LLM chunk.
+
+Compares `session_message(stream_object(...))`, which goes through model_dump() and two
+intermediate pydantic models, against the single-pass `session_stream`.
+
+Usage:
+    python benchmarks/bench_session_message.py
+"""
+
+import time
+
+from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.entities.model.llm import LLMResultChunk, LLMResultChunkDelta
+from dify_plugin.entities.model.message import AssistantPromptMessage
+
+ITERATIONS = 50000
+
+
+class NullResponseWriter(ResponseWriter):
+    def write(self, data: str):
+        pass
+
+    def done(self):
+        pass
+
+
+def main():
+    writer = NullResponseWriter()
+    chunk = LLMResultChunk(
+        model="gpt-4o",
+        prompt_messages=[],
+        delta=LLMResultChunkDelta(index=0, message=AssistantPromptMessage(content="Hello, world")),
+    )
+
+    def session_message():
+        writer.session_message(session_id="session", data=writer.stream_object(chunk))
+
+    def session_stream():
+        writer.session_stream(session_id="session", data=chunk)
+
+    for name, func in (("session_message", session_message), ("session_stream", session_stream)):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            func()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>16}: {elapsed / ITERATIONS * 1e6:.2f} us/chunk")
+
+
+if __name__ == "__main__":
+    main()
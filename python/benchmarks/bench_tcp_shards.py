@@ -0,0 +1,133 @@
+"""
+Throughput of the remote installation stream against a local fake daemon.
+
+Several sessions stream large chunks while small sessions send a single message, with one
+connection and with sessions spread across several connections. Reports the bulk throughput
+and the latency of the small sessions, which suffer from head-of-line blocking. The fake
+daemon runs in its own process with a thread per connection.
+
+Usage:
+    python benchmarks/bench_tcp_shards.py [connections ...]
+"""
+
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+BULK_SESSIONS = 4
+BULK_CHUNKS = 64
+CHUNK_SIZE = 256 * 1024
+SMALL_SESSIONS = 200
+
+
+class FakeDaemon:
+    """
+    Accepts any number of connections and records when each session's last frame arrived
+    """
+
+    def __init__(self) -> None:
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.received_bytes = 0
+        self.lock = threading.Lock()
+        # session id -> arrival time of its frames
+        self.arrivals: dict[str, float] = {}
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def wait(self, sessions: int, received_bytes: int):
+        while len(self.arrivals) < sessions or self.received_bytes < received_bytes:
+            time.sleep(0.001)
+
+    def _serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket):
+        buffer = b""
+        while b"\n" not in buffer:
+            buffer += conn.recv(65536)
+        _, _, buffer = buffer.partition(b"\n")
+        while True:
+            *frames, buffer = buffer.split(b"\n\n")
+            now = time.monotonic()
+            with self.lock:
+                for frame in frames:
+                    self.received_bytes += len(frame)
+                    start = frame.find(b'"session_id":"') + len(b'"session_id":"')
+                    self.arrivals[frame[start : frame.index(b'"', start)].decode()] = now
+            data = conn.recv(1048576)
+            if not data:
+                return
+            buffer += data
+
+
+def serve_daemon():
+    """
+    Run the fake daemon, print its port, then the arrival times once everything was received
+    """
+    daemon = FakeDaemon()
+    print(daemon.port, flush=True)
+    daemon.wait(BULK_SESSIONS + SMALL_SESSIONS, BULK_SESSIONS * BULK_CHUNKS * CHUNK_SIZE)
+    print(json.dumps({"received_bytes": daemon.received_bytes, "arrivals": daemon.arrivals}), flush=True)
+
+
+def run(connections: int):
+    # imported here so that the daemon process is not monkey patched by gevent
+    from dify_plugin.core.server.tcp.sharded import ShardedTCPReaderWriter
+
+    daemon = subprocess.Popen([sys.executable, __file__, "--daemon"], stdout=subprocess.PIPE)  # noqa: S603
+    assert daemon.stdout
+    port = int(daemon.stdout.readline())
+    stream = ShardedTCPReaderWriter("127.0.0.1", port, "key", connections=connections)
+    stream.launch()
+
+    chunk = {"data": "x" * CHUNK_SIZE}
+    sent: dict[str, float] = {}
+
+    def bulk(session_id: str):
+        for _ in range(BULK_CHUNKS):
+            stream.session_message(session_id=session_id, data=chunk)
+
+    def small():
+        for i in range(SMALL_SESSIONS):
+            session_id = f"small-{i}"
+            sent[session_id] = time.monotonic()
+            stream.session_message(session_id=session_id, data={"data": "ok"})
+            time.sleep(0.001)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=bulk, args=(f"bulk-{i}",)) for i in range(BULK_SESSIONS)]
+    threads.append(threading.Thread(target=small))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = json.loads(daemon.stdout.readline())
+    daemon.wait()
+    arrivals = result["arrivals"]
+    elapsed = max(arrivals.values()) - start
+
+    latencies = sorted(arrivals[session_id] - sent[session_id] for session_id in sent)
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+    throughput = result["received_bytes"] / elapsed / 1e6
+    print(f"{connections:>3} connections: {throughput:8.1f} MB/s, small session p50 {p50:7.2f} ms, p99 {p99:7.2f} ms")
+    stream.close()
+
+
+def main():
+    if sys.argv[1:] == ["--daemon"]:
+        serve_daemon()
+        return
+
+    for connections in [int(arg) for arg in sys.argv[1:]] or [1, 2, 4]:
+        run(connections)
+
+
+if __name__ == "__main__":
+    main()
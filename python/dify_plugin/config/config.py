@@ -1,7 +1,7 @@
 from enum import Enum
 from typing import Optional
 
-from pydantic import Field
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -11,6 +11,20 @@ class InstallMethod(Enum):
     Serverless = "serverless"
 
 
+class RemoteFraming(Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+class RequestClassConfig(BaseModel):
+    # share of the free workers given to the class while other classes have requests waiting
+    weight: int = Field(default=1, ge=1)
+    # requests of the class running at a time, defaults to MAX_WORKER
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+    # requests of the class waiting for a worker, further requests are rejected
+    max_queue: int = Field(default=1000, ge=0)
+
+
 class DifyPluginEnv(BaseSettings):
     MAX_REQUEST_TIMEOUT: int = Field(default=300, description="Maximum request timeout in seconds")
     MAX_WORKER: int = Field(
@@ -18,26 +32,175 @@ class DifyPluginEnv(BaseSettings):
         description="Maximum worker count, gevent will be used for async IO"
         "and you dont need to worry about the thread count",
     )
+    BACKWARDS_INVOCATION_TIMEOUT: float = Field(
+        default=250,
+        description="Seconds a backwards invocation waits for its next response, 0 to wait until the request timeout",
+    )
+    BACKWARDS_INVOCATION_TIMEOUTS: dict[str, float] = Field(
+        default_factory=dict,
+        description="Overrides of BACKWARDS_INVOCATION_TIMEOUT per invocation type, e.g. `llm` or `storage`, as json",
+    )
     HEARTBEAT_INTERVAL: float = Field(default=10, description="Heartbeat interval in seconds")
+    REQUEST_CLASSES: dict[str, RequestClassConfig] = Field(
+        default_factory=dict,
+        description="Overrides of the request classes `control`, `interactive` and `bulk` "
+        "used to schedule requests on the workers, as json",
+    )
+    SCHEDULER_STATS_INTERVAL: float = Field(
+        default=60,
+        description="Seconds between two log events reporting the load and the request classes of the "
+        "scheduler, 0 disables them",
+    )
+    WORKER_PROCESSES: int = Field(
+        default=1,
+        description="Number of worker processes executing requests, with more than one the main process "
+        "only owns the connection to the daemon and dispatches requests to the workers",
+    )
+    WORKER_ID: Optional[int] = Field(
+        default=None, description="Index of the worker process, set by the main process for its workers"
+    )
     INSTALL_METHOD: InstallMethod = Field(
         default=InstallMethod.Local,
         description="Installation method, local or network",
     )
 
+    STDIO_FLUSH_INTERVAL: float = Field(
+        default=0,
+        description="Seconds to coalesce stdout frames before flushing them, 0 flushes every frame immediately",
+    )
+    STDIO_FLUSH_SIZE: int = Field(default=65536, description="Pending stdout bytes which trigger an immediate flush")
+
     REMOTE_INSTALL_URL: Optional[str] = Field(default=None, description="Remote installation URL")
     REMOTE_INSTALL_HOST: str = Field(default="localhost", description="Remote installation host")
     REMOTE_INSTALL_PORT: int = Field(default=5003, description="Remote installation port")
     REMOTE_INSTALL_KEY: Optional[str] = Field(default=None, description="Remote installation key")
+    REMOTE_INSTALL_FRAMING: RemoteFraming = Field(
+        default=RemoteFraming.JSON,
+        description="Preferred framing of the remote installation stream, negotiated during the handshake, "
+        "newline delimited json is used if the daemon does not accept it",
+    )
+    REMOTE_INSTALL_WRITE_BUFFER_SIZE: int = Field(
+        default=16 * 1024 * 1024,
+        description="Outbound bytes buffered for the remote installation stream before session writers block",
+    )
+    REMOTE_INSTALL_HANDSHAKE_TIMEOUT: float = Field(
+        default=5, description="Seconds to wait for the daemon to accept a non-json framing"
+    )
+    REMOTE_INSTALL_CONNECTIONS: int = Field(
+        default=1,
+        description="Number of connections opened to the daemon, sessions are spread across them by session id",
+    )
+    REMOTE_INSTALL_RESUME: bool = Field(
+        default=False,
+        description="Ask the daemon to resume the remote installation stream after a reconnection, "
+        "in-flight sessions survive if it does",
+    )
+    REMOTE_INSTALL_REPLAY_BUFFER_SIZE: int = Field(
+        default=8 * 1024 * 1024,
+        description="Sent bytes kept to be replayed when the remote installation stream is resumed",
+    )
 
     SERVERLESS_HOST: str = Field(default="0.0.0.0", description="Serverless host")
     SERVERLESS_PORT: int = Field(default=8080, description="Serverless port")
-    SERVERLESS_WORKER_CLASS: str = Field(default="gevent", description="Serverless worker class")
-    SERVERLESS_WORKER_CONNECTIONS: int = Field(default=1000, description="Serverless worker connections")
-    SERVERLESS_WORKERS: int = Field(default=5, description="Serverless workers")
-    SERVERLESS_THREADS: int = Field(default=5, description="Serverless threads")
+    SERVERLESS_WORKER_CLASS: str = Field(
+        default="gevent",
+        description="Serverless worker class, gevent serves connections with greenlets, "
+        "any other class with a pool of SERVERLESS_THREADS threads",
+    )
+    SERVERLESS_WORKER_CONNECTIONS: int = Field(
+        default=1000, description="Concurrent connections of a serverless worker with the gevent worker class"
+    )
+    SERVERLESS_WORKERS: int = Field(
+        default=1,
+        description="Serverless worker processes sharing the port, above 1 they are forked at startup and every "
+        "worker has its own executor and caches. Prefork is opt-in, this setting had no effect before it",
+    )
+    SERVERLESS_THREADS: int = Field(
+        default=5, description="Concurrent requests of a serverless worker with a non gevent worker class"
+    )
+    SERVERLESS_COALESCE_BYTES: int = Field(
+        default=65536,
+        description="Output of a serverless session already written when the connection is ready is sent "
+        "as a single chunk of at most this many bytes, 0 sends every message on its own",
+    )
+    SERVERLESS_READY_MAX_OCCUPANCY: float = Field(
+        default=0.9,
+        description="Fraction of MAX_WORKER running requests above which `/ready` answers 503, 0 disables it",
+    )
+    SERVERLESS_READY_MAX_QUEUED: int = Field(
+        default=100, description="Queued requests above which `/ready` answers 503, 0 disables it"
+    )
+    SERVERLESS_READY_MAX_WAIT: float = Field(
+        default=5,
+        description="Average seconds the requests of the last minute waited for a worker above which "
+        "`/ready` answers 503, 0 disables it",
+    )
+    SERVERLESS_SHED_QUEUED: int = Field(
+        default=1000,
+        description="Queued requests above which `/invoke` answers 503 with Retry-After, 0 disables it",
+    )
+    SERVERLESS_SHED_RETRY_AFTER: int = Field(
+        default=1, description="Seconds sent in the Retry-After header of a shed request"
+    )
+    SERVERLESS_GRACEFUL_TIMEOUT: float = Field(
+        default=30,
+        description="Seconds a serverless worker may take to finish its in-flight requests on SIGTERM "
+        "before it is killed",
+    )
 
     DIFY_PLUGIN_DAEMON_URL: str = Field(default="http://localhost:5002", description="backwards invocation address")
 
+    STORAGE_CACHE_SIZE: int = Field(
+        default=0,
+        description="Bytes of storage values cached by a request, 0 disables the cache. Every request has a "
+        "cache of its own, the storage of a workspace is never served to another one",
+    )
+    STORAGE_CACHE_TTL: float = Field(default=60, description="Seconds a storage value is cached")
+    STORAGE_CACHE_NEGATIVE_TTL: Optional[float] = Field(
+        default=None, description="Seconds a missing storage key is cached, defaults to STORAGE_CACHE_TTL"
+    )
+    STORAGE_CACHE_WRITE_BEHIND: bool = Field(
+        default=False,
+        description="Hold the storage writes of a request until it ends, repeated writes of a key only send "
+        "the last value",
+    )
+    STORAGE_CACHE_FLUSH_TIMEOUT: float = Field(
+        default=10,
+        description="Seconds the storage writes held back by write-behind may take to be sent once a request ended, "
+        "they are sent even if the request was cancelled or outlived its deadline",
+    )
+
+    HTTP_POOL_MAX_CONNECTIONS: int = Field(
+        default=1000,
+        description="Maximum connections of the http client shared by backwards invocations and file transfers",
+    )
+    HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS: int = Field(
+        default=100, description="Maximum idle connections kept alive by the shared http client"
+    )
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = Field(
+        default=5, description="Seconds an idle connection of the shared http client is kept alive"
+    )
+    FILE_CACHE_SIZE: int = Field(
+        default=0,
+        description="Bytes of downloaded file contents cached by URL and shared by all sessions, 0 disables "
+        "the cache and the prefetching of files",
+    )
+    FILE_SPOOL_THRESHOLD: int = Field(
+        default=8 * 1024 * 1024,
+        description="File contents above this many bytes are downloaded to a temporary file by `File.open` "
+        "and are neither cached nor prefetched",
+    )
+    FILE_PREFETCH: bool = Field(
+        default=False,
+        description="Download the files of a list parameter concurrently into the file cache before the tool runs, "
+        "as far as they fit in the cache",
+    )
+    HTTP2: bool = Field(
+        default=False,
+        description="Use HTTP/2 for backwards invocations and file transfers where the server supports it, "
+        "requires the `h2` package",
+    )
+
     model_config = SettingsConfigDict(
         # read from dotenv format config file
         env_file=".env",
@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -35,6 +36,24 @@ class InitializeMessage(BaseModel):
 
     class Key(BaseModel):
         key: str
+        # framings supported by the plugin in order of preference, omitted for newline delimited json only
+        framings: Optional[list[str]] = None
+        # identifies the stream across reconnections, only sent when resuming is enabled
+        stream_id: Optional[str] = None
+        # number of frames received from the daemon on this stream
+        received: Optional[int] = None
+        # index of the connection and number of connections, only sent when the plugin opens several
+        shard: Optional[int] = None
+        shards: Optional[int] = None
+
+    class HandshakeAck(BaseModel):
+        framing: str = "json"
+        # whether binary data may be sent as blob frames instead of hex or base64 strings
+        blob_frames: bool = False
+        # whether the daemon resumed the stream, sessions and declarations are kept in that case
+        resumed: bool = False
+        # number of frames of the stream the daemon received, the plugin replays the rest
+        received: int = 0
 
     type: Type
     data: dict | list
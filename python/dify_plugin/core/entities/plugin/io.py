@@ -1,5 +1,8 @@
 from enum import Enum
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Optional, Self
+
+from pydantic import BaseModel
+from pydantic_core import to_json
 
 if TYPE_CHECKING:
     from dify_plugin.core.server.__base.request_reader import RequestReader
@@ -10,6 +13,8 @@ from dify_plugin.core.server.__base.response_writer import ResponseWriter
 class PluginInStreamEvent(Enum):
     Request = "request"
     BackwardInvocationResponse = "backwards_response"
+    # the daemon abandoned the session
+    Cancel = "cancel"
 
     @classmethod
     def value_of(cls, v: str):
@@ -19,6 +24,28 @@ class PluginInStreamEvent(Enum):
         raise ValueError(f"Invalid value for PluginInStream.Event: {v}")
 
 
+class _InStreamDataHeader(BaseModel):
+    backwards_request_id: Optional[str] = None
+
+
+class _InStreamHeader(BaseModel):
+    """
+    Routing fields of an inbound line, the rest of `data` is skipped without creating python objects
+    """
+
+    session_id: str
+    event: str
+    conversation_id: Optional[str] = None
+    message_id: Optional[str] = None
+    app_id: Optional[str] = None
+    endpoint_id: Optional[str] = None
+    data: Optional[_InStreamDataHeader]
+
+
+class _InStreamData(BaseModel):
+    data: Any
+
+
 class PluginInStreamBase:
     def __init__(
         self,
@@ -32,11 +59,79 @@ class PluginInStreamBase:
     ) -> None:
         self.session_id = session_id
         self.event = event
-        self.data = data
         self.conversation_id = conversation_id
         self.message_id = message_id
         self.app_id = app_id
         self.endpoint_id = endpoint_id
+        self._data = data
+        # raw json line, `data` is decoded from it on first access
+        self._raw: Optional[bytes | str] = None
+        self._backwards_request_id: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, line: bytes | str, **kwargs: Any) -> Self:
+        """
+        Build a stream from a json line, only the routing fields are decoded eagerly
+
+        :param line: json encoded line
+        :param kwargs: extra arguments of the constructor
+        """
+        header = _InStreamHeader.model_validate_json(line)
+        stream = cls(
+            session_id=header.session_id,
+            event=PluginInStreamEvent.value_of(header.event),
+            data={},
+            conversation_id=header.conversation_id,
+            message_id=header.message_id,
+            app_id=header.app_id,
+            endpoint_id=header.endpoint_id,
+            **kwargs,
+        )
+        stream._raw = line
+        stream._backwards_request_id = header.data.backwards_request_id if header.data else None
+        return stream
+
+    @property
+    def data(self) -> dict:
+        if self._raw is not None:
+            self._data = _InStreamData.model_validate_json(self._raw).data
+            self._raw = None
+        return self._data
+
+    @data.setter
+    def data(self, data: dict) -> None:
+        self._data = data
+        self._raw = None
+
+    def to_json(self) -> bytes:
+        """
+        Encode the stream as a json line, the raw line is reused if `data` was never decoded
+        """
+        if self._raw is not None:
+            return self._raw.encode() if isinstance(self._raw, str) else self._raw
+
+        return to_json(
+            {
+                "session_id": self.session_id,
+                "event": self.event.value,
+                "conversation_id": self.conversation_id,
+                "message_id": self.message_id,
+                "app_id": self.app_id,
+                "endpoint_id": self.endpoint_id,
+                "data": self._data,
+            }
+        )
+
+    @property
+    def backwards_request_id(self) -> Optional[str]:
+        """
+        Id of the backwards invocation this line responds to, available without decoding `data`
+        """
+        if self._raw is not None:
+            return self._backwards_request_id
+        if isinstance(self._data, dict):
+            return self._data.get("backwards_request_id")
+        return None
 
 
 class PluginInStream(PluginInStreamBase):
@@ -221,11 +221,11 @@ class PluginExecutor:
                 data.user_id,
             )
             if isinstance(b, bytes | bytearray | memoryview):
-                yield {"result": binascii.hexlify(b).decode()}
+                yield session.writer.binary_field("result", b, session.session_id)
                 return
 
             for chunk in b:
-                yield {"result": binascii.hexlify(chunk).decode()}
+                yield session.writer.binary_field("result", chunk, session.session_id)
         else:
             raise ValueError(f"Model `{data.model_type}` not found for provider `{data.provider}`")
 
@@ -303,9 +303,9 @@ class PluginExecutor:
 
             for chunk in response.response:
                 if isinstance(chunk, bytes | bytearray | memoryview):
-                    yield {"result": binascii.hexlify(chunk).decode()}
+                    yield session.writer.binary_field("result", chunk, session.session_id)
                 else:
-                    yield {"result": binascii.hexlify(chunk.encode("utf-8")).decode()}
+                    yield session.writer.binary_field("result", chunk.encode("utf-8"), session.session_id)
         else:
             result = {
                 "status": response.status_code,
@@ -313,16 +313,16 @@ class PluginExecutor:
             }
 
             if isinstance(response.response, bytes | bytearray | memoryview):
-                result["result"] = binascii.hexlify(response.response).decode()
+                result.update(session.writer.binary_field("result", response.response, session.session_id))
             elif isinstance(response.response, str):
-                result["result"] = binascii.hexlify(response.response.encode("utf-8")).decode()
+                body = response.response.encode("utf-8")
+                result.update(session.writer.binary_field("result", body, session.session_id))
             elif isinstance(response.response, Iterable):
-                result["result"] = ""
-                for chunk in response.response:
-                    if isinstance(chunk, bytes | bytearray | memoryview):
-                        result["result"] += binascii.hexlify(chunk).decode()
-                    else:
-                        result["result"] += binascii.hexlify(chunk.encode("utf-8")).decode()
+                body = b"".join(
+                    chunk if isinstance(chunk, bytes | bytearray | memoryview) else chunk.encode("utf-8")
+                    for chunk in response.response
+                )
+                result.update(session.writer.binary_field("result", body, session.session_id))
 
             yield result
 
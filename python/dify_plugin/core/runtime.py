@@ -1,29 +1,37 @@
+import threading
 import uuid
 from abc import ABC
-from collections.abc import Generator, Mapping
+from collections.abc import Generator, Iterable, Mapping, Sequence
 from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Any, Generic, Optional, TypeVar, Union
+from queue import Queue
+from typing import TYPE_CHECKING, Generic, Optional, TypeVar, Union
 
-import httpx
-from pydantic import BaseModel, TypeAdapter
+from pydantic import BaseModel
 from yarl import URL
 
 from dify_plugin.config.config import InstallMethod
 from dify_plugin.core.entities.invocation import InvokeType
-from dify_plugin.core.entities.plugin.io import (
-    PluginInStream,
-    PluginInStreamBase,
-    PluginInStreamEvent,
-)
+from dify_plugin.core.entities.plugin.io import PluginInStreamBase
 from dify_plugin.core.server.__base.request_reader import RequestReader
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
 from dify_plugin.core.server.tcp.request_reader import TCPReaderWriter
+from dify_plugin.core.utils.cancellation import CancellationToken, cancellable, use_cancellation_token
+from dify_plugin.core.utils.http_client import get_http_client
+
+if TYPE_CHECKING:
+    from dify_plugin.invocations.file import File
+    from dify_plugin.invocations.storage import StorageInvocation
+    from dify_plugin.invocations.storage_cache import StorageCache
+    from dify_plugin.invocations.tool import ToolInvocation
 
 #################################################
 # Session
 #################################################
 
+# seconds a backwards invocation waits for its next response by default
+DEFAULT_BACKWARDS_INVOCATION_TIMEOUT = 250.0
+
 
 class ModelInvocations:
     def __init__(self, session: "Session") -> None:
@@ -73,6 +81,36 @@ class WorkflowNodeInvocations:
 
 
 class Session:
+    """
+    Context of a request.
+
+    A session is created for every request, the invocation facades (`model`, `tool`, `app`,
+    `workflow_node`, `storage` and `file`) are only created once the plugin uses them.
+    """
+
+    __slots__ = (
+        "_app",
+        "_executor",
+        "_file",
+        "_model",
+        "_storage",
+        "_tool",
+        "_workflow_node",
+        "app_id",
+        "backwards_invocation_timeout",
+        "backwards_invocation_timeouts",
+        "cancellation",
+        "conversation_id",
+        "dify_plugin_daemon_url",
+        "endpoint_id",
+        "install_method",
+        "message_id",
+        "reader",
+        "session_id",
+        "storage_cache",
+        "writer",
+    )
+
     def __init__(
         self,
         session_id: str,
@@ -85,6 +123,10 @@ class Session:
         message_id: Optional[str] = None,
         app_id: Optional[str] = None,
         endpoint_id: Optional[str] = None,
+        cancellation: Optional[CancellationToken] = None,
+        backwards_invocation_timeout: float = DEFAULT_BACKWARDS_INVOCATION_TIMEOUT,
+        backwards_invocation_timeouts: Optional[Mapping[str, float]] = None,
+        storage_cache: Optional["StorageCache"] = None,
     ) -> None:
         # current session id
         self.session_id: str = session_id
@@ -114,20 +156,109 @@ class Session:
         # dify plugin daemon url
         self.dify_plugin_daemon_url: Optional[str] = dify_plugin_daemon_url
 
-        # register invocations
-        self._register_invocations()
+        # cancelled when the daemon abandons the session
+        self.cancellation: CancellationToken = cancellation or CancellationToken()
 
-    def _register_invocations(self) -> None:
-        from dify_plugin.invocations.file import File
-        from dify_plugin.invocations.storage import StorageInvocation
-        from dify_plugin.invocations.tool import ToolInvocation
+        # seconds a backwards invocation waits for its next response, overridden per invoke type
+        self.backwards_invocation_timeout: float = backwards_invocation_timeout
+        self.backwards_invocation_timeouts: Mapping[str, float] = backwards_invocation_timeouts or {}
 
-        self.model = ModelInvocations(self)
-        self.tool = ToolInvocation(self)
-        self.app = AppInvocations(self)
-        self.workflow_node = WorkflowNodeInvocations(self)
-        self.storage = StorageInvocation(self)
-        self.file = File(self)
+        # cache in front of the storage of this session, None if disabled
+        self.storage_cache: Optional[StorageCache] = storage_cache
+
+        # invocations, created on first use
+        self._model: Optional[ModelInvocations] = None
+        self._tool: Optional[ToolInvocation] = None
+        self._app: Optional[AppInvocations] = None
+        self._workflow_node: Optional[WorkflowNodeInvocations] = None
+        self._storage: Optional[StorageInvocation] = None
+        self._file: Optional[File] = None
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        Send the writes held back by the invocations of the session, called once the session ends
+
+        :param timeout: seconds the writes may take, they run under a token of their own so they
+            still reach the daemon once the session was cancelled or outlived its deadline
+        """
+        if self._storage is None:
+            return
+
+        token = CancellationToken() if timeout is None else CancellationToken.with_timeout(timeout)
+        cancellation, self.cancellation = self.cancellation, token
+        try:
+            with use_cancellation_token(token):
+                self._storage.flush()
+        finally:
+            self.cancellation = cancellation
+            token.release()
+
+    def inactivity_timeout(self, type: InvokeType) -> Optional[float]:  # noqa: A002
+        """
+        Seconds a backwards invocation of type waits for its next response, None to wait until the deadline
+        """
+        timeout = self.backwards_invocation_timeouts.get(type.value, self.backwards_invocation_timeout)
+        return timeout if timeout > 0 else None
+
+    def batch_invoke(
+        self,
+        requests: Sequence[tuple[InvokeType, dict]],
+        ordered: bool = True,
+    ) -> Generator["BackwardsInvocationResult[dict]", None, None]:
+        """
+        Send several backwards invocations at once and wait for all of them concurrently
+
+        :param requests: invoke type and request data of every invocation
+        :param ordered: yield the results in the order of the requests, otherwise as they complete
+        """
+        return BackwardsInvocation[dict](self)._backwards_invoke_batch(requests, dict, ordered)
+
+    @property
+    def model(self) -> ModelInvocations:
+        if self._model is None:
+            self._model = ModelInvocations(self)
+        return self._model
+
+    @property
+    def tool(self) -> "ToolInvocation":
+        if self._tool is None:
+            from dify_plugin.invocations.tool import ToolInvocation
+
+            self._tool = ToolInvocation(self)
+        return self._tool
+
+    @property
+    def app(self) -> AppInvocations:
+        if self._app is None:
+            self._app = AppInvocations(self)
+        return self._app
+
+    @property
+    def workflow_node(self) -> WorkflowNodeInvocations:
+        if self._workflow_node is None:
+            self._workflow_node = WorkflowNodeInvocations(self)
+        return self._workflow_node
+
+    @property
+    def storage(self) -> "StorageInvocation":
+        if self._storage is None:
+            if self.storage_cache is not None:
+                from dify_plugin.invocations.storage_cache import CachedStorageInvocation
+
+                self._storage = CachedStorageInvocation(self, self.storage_cache)
+            else:
+                from dify_plugin.invocations.storage import StorageInvocation
+
+                self._storage = StorageInvocation(self)
+        return self._storage
+
+    @property
+    def file(self) -> "File":
+        if self._file is None:
+            from dify_plugin.invocations.file import File
+
+            self._file = File(self)
+        return self._file
 
     @classmethod
     def empty_session(cls) -> "Session":
@@ -161,6 +292,26 @@ class BackwardsInvocationResponseEvent(BaseModel):
 T = TypeVar("T", bound=Union[BaseModel, dict, str])
 
 
+class BackwardsInvocationResult(Generic[T]):
+    """
+    Outcome of one backwards invocation of a batch
+    """
+
+    def __init__(self, index: int) -> None:
+        # position of the invocation in the batch
+        self.index = index
+        self.responses: list[T] = []
+        self.error: Optional[Exception] = None
+
+    def result(self) -> list[T]:
+        """
+        Responses of the invocation, raises its error if it failed
+        """
+        if self.error is not None:
+            raise self.error
+        return self.responses
+
+
 class BackwardsInvocation(Generic[T], ABC):
     def __init__(
         self,
@@ -184,10 +335,73 @@ class BackwardsInvocation(Generic[T], ABC):
 
         if not self.session:
             raise Exception("current tool runtime does not support backwards invoke")
+        data = self._encode_binary_fields(data)
         if self.session.install_method in [InstallMethod.Local, InstallMethod.Remote]:
             return self._full_duplex_backwards_invoke(backwards_request_id, type, data_type, data)
         return self._http_backwards_invoke(backwards_request_id, type, data_type, data)
 
+    def _backwards_invoke_batch(
+        self,
+        requests: Sequence[tuple[InvokeType, dict]],
+        data_type: type[T],
+        ordered: bool = True,
+    ) -> Generator[BackwardsInvocationResult[T], None, None]:
+        """
+        backwards invoke several requests at once, the failure of one request does not fail the others
+        """
+        if not self.session:
+            raise Exception("current tool runtime does not support backwards invoke")
+
+        requests = [(invoke_type, self._encode_binary_fields(data)) for invoke_type, data in requests]
+        if self.session.install_method in [InstallMethod.Local, InstallMethod.Remote]:
+            results = self._full_duplex_backwards_invoke_batch(requests, data_type)
+        else:
+            results = self._http_backwards_invoke_batch(requests, data_type)
+
+        if not ordered:
+            yield from results
+            return
+
+        # hold back results which complete before the ones preceding them
+        completed: dict[int, BackwardsInvocationResult[T]] = {}
+        next_index = 0
+        for result in results:
+            completed[result.index] = result
+            while next_index in completed:
+                yield completed.pop(next_index)
+                next_index += 1
+
+    def _encode_binary_fields(self, data: dict) -> dict:
+        """
+        encode top-level binary values of a request, see `ResponseWriter.binary_field`
+        """
+        if not self.session or not any(isinstance(v, bytes | bytearray | memoryview) for v in data.values()):
+            return data
+
+        encoded = {}
+        for key, value in data.items():
+            if isinstance(value, bytes | bytearray | memoryview):
+                encoded.update(self.session.writer.binary_field(key, value, self.session.session_id))
+            else:
+                encoded[key] = value
+        return encoded
+
+    def _resolve_blob_fields(self, data: dict) -> dict:
+        """
+        replace top-level `<name>_blob_id` fields of a response with `<name>_blob`,
+        the data of the referenced blob frame
+        """
+        if not self.session or not any(key.endswith("_blob_id") for key in data):
+            return data
+
+        resolved = {}
+        for key, value in data.items():
+            if key.endswith("_blob_id") and isinstance(value, str):
+                resolved[f"{key.removesuffix('_blob_id')}_blob"] = self.session.reader.take_blob(value)
+            else:
+                resolved[key] = value
+        return resolved
+
     def _line_converter_wrapper(
         self,
         generator: Generator[PluginInStreamBase | None, None, None],
@@ -196,18 +410,12 @@ class BackwardsInvocation(Generic[T], ABC):
         """
         convert string into type T
         """
-        empty_response_count = 0
+        cancellation = self.session.cancellation if self.session else CancellationToken()
 
-        for chunk in generator:
-            """
-            accept response from input stream and wait for at most 60 seconds
-            """
+        for chunk in cancellable(generator, token=cancellation):
             if chunk is None:
-                empty_response_count += 1
-                # if no response for 250 seconds, break
-                if empty_response_count >= 250:
-                    raise Exception("invocation exited without response")
-                continue
+                # the reader yields None once the inactivity timeout passed without a response
+                raise Exception("invocation exited without response")
 
             event = BackwardsInvocationResponseEvent(**chunk.data)
             if event.event == BackwardsInvocationResponseEvent.Event.End:
@@ -219,11 +427,13 @@ class BackwardsInvocation(Generic[T], ABC):
             if event.data is None:
                 break
 
-            empty_response_count = 0
-            try:
-                yield data_type(**event.data)
-            except Exception as e:
-                raise Exception(f"Failed to parse response: {e!s}") from e
+            yield self._parse_response(event.data, data_type)
+
+    def _parse_response(self, data: dict, data_type: type[T]) -> T:
+        try:
+            return data_type(**self._resolve_blob_fields(data))
+        except Exception as e:
+            raise Exception(f"Failed to parse response: {e!s}") from e
 
     def _http_backwards_invoke(
         self,
@@ -255,19 +465,16 @@ class BackwardsInvocation(Generic[T], ABC):
         )
 
         with (
-            httpx.Client() as client,
-            client.stream(
+            # the pooled client reuses the connection to the daemon across backwards invocations
+            get_http_client().stream(
                 method="POST",
                 url=str(url),
                 headers=headers,
                 content=payload,
-                timeout=(
-                    300,
-                    300,
-                    300,
-                    300,
-                ),  # 300 seconds for connection, read, write, and pool
+                # 300 seconds for connection, read, write, and pool, at most until the deadline of the session
+                timeout=self.session.cancellation.timeout((300, 300, 300, 300)),
             ) as response,
+            self.session.cancellation.on_cancel(response.close),
         ):
 
             def generator():
@@ -275,12 +482,7 @@ class BackwardsInvocation(Generic[T], ABC):
                     if not line:
                         continue
 
-                    data = TypeAdapter(dict[str, Any]).validate_json(line)
-                    yield PluginInStreamBase(
-                        session_id=data["session_id"],
-                        event=PluginInStreamEvent.value_of(data["event"]),
-                        data=data["data"],
-                    )
+                    yield PluginInStreamBase.from_json(line)
 
             yield from self._line_converter_wrapper(generator(), data_type)
 
@@ -305,11 +507,115 @@ class BackwardsInvocation(Generic[T], ABC):
             ),
         )
 
-        def filter(data: PluginInStream) -> bool:  # noqa: A001
-            return (
-                data.event == PluginInStreamEvent.BackwardInvocationResponse
-                and data.data.get("backwards_request_id") == backwards_request_id
+        # the wait for the next response only wakes up when it arrives, when the inactivity timeout
+        # passes or when the session is cancelled, its deadline included, which closes the reader
+        timeout = self.session.inactivity_timeout(type)
+        with (
+            self.session.reader.read(key=RequestReader.backwards_response_key(backwards_request_id)) as reader,
+            self.session.cancellation.on_cancel(reader.close),
+        ):
+            yield from self._line_converter_wrapper(reader.read(timeout_for_round=timeout), data_type)
+
+    def _full_duplex_backwards_invoke_batch(
+        self,
+        requests: Sequence[tuple[InvokeType, dict]],
+        data_type: type[T],
+    ) -> Iterable[BackwardsInvocationResult[T]]:
+        """
+        write all invocations with a single write and read their responses from a single reader,
+        results are yielded as they complete
+        """
+        if not self.session:
+            raise Exception("current tool runtime does not support backwards invoke")
+
+        backwards_request_ids = [self._generate_backwards_request_id() for _ in requests]
+        indexes = {backwards_request_id: index for index, backwards_request_id in enumerate(backwards_request_ids)}
+        results: list[BackwardsInvocationResult[T]] = [
+            BackwardsInvocationResult(index) for index in range(len(requests))
+        ]
+        pending = set(range(len(requests)))
+        if not pending:
+            return
+
+        timeouts = [self.session.inactivity_timeout(invoke_type) for invoke_type, _ in requests]
+        timeout = None if None in timeouts else max(t for t in timeouts if t is not None)
+
+        # the reader is registered before the invocations are sent, no response can be missed
+        with (
+            self.session.reader.read(
+                keys=[RequestReader.backwards_response_key(id_) for id_ in backwards_request_ids]
+            ) as reader,
+            self.session.cancellation.on_cancel(reader.close),
+        ):
+            self.session.writer.session_messages(
+                self.session.session_id,
+                [
+                    self.session.writer.stream_invoke_object(
+                        data={
+                            "type": invoke_type.value,
+                            "backwards_request_id": backwards_request_id,
+                            "request": data,
+                        }
+                    )
+                    for backwards_request_id, (invoke_type, data) in zip(backwards_request_ids, requests, strict=True)
+                ],
             )
 
-        with self.session.reader.read(filter) as reader:
-            yield from self._line_converter_wrapper(reader.read(timeout_for_round=1), data_type)
+            for chunk in cancellable(reader.read(timeout_for_round=timeout), token=self.session.cancellation):
+                if chunk is None:
+                    raise Exception("invocation exited without response")
+
+                index = indexes.get(chunk.backwards_request_id or "")
+                if index is None or index not in pending:
+                    continue
+
+                result = results[index]
+                event = BackwardsInvocationResponseEvent(**chunk.data)
+                if event.event == BackwardsInvocationResponseEvent.Event.Error:
+                    result.error = Exception(event.message)
+                elif event.event != BackwardsInvocationResponseEvent.Event.End and event.data is not None:
+                    try:
+                        result.responses.append(self._parse_response(event.data, data_type))
+                    except Exception as e:
+                        result.error = e
+                    else:
+                        continue
+
+                pending.discard(index)
+                yield result
+                if not pending:
+                    return
+
+    def _http_backwards_invoke_batch(
+        self,
+        requests: Sequence[tuple[InvokeType, dict]],
+        data_type: type[T],
+    ) -> Iterable[BackwardsInvocationResult[T]]:
+        """
+        send every invocation as a concurrent transaction over the pooled client,
+        results are yielded as they complete
+        """
+        results: list[BackwardsInvocationResult[T]] = [
+            BackwardsInvocationResult(index) for index in range(len(requests))
+        ]
+        completed: Queue[int] = Queue()
+
+        def invoke(result: BackwardsInvocationResult[T], invoke_type: InvokeType, data: dict):
+            try:
+                result.responses = list(
+                    self._http_backwards_invoke(self._generate_backwards_request_id(), invoke_type, data_type, data)
+                )
+            except Exception as e:
+                result.error = e
+            finally:
+                completed.put(result.index)
+
+        for result, (invoke_type, data) in zip(results, requests, strict=True):
+            threading.Thread(target=invoke, args=(result, invoke_type, data), daemon=True).start()
+
+        for _ in results:
+            index = completed.get()
+            # a cancellation closes the transactions, which fail the pending invocations
+            if self.session:
+                self.session.cancellation.raise_if_cancelled()
+            yield results[index]
@@ -2,8 +2,10 @@ import logging
 import threading
 import time
 from abc import ABC, abstractmethod
-from collections.abc import Callable, Generator
-from typing import TYPE_CHECKING
+from collections.abc import Callable, Generator, Hashable, Sequence
+from typing import TYPE_CHECKING, Optional
+
+from dify_plugin.core.entities.plugin.io import PluginInStreamEvent
 
 if TYPE_CHECKING:
     from dify_plugin.core.entities.plugin.io import PluginInStream
@@ -19,7 +21,10 @@ class RequestReader(ABC):
     def __init__(self):
         # Convert class variables to instance variables to avoid global lock contention
         self.lock = threading.Lock()
-        self.readers = []
+        # readers which need to run a predicate against every line, used as a fallback
+        self.readers: list[FilterReader] = []
+        # readers indexed by routing key, a line is dispatched to them with a single lookup
+        self.keyed_readers: dict[Hashable, list[FilterReader]] = {}
 
     @abstractmethod
     def _read_stream(self) -> Generator["PluginInStream", None, None]:
@@ -28,6 +33,45 @@ class RequestReader(ABC):
         """
         raise NotImplementedError
 
+    @staticmethod
+    def request_key() -> Hashable:
+        """
+        Routing key of all `Request` events
+        """
+        return (PluginInStreamEvent.Request, None)
+
+    @staticmethod
+    def backwards_response_key(backwards_request_id: str) -> Hashable:
+        """
+        Routing key of the `BackwardInvocationResponse` events of a backwards invocation
+        """
+        return (PluginInStreamEvent.BackwardInvocationResponse, backwards_request_id)
+
+    @staticmethod
+    def cancel_key() -> Hashable:
+        """
+        Routing key of all `Cancel` events
+        """
+        return (PluginInStreamEvent.Cancel, None)
+
+    @classmethod
+    def routing_key(cls, data: "PluginInStream") -> Optional[Hashable]:
+        """
+        Compute the routing key of a line, None if the line can only be matched by predicates
+        """
+        if data.event == PluginInStreamEvent.Request:
+            return cls.request_key()
+
+        if data.event == PluginInStreamEvent.Cancel:
+            return cls.cancel_key()
+
+        if data.event == PluginInStreamEvent.BackwardInvocationResponse:
+            backwards_request_id = data.backwards_request_id
+            if backwards_request_id is not None:
+                return cls.backwards_response_key(backwards_request_id)
+
+        return None
+
     def event_loop(self):
         # read line by line
         while True:
@@ -41,18 +85,20 @@ class RequestReader(ABC):
     def _process_line(self, data: "PluginInStream"):
         try:
             session_id = data.session_id
-            readers_to_process = []
+            key = self.routing_key(data)
 
-            # Acquire lock to safely access readers list
+            # Acquire lock to safely access the routing table
             self.lock.acquire()
             try:
-                # Safely copy the reader list under lock protection
-                readers_to_process = self.readers.copy()
+                keyed_readers = self.keyed_readers.get(key) if key is not None else None
+                # copy the matched slot only, it is usually a single reader
+                keyed_readers = keyed_readers.copy() if keyed_readers else []
+                readers_to_process = self.readers.copy() if self.readers else []
             finally:
                 self.lock.release()
 
-            # Execute filter operations outside of lock
-            matched_readers = []
+            # Execute fallback filter operations outside of lock
+            matched_readers = keyed_readers
             for reader in readers_to_process:
                 try:
                     result = reader.filter(data)
@@ -74,25 +120,59 @@ class RequestReader(ABC):
                 data={"error": f"Failed to process request ({type(e).__name__}): {e!s}"},
             )
 
-    def read(self, filter: Callable[["PluginInStream"], bool]) -> FilterReader:  # noqa: A002
+    def read(
+        self,
+        filter: Optional[Callable[["PluginInStream"], bool]] = None,  # noqa: A002
+        key: Optional[Hashable] = None,
+        keys: Optional[Sequence[Hashable]] = None,
+    ) -> FilterReader:
+        """
+        Register a reader, lines are routed to it by `key` or `keys` when given, otherwise by `filter`
+
+        :param filter: predicate evaluated against every line, cannot be combined with keys
+        :param key: routing key, see `request_key` and `backwards_response_key`
+        :param keys: routing keys, lines matching any of them are routed to the reader
+        """
+        # a key registered twice would route its lines twice to the reader
+        routing_keys = list(dict.fromkeys([*(keys or []), *([] if key is None else [key])]))
+        if not routing_keys and filter is None:
+            raise ValueError("either filter or key must be provided")
+        if routing_keys and filter is not None:
+            raise ValueError("filter cannot be combined with key or keys")
+
         def close(reader: FilterReader):
             self.lock.acquire()
             try:
-                if reader in self.readers:
+                for routing_key in routing_keys:
+                    slot = self.keyed_readers.get(routing_key)
+                    if slot and reader in slot:
+                        slot.remove(reader)
+                        if not slot:
+                            del self.keyed_readers[routing_key]
+                if not routing_keys and reader in self.readers:
                     self.readers.remove(reader)
             finally:
                 self.lock.release()
 
-        reader = FilterReader(filter, close_callback=lambda: close(reader))
+        reader = FilterReader(filter or (lambda _: True), close_callback=lambda: close(reader))
 
         self.lock.acquire()
         try:
-            self.readers.append(reader)
+            for routing_key in routing_keys:
+                self.keyed_readers.setdefault(routing_key, []).append(reader)
+            if not routing_keys:
+                self.readers.append(reader)
         finally:
             self.lock.release()
 
         return reader
 
+    def take_blob(self, blob_id: str) -> bytes:
+        """
+        Take the data of a blob frame received from the daemon, a blob can only be taken once
+        """
+        raise ValueError("blob frames are not supported by this reader")
+
     def close(self):
         """
         close stdin processing
@@ -102,7 +182,12 @@ class RequestReader(ABC):
         self.lock.acquire()
         try:
             readers_to_close = self.readers.copy()
+            for slot in self.keyed_readers.values():
+                readers_to_close.extend(slot)
+            # a reader registered under several keys is closed once
+            readers_to_close = list(dict.fromkeys(readers_to_close))
             self.readers.clear()
+            self.keyed_readers.clear()
         finally:
             self.lock.release()
 
@@ -1,11 +1,20 @@
+import binascii
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
 from typing import Optional
 
 from pydantic import BaseModel
+from pydantic_core import to_json
 
 from dify_plugin.core.entities.message import SessionMessage
 from dify_plugin.core.server.__base.writer_entities import Event, StreamOutputMessage
 
+# envelope of a session stream message, identical to the output of
+# StreamOutputMessage(event=SESSION, data=SessionMessage(type=STREAM, ...)).model_dump_json()
+_SESSION_MESSAGE_PREFIX = '{"event":"session","session_id":'
+_STREAM_DATA_PREFIX = ',"data":{"type":"stream","data":'
+_STREAM_DATA_SUFFIX = "}}\n\n"
+
 
 class ResponseWriter(ABC):
     """
@@ -36,8 +45,50 @@ class ResponseWriter(ABC):
         if isinstance(data, BaseModel):
             data = data.model_dump()
 
-        self.write(StreamOutputMessage(event=event, session_id=session_id, data=data).model_dump_json())
-        self.write("\n\n")
+        self.write_message(StreamOutputMessage(event=event, session_id=session_id, data=data))
+
+    def write_message(self, message: BaseModel):
+        """
+        serialize a message and write it as a single frame
+        """
+        self.write(message.model_dump_json() + "\n\n")
+
+    def write_session_frame(self, session_id: Optional[str], data: str):
+        """
+        write a message of a session already serialized as a json frame, writers which schedule
+        sessions queue it with the other messages of the session
+        """
+        self.write(data)
+
+    def supports_blob_frames(self) -> bool:
+        """
+        whether binary data can be sent out of band with `write_blob`
+        """
+        return False
+
+    def write_blob(self, data: bytes, session_id: Optional[str] = None) -> str:
+        """
+        write raw bytes as a blob frame and return the blob id referencing it,
+        the blob must be written before any message referencing it
+
+        :param session_id: session the blob belongs to, its messages keep their order relative to the blob
+        """
+        raise ValueError("blob frames are not supported by this writer, check `supports_blob_frames` first")
+
+    def binary_field(
+        self,
+        name: str,
+        data: bytes | bytearray | memoryview,
+        session_id: Optional[str] = None,
+    ) -> dict:
+        """
+        encode binary data as a message field, `<name>_blob_id` referencing a blob frame
+        if supported, otherwise `<name>` with the hex encoded data
+        """
+        if self.supports_blob_frames():
+            return {f"{name}_blob_id": self.write_blob(bytes(data), session_id)}
+
+        return {name: binascii.hexlify(data).decode()}
 
     def error(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None):
         return self.put(Event.ERROR, session_id, data)
@@ -51,6 +102,25 @@ class ResponseWriter(ABC):
     def session_message(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None):
         return self.put(Event.SESSION, session_id, data)
 
+    def session_messages(self, session_id: Optional[str], data: Sequence[dict | BaseModel]):
+        """
+        equivalent to calling `session_message` for every item, the messages are written with a single write
+        """
+        return self.write("".join(self.session_message_text(session_id, item) for item in data))
+
+    def session_stream(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None):
+        """
+        equivalent to `session_message(session_id, stream_object(data))`,
+        the payload is serialized to json in a single pass without intermediate dicts
+        """
+        return self.write(self.session_stream_text(session_id, data))
+
+    def session_stream_text(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None) -> str:
+        payload = data.model_dump_json() if isinstance(data, BaseModel) else to_json(data).decode()
+        return "".join(
+            (_SESSION_MESSAGE_PREFIX, to_json(session_id).decode(), _STREAM_DATA_PREFIX, payload, _STREAM_DATA_SUFFIX)
+        )
+
     def session_message_text(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None) -> str:
         if isinstance(data, BaseModel):
             data = data.model_dump()
@@ -1,19 +1,25 @@
 import contextlib
+import json
 import logging
 import os
 import time
 from abc import ABC, abstractmethod
 from concurrent.futures import ThreadPoolExecutor
-from threading import Thread
+from threading import Lock, Thread
 from typing import Optional
 
 from dify_plugin.config.config import DifyPluginEnv
-from dify_plugin.core.entities.plugin.io import PluginInStream, PluginInStreamEvent
+from dify_plugin.core.entities.plugin.io import PluginInStream
 from dify_plugin.core.server.__base.request_reader import RequestReader
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.core.server.scheduler import RequestRejectedError, RequestScheduler
+from dify_plugin.core.server.serverless.prefork import PreforkSupervisor
 from dify_plugin.core.server.serverless.request_reader import ServerlessRequestReader
 from dify_plugin.core.server.stdio.request_reader import StdioRequestReader
 from dify_plugin.core.server.tcp.request_reader import TCPReaderWriter
+from dify_plugin.core.server.tcp.sharded import ShardedTCPReaderWriter
+from dify_plugin.core.server.worker.supervisor import WorkerSupervisor
+from dify_plugin.core.utils.cancellation import CancellationToken
 from dify_plugin.errors.model import InvokeError
 
 logger = logging.getLogger(__name__)
@@ -31,7 +37,11 @@ class IOServer(ABC):
         self.config = config
         self.default_writer = default_writer
         self.executer = ThreadPoolExecutor(max_workers=self.config.MAX_WORKER)
+        self.scheduler = RequestScheduler(self.executer, self.config.MAX_WORKER, self.config.REQUEST_CLASSES)
         self.request_reader = request_reader
+        # cancellation tokens of the admitted sessions
+        self.cancellation_tokens: dict[str, CancellationToken] = {}
+        self.cancellation_lock = Lock()
 
     def close(self, *args):
         self.request_reader.close()
@@ -47,6 +57,7 @@ class IOServer(ABC):
         message_id: Optional[str] = None,
         app_id: Optional[str] = None,
         endpoint_id: Optional[str] = None,
+        cancellation: Optional[CancellationToken] = None,
     ):
         """
         accept requests and execute them, should be implemented outside
@@ -57,11 +68,20 @@ class IOServer(ABC):
         start listen to stdin and dispatch task to executor
         """
 
-        def filter(data: PluginInStream) -> bool:  # noqa: A001
-            return data.event == PluginInStreamEvent.Request
+        for data in self.request_reader.read(key=RequestReader.request_key()).read():
+            self._dispatch_request(data)
 
-        for data in self.request_reader.read(filter).read():
-            self.executer.submit(
+    def _dispatch_request(self, data: PluginInStream):
+        """
+        Admit a request into the scheduler, or reject it
+        """
+        # the deadline of a request runs from its arrival, time spent queued included
+        cancellation = CancellationToken.with_timeout(self.config.MAX_REQUEST_TIMEOUT)
+        with self.cancellation_lock:
+            self.cancellation_tokens[data.session_id] = cancellation
+        try:
+            self.scheduler.submit(
+                data.data,
                 self._execute_request_in_thread,
                 data.session_id,
                 data.data,
@@ -71,7 +91,41 @@ class IOServer(ABC):
                 data.message_id,
                 data.app_id,
                 data.endpoint_id,
+                cancellation,
             )
+        except RequestRejectedError as e:
+            cancellation.release()
+            with self.cancellation_lock:
+                self.cancellation_tokens.pop(data.session_id, None)
+            self._reject_request(data.session_id, data.writer, e)
+
+    def _setup_cancellation_listener(self):
+        """
+        cancel sessions abandoned by the daemon
+        """
+        for data in self.request_reader.read(key=RequestReader.cancel_key()).read():
+            with self.cancellation_lock:
+                cancellation = self.cancellation_tokens.get(data.session_id)
+            if cancellation is not None:
+                logger.info(f"Cancelling session {data.session_id}")
+                cancellation.cancel()
+
+    def _reject_request(self, session_id: str, writer: ResponseWriter, error: RequestRejectedError):
+        """
+        End a session which was not admitted
+        """
+        writer.session_message(
+            session_id=session_id,
+            data=writer.stream_error_object(
+                data={
+                    "error_type": type(error).__name__,
+                    "message": str(error),
+                    "args": {"request_class": error.request_class, "queue_size": error.queue_size},
+                }
+            ),
+        )
+        writer.session_message(session_id=session_id, data=writer.stream_end_object())
+        writer.done()
 
     def _execute_request_in_thread(
         self,
@@ -83,6 +137,7 @@ class IOServer(ABC):
         message_id: Optional[str] = None,
         app_id: Optional[str] = None,
         endpoint_id: Optional[str] = None,
+        cancellation: Optional[CancellationToken] = None,
     ):
         """
         wrapper for _execute_request
@@ -98,13 +153,14 @@ class IOServer(ABC):
                 message_id,
                 app_id,
                 endpoint_id,
+                cancellation,
             )
         except Exception as e:
             args = {}
             if isinstance(e, InvokeError):
                 args["description"] = e.description
 
-            if isinstance(reader, (TCPReaderWriter, ServerlessRequestReader)):
+            if isinstance(reader, (TCPReaderWriter, ShardedTCPReaderWriter, ServerlessRequestReader)):
                 logger.exception(
                     "Unexpected error occurred when executing request",
                     exc_info=e,
@@ -121,6 +177,12 @@ class IOServer(ABC):
                 ),
             )
 
+        finally:
+            if cancellation is not None:
+                cancellation.release()
+            with self.cancellation_lock:
+                self.cancellation_tokens.pop(session_id, None)
+
         writer.session_message(session_id=session_id, data=writer.stream_end_object())
         writer.done()
 
@@ -136,6 +198,23 @@ class IOServer(ABC):
                 self.default_writer.heartbeat()
             time.sleep(self.config.HEARTBEAT_INTERVAL)
 
+    def _report_scheduler_stats(self):
+        """
+        log the load of the scheduler and the stats of its request classes periodically
+        """
+        assert self.default_writer
+
+        while True:
+            time.sleep(self.config.SCHEDULER_STATS_INTERVAL)
+            stats = {
+                "load": self.scheduler.load().model_dump(),
+                "classes": {name: stats.model_dump() for name, stats in self.scheduler.stats().items()},
+            }
+            with contextlib.suppress(Exception):
+                self.default_writer.log(
+                    {"level": "INFO", "message": f"scheduler stats: {json.dumps(stats)}", "timestamp": time.time()}
+                )
+
     def _parent_alive_check(self):
         """
         check if the parent process is alive
@@ -148,17 +227,39 @@ class IOServer(ABC):
 
     def _run(self):
         th1 = Thread(target=self._setup_instruction_listener)
+        cancellation_listener = Thread(target=self._setup_cancellation_listener)
+        if isinstance(self.request_reader, ServerlessRequestReader):
+            if self.config.WORKER_PROCESSES > 1:
+                logger.warning("Worker processes are not used by the serverless runtime, see SERVERLESS_WORKERS")
+            # requests are submitted by the connection serving them, without a trip through the event loop
+            self.request_reader.set_dispatcher(self._dispatch_request)
+            self.request_reader.set_load_reporter(self.scheduler.load)
+            if self.request_reader.workers > 1:
+                self.request_reader.bind_for_workers()
+                # returns in the forked workers only, each runs its own server, executor and scheduler
+                PreforkSupervisor(self.request_reader.workers, self.request_reader.graceful_timeout).run()
+            self.request_reader.launch()
+        elif self.config.WORKER_PROCESSES > 1 and self.config.WORKER_ID is None:
+            # requests are executed by worker processes, this process only owns the connection
+            supervisor = WorkerSupervisor(self.request_reader, self.default_writer, self.config.WORKER_PROCESSES)
+            th1 = Thread(target=supervisor.run)
+            # cancellations are forwarded to the workers
+            cancellation_listener = None
         th2 = Thread(target=self.request_reader.event_loop)
         th3 = None
 
         if self.default_writer:
             th3 = Thread(target=self._heartbeat)
+            if self.config.SCHEDULER_STATS_INTERVAL > 0:
+                Thread(target=self._report_scheduler_stats, daemon=True).start()
 
         if isinstance(self.request_reader, StdioRequestReader):
             Thread(target=self._parent_alive_check).start()
 
         th1.start()
         th2.start()
+        if cancellation_listener is not None:
+            cancellation_listener.start()
 
         if th3 is not None:
             th3.start()
@@ -3,6 +3,8 @@ import logging
 from collections.abc import Callable
 from typing import Any, Optional
 
+from pydantic import TypeAdapter
+
 from dify_plugin.core.runtime import Session
 from dify_plugin.core.server.__base.request_reader import RequestReader
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
@@ -20,60 +22,77 @@ class Route:
 
 
 class Router:
+    """
+    Dispatch requests to their handlers.
+
+    Routes registered with an invoke type and an action are looked up in a table keyed by
+    `(type, action)`, routes registered with a filter are tried in registration order when
+    no entry of the table matches.
+    """
+
     routes: list[Route]
+    table: dict[tuple[str, str], Callable[[Session, dict], Any]]
     request_reader: RequestReader
 
     def __init__(self, request_reader: RequestReader, response_writer: Optional[ResponseWriter]) -> None:
         self.routes = []
+        self.table = {}
         self.request_reader = request_reader
         self.response_writer = response_writer
 
-    def register_route(self, f: Callable, filter: Callable[[dict], bool], instance: Any = None):  # noqa: A002
+    def register_route(
+        self,
+        f: Callable,
+        filter: Optional[Callable[[dict], bool]] = None,  # noqa: A002
+        instance: Any = None,
+        *,
+        invoke_type: Optional[str] = None,
+        action: Optional[str] = None,
+    ):
+        """
+        Register a handler for the requests matching filter, or the requests of an invoke type and action
+
+        The request data is validated against the annotation of the request parameter of f once
+        the route matched, a validation error fails the session.
+        """
+        handler = self._build_handler(f, instance)
+        if invoke_type is not None and action is not None:
+            key = (str(invoke_type), str(action))
+            if key in self.table:
+                raise ValueError(f"Route for type `{key[0]}` and action `{key[1]}` is already registered")
+            self.table[key] = handler
+        elif filter is not None:
+            self.routes.append(Route(filter, handler))
+        else:
+            raise ValueError("Route requires either a filter or an invoke type and an action")
+
+    def _build_handler(self, f: Callable, instance: Any) -> Callable[[Session, dict], Any]:
         sig = inspect.signature(f)
         parameters = list(sig.parameters.values())
-        if len(parameters) == 0:
-            raise ValueError("Route function must have at least one parameter")
+        # the request follows the session, and the instance if f is unbound
+        index = 2 if instance else 1
+        if len(parameters) <= index:
+            raise ValueError("Route function must accept a session and a request")
+
+        # compile the validator of the request once instead of on every request
+        validate = TypeAdapter(parameters[index].annotation).validate_python
 
         if instance:
-            # get first parameter of func
-            parameter = parameters[2]
-            # get annotation of the first parameter
-            annotation = parameter.annotation
-
-            def wrapper(session: Session, data: dict):
-                try:
-                    data = annotation(**data)
-                except TypeError as e:
-                    if not self.response_writer:
-                        logger.exception("failed to route request: %s")
-                    else:
-                        self.response_writer.error(
-                            session_id=session.session_id,
-                            data={"error": str(e), "error_type": type(e).__name__},
-                        )
-                return f(instance, session, data)
+
+            def handler(session: Session, data: dict):
+                return f(instance, session, validate(data))
         else:
-            # get first parameter of func
-            parameter = parameters[1]
-            # get annotation of the first parameter
-            annotation = parameter.annotation
-
-            def wrapper(session: Session, data: dict):
-                try:
-                    data = annotation(**data)
-                except TypeError as e:
-                    if not self.response_writer:
-                        logger.exception("failed to route request: %s")
-                    else:
-                        self.response_writer.error(
-                            session_id=session.session_id,
-                            data={"error": str(e), "error_type": type(e).__name__},
-                        )
-                return f(session, data)
-
-        self.routes.append(Route(filter, wrapper))
+
+            def handler(session: Session, data: dict):
+                return f(session, validate(data))
+
+        return handler
 
     def dispatch(self, session: Session, data: dict) -> Any:
+        handler = self.table.get((data.get("type"), data.get("action")))  # type: ignore[arg-type]
+        if handler is not None:
+            return handler(session, data)
+
         for route in self.routes:
             if route.filter(data):
                 return route.func(session, data)
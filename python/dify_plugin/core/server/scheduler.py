@@ -0,0 +1,260 @@
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Mapping
+from concurrent.futures import Executor
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from dify_plugin.config.config import RequestClassConfig
+from dify_plugin.core.entities.plugin.request import (
+    AgentActions,
+    EndpointActions,
+    ModelActions,
+    OAuthActions,
+    PluginInvokeType,
+    ToolActions,
+)
+
+logger = logging.getLogger(__name__)
+
+# cheap requests, a user usually waits for them in a form
+CONTROL = "control"
+# long running requests streaming to a user
+INTERACTIVE = "interactive"
+# everything else, tool calls and batch model invocations
+BULK = "bulk"
+
+# seconds of history behind the recent wait and latency of `RequestScheduler.load`
+LOAD_WINDOW = 60
+
+# keyed by invoke type and action, like the routes of the router
+_REQUEST_CLASSES: dict[tuple[str, str], str] = {
+    (PluginInvokeType.Tool, ToolActions.ValidateCredentials): CONTROL,
+    (PluginInvokeType.Tool, ToolActions.GetToolRuntimeParameters): CONTROL,
+    (PluginInvokeType.Model, ModelActions.ValidateProviderCredentials): CONTROL,
+    (PluginInvokeType.Model, ModelActions.ValidateModelCredentials): CONTROL,
+    (PluginInvokeType.Model, ModelActions.GetLLMNumTokens): CONTROL,
+    (PluginInvokeType.Model, ModelActions.GetTextEmbeddingNumTokens): CONTROL,
+    (PluginInvokeType.Model, ModelActions.GetTTSVoices): CONTROL,
+    (PluginInvokeType.Model, ModelActions.GetAIModelSchemas): CONTROL,
+    (PluginInvokeType.OAuth, OAuthActions.GetAuthorizationUrl): CONTROL,
+    (PluginInvokeType.OAuth, OAuthActions.GetCredentials): CONTROL,
+    (PluginInvokeType.Model, ModelActions.InvokeLLM): INTERACTIVE,
+    (PluginInvokeType.Agent, AgentActions.InvokeAgentStrategy): INTERACTIVE,
+    (PluginInvokeType.Endpoint, EndpointActions.InvokeEndpoint): INTERACTIVE,
+}
+
+
+def classify_request(data: Mapping[str, Any]) -> str:
+    """
+    Request class of a request, by its invoke type and action
+    """
+    return _REQUEST_CLASSES.get((data.get("type") or "", data.get("action") or ""), BULK)
+
+
+def default_request_classes(max_worker: int) -> dict[str, RequestClassConfig]:
+    """
+    Default request classes, bulk requests may only use three quarters of the workers
+    """
+    return {
+        CONTROL: RequestClassConfig(weight=8),
+        INTERACTIVE: RequestClassConfig(weight=4),
+        BULK: RequestClassConfig(weight=1, max_concurrency=max(1, max_worker * 3 // 4)),
+    }
+
+
+class RequestRejectedError(Exception):
+    """
+    Raised when the queue of a request class is full
+    """
+
+    def __init__(self, request_class: str, queue_size: int) -> None:
+        super().__init__(f"too many pending `{request_class}` requests ({queue_size}), retry later")
+        self.request_class = request_class
+        self.queue_size = queue_size
+
+
+class RequestClassStats(BaseModel):
+    queued: int
+    running: int
+    submitted: int
+    rejected: int
+    # seconds between submission and start
+    average_wait: float
+    max_wait: float
+
+
+class SchedulerLoad(BaseModel):
+    running: int
+    queued: int
+    max_concurrency: int
+    # fraction of max_concurrency in use
+    occupancy: float
+    # average seconds the requests started recently waited in the queue
+    recent_wait: float
+    # average seconds the requests finished recently took from submission to completion
+    recent_latency: float
+
+
+class _RecentValues:
+    """
+    Values recorded in the last `window` seconds, an idle scheduler forgets its past load
+    """
+
+    def __init__(self, window: float, max_size: int = 1024) -> None:
+        self.window = window
+        # (time recorded, value)
+        self.values: deque[tuple[float, float]] = deque(maxlen=max_size)
+
+    def add(self, value: float):
+        self.values.append((time.monotonic(), value))
+
+    def average(self) -> float:
+        expired = time.monotonic() - self.window
+        while self.values and self.values[0][0] < expired:
+            self.values.popleft()
+        if not self.values:
+            return 0.0
+        return sum(value for _, value in self.values) / len(self.values)
+
+
+class _RequestClass:
+    def __init__(self, name: str, config: RequestClassConfig, max_concurrency: int) -> None:
+        self.name = name
+        self.weight = config.weight
+        self.max_concurrency = min(config.max_concurrency or max_concurrency, max_concurrency)
+        self.max_queue = config.max_queue
+        # (finish tag, submission time, function, arguments)
+        self.queue: deque[tuple[float, float, Callable, tuple]] = deque()
+        self.last_finish = 0.0
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class RequestScheduler:
+    """
+    Admission control and weighted fair queuing in front of the executor.
+
+    Requests are classified by `classify`, every class has a bounded queue and a concurrency
+    cap, at most `max_concurrency` requests run at a time. Free slots are given to queued
+    requests in weighted fair order: a class with weight 4 starts four requests for every
+    request of a class with weight 1 while both have requests waiting.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        max_concurrency: int,
+        classes: Optional[dict[str, RequestClassConfig]] = None,
+        classify: Callable[[Mapping[str, Any]], str] = classify_request,
+    ) -> None:
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.classify = classify
+        self.classes = {
+            name: _RequestClass(name, config, max_concurrency)
+            for name, config in {**default_request_classes(max_concurrency), **(classes or {})}.items()
+        }
+        self.running = 0
+        self.virtual_time = 0.0
+        self.recent_waits = _RecentValues(LOAD_WINDOW)
+        self.recent_latencies = _RecentValues(LOAD_WINDOW)
+        self.lock = threading.Lock()
+
+    def submit(self, data: Mapping[str, Any], fn: Callable, *args: Any):
+        """
+        Schedule fn(*args) for the request data
+
+        :raises RequestRejectedError: if the queue of the request class is full
+        """
+        request_class = self.classes.get(self.classify(data)) or self.classes[BULK]
+        with self.lock:
+            request_class.submitted += 1
+            can_start = (
+                not request_class.queue
+                and self.running < self.max_concurrency
+                and request_class.running < request_class.max_concurrency
+            )
+            if len(request_class.queue) >= request_class.max_queue and not can_start:
+                request_class.rejected += 1
+                raise RequestRejectedError(request_class.name, len(request_class.queue))
+
+            start = max(self.virtual_time, request_class.last_finish)
+            request_class.last_finish = start + 1 / request_class.weight
+            request_class.queue.append((request_class.last_finish, time.monotonic(), fn, args))
+            self._dispatch()
+
+    def _dispatch(self):
+        """
+        Start queued requests while there are free slots, the caller holds the lock
+        """
+        while self.running < self.max_concurrency:
+            candidate: Optional[_RequestClass] = None
+            for request_class in self.classes.values():
+                if not request_class.queue or request_class.running >= request_class.max_concurrency:
+                    continue
+                if candidate is None or request_class.queue[0][0] < candidate.queue[0][0]:
+                    candidate = request_class
+            if candidate is None:
+                return
+
+            finish, submitted_at, fn, args = candidate.queue.popleft()
+            self.virtual_time = max(self.virtual_time, finish - 1 / candidate.weight)
+            wait = time.monotonic() - submitted_at
+            candidate.started += 1
+            candidate.total_wait += wait
+            candidate.max_wait = max(candidate.max_wait, wait)
+            self.recent_waits.add(wait)
+            candidate.running += 1
+            self.running += 1
+            self.executor.submit(self._run, candidate, fn, args, submitted_at)
+
+    def _run(self, request_class: _RequestClass, fn: Callable, args: tuple, submitted_at: float):
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"Unexpected error in a `{request_class.name}` request")
+        finally:
+            with self.lock:
+                self.recent_latencies.add(time.monotonic() - submitted_at)
+                request_class.running -= 1
+                self.running -= 1
+                self._dispatch()
+
+    def stats(self) -> dict[str, RequestClassStats]:
+        """
+        Queue depth, concurrency and wait time of every request class
+        """
+        with self.lock:
+            return {
+                name: RequestClassStats(
+                    queued=len(request_class.queue),
+                    running=request_class.running,
+                    submitted=request_class.submitted,
+                    rejected=request_class.rejected,
+                    average_wait=request_class.total_wait / request_class.started if request_class.started else 0,
+                    max_wait=request_class.max_wait,
+                )
+                for name, request_class in self.classes.items()
+            }
+
+    def load(self) -> SchedulerLoad:
+        """
+        Current occupancy and queue depth, and the wait and latency of the recent requests
+        """
+        with self.lock:
+            return SchedulerLoad(
+                running=self.running,
+                queued=sum(len(request_class.queue) for request_class in self.classes.values()),
+                max_concurrency=self.max_concurrency,
+                occupancy=self.running / self.max_concurrency,
+                recent_wait=self.recent_waits.average(),
+                recent_latency=self.recent_latencies.average(),
+            )
@@ -0,0 +1,134 @@
+import contextlib
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# seconds between two checks of the workers
+_POLL_INTERVAL = 0.2
+
+
+class PreforkSupervisor:
+    """
+    Fork serverless worker processes and keep them running.
+
+    Every worker serves the HTTP endpoints on its own listening socket bound with SO_REUSEPORT,
+    the kernel spreads the incoming connections across them. The supervisor does not serve
+    requests, it restarts workers which exited and forwards signals:
+
+    - SIGTERM / SIGINT: the workers stop accepting connections and drain their in-flight
+      requests, the ones still running after `graceful_timeout` seconds are killed
+    - SIGHUP: every worker is replaced by a new one, the old ones drain
+    """
+
+    def __init__(self, workers: int, graceful_timeout: float) -> None:
+        """
+        :param workers: number of worker processes
+        :param graceful_timeout: seconds a worker may take to drain its requests
+        """
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+
+        self.worker_count = workers
+        self.graceful_timeout = graceful_timeout
+        # index -> pid of the worker
+        self.workers: dict[int, int] = {}
+        # pid -> deadline of the workers asked to stop
+        self.stopping: dict[int, float] = {}
+        self._shutdown = False
+        self._reload = False
+
+    def run(self) -> Optional[int]:
+        """
+        Fork the workers and supervise them.
+
+        Returns the index of the worker in the forked processes, the supervisor itself exits
+        once its workers stopped.
+        """
+        signal.signal(signal.SIGTERM, self._on_shutdown)
+        signal.signal(signal.SIGINT, self._on_shutdown)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        for index in range(self.worker_count):
+            if self._spawn(index):
+                return index
+
+        while self.workers or self.stopping:
+            time.sleep(_POLL_INTERVAL)
+
+            if self._shutdown:
+                self._shutdown = False
+                for pid in self.workers.values():
+                    self._stop(pid)
+                self.workers.clear()
+
+            if self._reload:
+                self._reload = False
+                for index, pid in list(self.workers.items()):
+                    # the new worker accepts connections before the old one stops accepting them
+                    if self._spawn(index):
+                        return index
+                    self._stop(pid)
+
+            for pid, deadline in list(self.stopping.items()):
+                if self._reap(pid):
+                    del self.stopping[pid]
+                elif time.monotonic() > deadline:
+                    logger.warning(f"Worker {pid} did not drain in time, killing it")
+                    os.kill(pid, signal.SIGKILL)
+                    self.stopping[pid] = float("inf")
+
+            for index, pid in list(self.workers.items()):
+                if self._reap(pid):
+                    logger.warning(f"Worker {index}, pid {pid} exited, restarting it")
+                    if self._spawn(index):
+                        return index
+
+        os._exit(0)
+
+    def _spawn(self, index: int) -> bool:
+        """
+        Fork a worker, returns True in the worker
+        """
+        pid = os.fork()
+        if pid == 0:
+            self.workers.clear()
+            self.stopping.clear()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            # ctrl-c reaches the whole process group, the workers wait for the supervisor to stop them
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            threading.Thread(target=self._watch_supervisor, args=(os.getppid(),), daemon=True).start()
+            return True
+
+        self.workers[index] = pid
+        logger.info(f"Started serverless worker {index}, pid {pid}")
+        return False
+
+    def _stop(self, pid: int):
+        self.stopping[pid] = time.monotonic() + self.graceful_timeout
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGTERM)
+
+    def _reap(self, pid: int) -> bool:
+        try:
+            reaped, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            return True
+        return reaped == pid
+
+    def _watch_supervisor(self, supervisor_pid: int):
+        # a worker drains once its supervisor is gone, nothing would restart it or stop it otherwise
+        while os.getppid() == supervisor_pid:
+            time.sleep(1)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def _on_shutdown(self, signum, frame):
+        self._shutdown = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
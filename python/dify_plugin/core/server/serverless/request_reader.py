@@ -1,31 +1,65 @@
+import os
+import signal
+import socket
 import threading
-import time
-from collections.abc import Generator
+from collections.abc import Callable, Generator
+from concurrent.futures import ThreadPoolExecutor
 from queue import Empty, Queue
+from typing import Any, Optional
 
-from flask import Flask, request
+from flask import Flask, jsonify, request
+from pydantic import BaseModel
+from werkzeug.serving import BaseWSGIServer
 
 from dify_plugin.core.entities.plugin.io import (
     PluginInStream,
     PluginInStreamEvent,
 )
 from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.scheduler import SchedulerLoad
 from dify_plugin.core.server.serverless.response_writer import ServerlessResponseWriter
 
 
+class LoadThresholds(BaseModel):
+    """
+    Load above which an instance reports it is not ready, or sheds requests, 0 disables a threshold
+    """
+
+    # fraction of the executor running requests
+    max_occupancy: float = 0.9
+    # requests waiting for the executor
+    max_queued: int = 100
+    # average seconds the recent requests waited for the executor
+    max_wait: float = 5
+    # requests waiting for the executor above which `/invoke` answers 503
+    shed_queued: int = 1000
+    # seconds a client is asked to wait before retrying a shed request
+    retry_after: int = 1
+
+
 class ServerlessRequestReader(RequestReader):
     def __init__(
         self,
         host: str = "0.0.0.0",
         port: int = 8080,
         worker_class: str = "gevent",
-        workers: int = 5,
+        workers: int = 1,
         worker_connections: int = 1000,
         threads: int = 5,
         max_single_connection_lifetime: int = 300,
+        graceful_timeout: float = 30,
+        coalesce_bytes: int = 65536,
+        thresholds: Optional[LoadThresholds] = None,
     ):
         """
         Initialize the ServerlessStream and wait for jobs
+
+        :param workers: worker processes serving the port, see `PreforkSupervisor`
+        :param worker_connections: concurrent connections of a worker with the gevent worker class
+        :param threads: concurrent requests of a worker with any other worker class
+        :param graceful_timeout: seconds the in-flight requests may take to finish on SIGTERM
+        :param coalesce_bytes: output of a session merged into a single write at most, 0 to write every chunk
+        :param thresholds: load reported as not ready by `/ready` and shed by `/invoke`
         """
         super().__init__()
         self.app = Flask(__name__)
@@ -36,7 +70,21 @@ class ServerlessRequestReader(RequestReader):
         self.threads = threads
         self.worker_connections = worker_connections
         self.max_single_connection_lifetime = max_single_connection_lifetime
+        self.graceful_timeout = graceful_timeout
+        self.coalesce_bytes = coalesce_bytes
+        self.dispatch: Optional[Callable[[PluginInStream], None]] = None
+        self.thresholds = thresholds or LoadThresholds()
+        self.load: Optional[Callable[[], SchedulerLoad]] = None
+        # requests answered with 503
+        self.shed = 0
+        self.server: Optional[Any] = None
+        # bound before forking the workers, shared by all of them
+        self.listener: Optional[socket.socket] = None
+        self._sigterm = threading.Event()
         self.request_queue = Queue[PluginInStream]()
+        self.app.route("/invoke", methods=["POST"])(self.handler)
+        self.app.route("/health", methods=["GET"])(self.health)
+        self.app.route("/ready", methods=["GET"])(self.ready)
 
     def _read_stream(self) -> Generator[PluginInStream, None, None]:
         """
@@ -45,9 +93,30 @@ class ServerlessRequestReader(RequestReader):
         while True:
             yield self.request_queue.get()
 
+    def set_dispatcher(self, dispatch: Optional[Callable[[PluginInStream], None]]) -> None:
+        """
+        Hand requests to dispatch from the thread serving their connection, instead of queueing
+        them for `event_loop`
+        """
+        self.dispatch = dispatch
+
+    def set_load_reporter(self, load: Optional[Callable[[], SchedulerLoad]]) -> None:
+        """
+        Report the load of the instance from `/health` and `/ready`, and shed requests above the thresholds
+        """
+        self.load = load
+
     def handler(self):
+        shed_queued = self.thresholds.shed_queued
+        if self.load is not None and shed_queued > 0 and self.load().queued >= shed_queued:
+            self.shed += 1
+            response = jsonify({"error": "too many pending requests, retry later"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(self.thresholds.retry_after)
+            return response
+
         try:
-            queue = Queue[str]()
+            queue = Queue[Optional[str]]()
             data = request.get_json()
             event = PluginInStreamEvent.value_of(data["event"])
             plugin_in = PluginInStream(
@@ -61,56 +130,179 @@ class ServerlessRequestReader(RequestReader):
                 reader=self,
                 writer=ServerlessResponseWriter(queue),
             )
-            # put request to queue
-            self.request_queue.put(plugin_in)
+            if self.dispatch is not None:
+                self.dispatch(plugin_in)
+            else:
+                self.request_queue.put(plugin_in)
 
-            # wait for response
-            def generate():
-                refresh_time = time.time()
-                while True:
+            return self._stream(queue), 200
+        except Exception as e:
+            return str(e), 500
+
+    def _stream(self, queue: Queue[Optional[str]]) -> Generator[str, None, None]:
+        """
+        Yield the output of a session as it is written, the connection is closed once the session
+        wrote nothing for `max_single_connection_lifetime` seconds
+        """
+        while True:
+            try:
+                chunk = queue.get(timeout=self.max_single_connection_lifetime)
+            except Empty:
+                # reach max single connection lifetime
+                return
+
+            if chunk is None:
+                return
+
+            finished = False
+            if self.coalesce_bytes > 0:
+                # the chunks written meanwhile are sent with a single write, nothing waits for more
+                chunks = [chunk]
+                size = len(chunk)
+                while size < self.coalesce_bytes:
                     try:
-                        response = queue.get(timeout=1)
+                        chunk = queue.get_nowait()
                     except Empty:
-                        if time.time() - refresh_time > self.max_single_connection_lifetime:
-                            # reach max single connection lifetime
-                            break
-                        continue
-
-                    if response is None:
                         break
+                    if chunk is None:
+                        finished = True
+                        break
+                    chunks.append(chunk)
+                    size += len(chunk)
+                chunk = "".join(chunks)
 
-                    # refresh refresh_time
-                    refresh_time = time.time()
-                    yield response
-
-            return generate(), 200
-        except Exception as e:
-            return str(e), 500
+            yield chunk
+            if finished:
+                return
 
     def health(self):
-        return "OK", 200
+        if self.load is None:
+            return "OK", 200
+        return jsonify(self._load_report()), 200
 
-    def _run(self):
-        self.app.route("/invoke", methods=["POST"])(self.handler)
-        self.app.route("/health", methods=["GET"])(self.health)
+    def ready(self):
+        """
+        503 while the load is above a threshold, load balancers and autoscalers route around the instance
+        """
+        report = self._load_report()
+        return jsonify(report), 200 if report["ready"] else 503
+
+    def _load_report(self) -> dict:
+        if self.load is None:
+            return {"ready": True, "reasons": []}
+
+        load = self.load()
+        thresholds = self.thresholds
+        reasons = []
+        if 0 < thresholds.max_occupancy <= load.occupancy:
+            reasons.append(f"occupancy {load.occupancy:.2f} reached {thresholds.max_occupancy}")
+        if 0 < thresholds.max_queued <= load.queued:
+            reasons.append(f"{load.queued} queued requests reached {thresholds.max_queued}")
+        if 0 < thresholds.max_wait <= load.recent_wait:
+            reasons.append(f"recent wait {load.recent_wait:.3f}s reached {thresholds.max_wait}s")
+
+        return {
+            "ready": not reasons,
+            "reasons": reasons,
+            "pid": os.getpid(),
+            "shed": self.shed,
+            **load.model_dump(),
+        }
 
-        import socket
+    def bind_for_workers(self):
+        """
+        Called before forking the workers, without SO_REUSEPORT the workers cannot bind the port each
+        and accept the connections of a socket bound once and inherited instead
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            self.listener = self.listen()
 
+    def listen(self) -> socket.socket:
+        """
+        Bind the listening socket, several processes may bind the same port and share its connections
+        """
+        if self.listener is not None:
+            return self.listener
+
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # responses are written in several sends, Nagle's algorithm would hold all but the first
+        # one until the client acknowledges it, which delayed acks postpone by 40ms
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(socket.SOMAXCONN)
+        return sock
+
+    def _run(self):
         import gevent.socket
 
-        if socket.socket is gevent.socket.socket:
+        listener = self.listen()
+        if socket.socket is gevent.socket.socket and self.worker_class == "gevent":
             from gevent.pywsgi import WSGIServer
 
-            server = WSGIServer((self.host, self.port), self.app)
-            print("* Serving Flask app 'dify_plugin.core.server.serverless.request_reader'")
-            print(f"* Running on http://{self.host}:{self.port} (Press CTRL+C to quit)")
-            print("* Server Worker: gevent.wsgi.WSGIServer", flush=True)
-            server.serve_forever()
+            self.server = WSGIServer(listener, self.app, spawn=self.worker_connections)
+            server_worker = "gevent.wsgi.WSGIServer"
         else:
-            self.app.run(host=self.host, port=self.port, threaded=True)
+            self.server = _PooledWSGIServer(self.host, self.port, self.app, self.threads, listener)
+            server_worker = f"werkzeug, {self.threads} threads"
+
+        print("* Serving Flask app 'dify_plugin.core.server.serverless.request_reader'")
+        print(f"* Running on http://{self.host}:{self.port} (Press CTRL+C to quit)")
+        print(f"* Server Worker: {server_worker}, pid {os.getpid()}", flush=True)
+        self.server.serve_forever()
+
+    def shutdown(self, timeout: float) -> None:
+        """
+        Stop accepting connections and wait up to timeout seconds for the in-flight requests
+        """
+        server = self.server
+        if server is None:
+            return
+        if isinstance(server, _PooledWSGIServer):
+            server.shutdown()
+            server.server_close()
+            server.pool.shutdown(wait=True)
+        else:
+            server.stop(timeout=timeout)
+
+    def _drain_on_sigterm(self):
+        self._sigterm.wait()
+        self.shutdown(self.graceful_timeout)
+        os._exit(0)
+
+    def _on_sigterm(self, signum, frame):
+        # signal handlers may run in the event loop, where nothing may block
+        self._sigterm.set()
 
     def launch(self):
         """
-        Launch server
+        Launch server, SIGTERM drains it and exits when called from the main thread
         """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._on_sigterm)
+            threading.Thread(target=self._drain_on_sigterm, daemon=True).start()
         threading.Thread(target=self._run).start()
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug server handling requests with a fixed number of threads
+    """
+
+    def __init__(self, host: str, port: int, app, threads: int, listener: socket.socket) -> None:
+        super().__init__(host, port, app, fd=listener.fileno())
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
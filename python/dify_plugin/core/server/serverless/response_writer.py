@@ -1,4 +1,5 @@
 from queue import Queue
+from typing import Optional
 
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
 
@@ -8,10 +9,10 @@ class ServerlessResponseWriter(ResponseWriter):
     Writer for a single plugin request
     """
 
-    def __init__(self, queue: Queue) -> None:
+    def __init__(self, queue: Queue[Optional[str]]) -> None:
         self.q = queue
 
-    def write(self, data: bytes) -> None:
+    def write(self, data: str) -> None:
         self.q.put(data)
 
     def done(self):
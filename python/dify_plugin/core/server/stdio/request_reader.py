@@ -1,21 +1,20 @@
 import sys
 from collections.abc import Generator
-from typing import Any
+from typing import Optional
 
 from gevent.os import tp_read
-from pydantic import TypeAdapter
 
-from dify_plugin.core.entities.plugin.io import (
-    PluginInStream,
-    PluginInStreamEvent,
-)
+from dify_plugin.core.entities.plugin.io import PluginInStream
 from dify_plugin.core.server.__base.request_reader import RequestReader
 from dify_plugin.core.server.stdio.response_writer import StdioResponseWriter
+from dify_plugin.core.utils.line_framer import LineFramer
 
 
 class StdioRequestReader(RequestReader):
-    def __init__(self):
+    def __init__(self, writer: Optional[StdioResponseWriter] = None):
         super().__init__()
+        # a single writer is shared by all sessions so that their frames are never interleaved
+        self.writer = writer or StdioResponseWriter()
 
     def _read_async(self) -> bytes:
         # read data from stdin using tp_read in 64KB chunks.
@@ -23,40 +22,19 @@ class StdioRequestReader(RequestReader):
         return tp_read(sys.stdin.fileno(), 65536)
 
     def _read_stream(self) -> Generator[PluginInStream, None, None]:
-        buffer = b""
+        framer = LineFramer()
         while True:
             data = self._read_async()
             if not data:
                 continue
 
-            buffer += data
-
-            # if no b"\n" is in data, skip to the next iteration
-            if data.find(b"\n") == -1:
-                continue
-
-            # process line by line and keep the last line if it is not complete
-            lines = buffer.split(b"\n")
-            buffer = lines[-1]
-
-            lines = lines[:-1]
-            for line in lines:
+            # process line by line, the incomplete last line is kept by the framer
+            for line in framer.feed(data):
                 line = line.strip()
                 if not line:
                     continue
 
                 try:
-                    data = TypeAdapter(dict[str, Any]).validate_json(line)
-                    yield PluginInStream(
-                        session_id=data["session_id"],
-                        conversation_id=data.get("conversation_id"),
-                        message_id=data.get("message_id"),
-                        app_id=data.get("app_id"),
-                        endpoint_id=data.get("endpoint_id"),
-                        event=PluginInStreamEvent.value_of(data["event"]),
-                        data=data["data"],
-                        reader=self,
-                        writer=StdioResponseWriter(),
-                    )
+                    yield PluginInStream.from_json(line, reader=self, writer=self.writer)
                 except Exception as e:
-                    StdioResponseWriter().error(data={"error": str(e)})
+                    self.writer.error(data={"error": str(e)})
@@ -1,12 +1,85 @@
+import os
 import sys
+import threading
+import time
 
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
 
+# maximum number of buffers accepted by a single writev call
+_IOV_MAX = 1024
+
 
 class StdioResponseWriter(ResponseWriter):
+    """
+    Writer shared by all sessions of the stdio transport.
+
+    Every frame is written with a single call, frames written while another flush is in progress
+    are coalesced into the next `writev`. With a positive `flush_interval`, frames are additionally
+    held for up to that many seconds, or until `flush_size` bytes are pending.
+    """
+
+    def __init__(self, flush_interval: float = 0, flush_size: int = 65536) -> None:
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # protects the pending frames
+        self._lock = threading.Lock()
+        # only one flush writes to stdout at a time
+        self._flush_lock = threading.Lock()
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+        self._wakeup = threading.Event()
+        self._flusher: threading.Thread | None = None
+
     def write(self, data: str):
-        sys.stdout.write(data)
-        sys.stdout.flush()
+        frame = data.encode()
+        with self._lock:
+            self._pending.append(frame)
+            self._pending_size += len(frame)
+            if self.flush_interval > 0 and self._pending_size < self.flush_size:
+                self._ensure_flusher()
+                self._wakeup.set()
+                return
+
+        self.flush()
+
+    def flush(self):
+        """
+        Write all pending frames to stdout
+        """
+        with self._flush_lock:
+            with self._lock:
+                frames, self._pending = self._pending, []
+                self._pending_size = 0
+
+            if frames:
+                self._writev(frames)
 
     def done(self):
         pass
+
+    def _writev(self, frames: list[bytes]):
+        # anything printed through sys.stdout must reach the daemon before our frames
+        sys.stdout.flush()
+        fd = sys.stdout.fileno()
+        start = 0
+        while start < len(frames):
+            written = os.writev(fd, frames[start : start + _IOV_MAX])
+            # skip fully written frames and keep the unwritten part of a partially written one
+            while start < len(frames) and written >= len(frames[start]):
+                written -= len(frames[start])
+                start += 1
+            if written:
+                frames[start] = frames[start][written:]
+
+    def _ensure_flusher(self):
+        # called with self._lock held
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
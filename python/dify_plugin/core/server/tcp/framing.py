@@ -0,0 +1,114 @@
+import struct
+from enum import IntEnum
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:  # msgpack is an optional dependency, only needed by the msgpack framing
+    msgpack = None
+
+
+class FrameKind(IntEnum):
+    MESSAGE = 1
+    # raw bytes referenced by a message through their blob id
+    BLOB = 2
+
+
+# every frame starts with its kind and the length of its payload
+FRAME_HEADER = struct.Struct(">BI")
+
+# blob frames start with the ascii hex id of the blob
+BLOB_ID_LENGTH = 32
+
+
+def is_msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def encode_frame(kind: FrameKind, payload: bytes) -> bytes:
+    """
+    Prefix a payload with the frame header
+    """
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def pack_message(message: dict) -> bytes:
+    """
+    Encode a message as a length-prefixed msgpack frame
+    """
+    if msgpack is None:
+        raise RuntimeError("msgpack framing requires the `msgpack` package")
+
+    return encode_frame(FrameKind.MESSAGE, msgpack.packb(message, use_bin_type=True))
+
+
+def pack_blob(blob_id: str, data: bytes) -> bytes:
+    """
+    Encode raw bytes as a blob frame
+    """
+    encoded_id = blob_id.encode()
+    if len(encoded_id) != BLOB_ID_LENGTH:
+        raise ValueError(f"blob id must be {BLOB_ID_LENGTH} bytes long")
+
+    return FRAME_HEADER.pack(FrameKind.BLOB, BLOB_ID_LENGTH + len(data)) + encoded_id + data
+
+
+def unpack_blob(payload: bytes) -> tuple[str, bytes]:
+    """
+    Decode the payload of a blob frame into its id and data
+    """
+    if len(payload) < BLOB_ID_LENGTH:
+        raise ValueError("blob frame is too short")
+
+    return payload[:BLOB_ID_LENGTH].decode(), payload[BLOB_ID_LENGTH:]
+
+
+def unpack_message(payload: bytes) -> dict[str, Any]:
+    """
+    Decode the payload of a message frame
+    """
+    if msgpack is None:
+        raise RuntimeError("msgpack framing requires the `msgpack` package")
+
+    message = msgpack.unpackb(payload, raw=False)
+    if not isinstance(message, dict):
+        raise ValueError(f"unexpected message type: {type(message).__name__}")
+
+    return message
+
+
+class LengthPrefixedFramer:
+    """
+    Incremental decoder for length-prefixed frames.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[tuple[FrameKind, bytes]]:
+        """
+        Append data and return the frames it completed
+
+        :param data: bytes read from the stream
+        :return: (kind, payload) of completed frames, in order
+        """
+        buffer = self._buffer
+        buffer += data
+
+        frames: list[tuple[FrameKind, bytes]] = []
+        start = 0
+        with memoryview(buffer) as view:
+            while len(buffer) - start >= FRAME_HEADER.size:
+                kind, length = FRAME_HEADER.unpack_from(buffer, start)
+                end = start + FRAME_HEADER.size + length
+                if len(buffer) < end:
+                    break
+
+                frames.append((FrameKind(kind), bytes(view[start + FRAME_HEADER.size : end])))
+                start = end
+
+        del buffer[:start]
+        return frames
+
+    def clear(self) -> None:
+        self._buffer.clear()
@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Optional
+
+from dify_plugin.core.utils.cancellation import CancellationToken
+
+# seconds a blocked producer waits before checking the cancellation of its session again
+_WAIT_SLICE = 1.0
+
+
+class OutboundPriority(IntEnum):
+    # heartbeats, errors, logs and declarations, never blocked by session data
+    CONTROL = 0
+    # session data, served round-robin per session
+    SESSION = 1
+
+
+class OutboundQueueClosedError(Exception):
+    """
+    Raised to the producers of a queue whose connection was given up
+    """
+
+
+class OutboundQueue:
+    """
+    Bounded queue of outbound frames drained by a single writer.
+
+    Control frames are always dequeued first and are never blocked. Session frames keep their
+    order within a session, sessions are served round-robin so that one large response does not
+    starve the others. Producers of session frames block while more than `max_pending_bytes`
+    are queued, which propagates backpressure to the plugin generators, until their session is
+    cancelled or reaches its deadline, or the queue is closed.
+    """
+
+    def __init__(self, max_pending_bytes: int = 16 * 1024 * 1024) -> None:
+        self.max_pending_bytes = max_pending_bytes
+        self._control: deque[bytes] = deque()
+        self._sessions: OrderedDict[Optional[str], deque[bytes]] = OrderedDict()
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+        # why the queue no longer accepts frames, None while it is open
+        self._closed: Optional[str] = None
+
+    def put(
+        self,
+        frame: bytes,
+        priority: OutboundPriority = OutboundPriority.SESSION,
+        session_id: Optional[str] = None,
+        token: Optional[CancellationToken] = None,
+    ) -> None:
+        """
+        Enqueue a frame, blocks session frames while the queue is full
+
+        :param token: token of the session producing the frame, a blocked producer raises once it is cancelled
+        :raises OutboundQueueClosedError: if the queue is closed
+        """
+        with self._condition:
+            self._raise_if_closed()
+            if priority == OutboundPriority.CONTROL:
+                self._control.append(frame)
+            else:
+                # a frame larger than the bound is accepted once the queue is drained
+                while self._pending_bytes and self._pending_bytes + len(frame) > self.max_pending_bytes:
+                    if token is None:
+                        self._condition.wait()
+                    else:
+                        # the token cancels itself once the deadline of the session passed
+                        token.raise_if_cancelled()
+                        remaining = token.remaining()
+                        self._condition.wait(_WAIT_SLICE if remaining is None else min(remaining, _WAIT_SLICE))
+                    self._raise_if_closed()
+                self._sessions.setdefault(session_id, deque()).append(frame)
+
+            self._pending_bytes += len(frame)
+            self._condition.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Dequeue the next frame to send, None if no frame arrived within timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._control or self._sessions, timeout):
+                return None
+
+            if self._control:
+                frame = self._control.popleft()
+            else:
+                session_id, frames = next(iter(self._sessions.items()))
+                frame = frames.popleft()
+                if frames:
+                    # let the other sessions go first
+                    self._sessions.move_to_end(session_id)
+                else:
+                    del self._sessions[session_id]
+
+            self._pending_bytes -= len(frame)
+            self._condition.notify_all()
+            return frame
+
+    def close(self, reason: str) -> None:
+        """
+        Stop accepting frames and fail the blocked producers, the queued frames are kept
+        """
+        with self._condition:
+            self._closed = reason
+            self._condition.notify_all()
+
+    def reopen(self) -> None:
+        with self._condition:
+            self._closed = None
+
+    def _raise_if_closed(self) -> None:
+        # the caller holds the condition
+        if self._closed is not None:
+            raise OutboundQueueClosedError(self._closed)
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._pending_bytes
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._control) + sum(len(frames) for frames in self._sessions.values())
+
+
+class ReplayBuffer:
+    """
+    Recently sent frames kept for replay after a resumed reconnection.
+
+    Frames are numbered implicitly from 0 in send order, the buffer keeps the most recent
+    frames up to `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._frames: deque[bytes] = deque()
+        self._bytes = 0
+        # sequence number of the oldest buffered frame
+        self._first_seq = 0
+        # sequence number of the next frame
+        self.next_seq = 0
+
+    def append(self, frame: bytes) -> int:
+        """
+        Record a frame and return its sequence number
+        """
+        seq = self.next_seq
+        self.next_seq += 1
+        self._frames.append(frame)
+        self._bytes += len(frame)
+        while self._bytes > self.max_bytes and len(self._frames) > 1:
+            self._bytes -= len(self._frames.popleft())
+            self._first_seq += 1
+        return seq
+
+    def frames_from(self, seq: int) -> Optional[list[bytes]]:
+        """
+        Frames with a sequence number of at least seq, None if some of them were already evicted
+        """
+        if seq < self._first_seq or seq > self.next_seq:
+            return None
+        return list(self._frames)[seq - self._first_seq :]
+
+    def reset(self) -> None:
+        self._frames.clear()
+        self._bytes = 0
+        self._first_seq = 0
+        self.next_seq = 0
@@ -1,18 +1,22 @@
+import contextlib
 import errno
 import logging
 import os
 import signal
 import socket as native_socket
+import threading
 import time
-from collections.abc import Callable, Generator
+import uuid
+from collections.abc import Callable, Generator, Sequence
 from threading import Lock
 from typing import Any, Optional
 
 from gevent import sleep
 from gevent import socket as gevent_socket
 from gevent.select import select
-from pydantic import TypeAdapter
+from pydantic import BaseModel, TypeAdapter
 
+from dify_plugin.config.config import RemoteFraming
 from dify_plugin.core.entities.message import InitializeMessage
 from dify_plugin.core.entities.plugin.io import (
     PluginInStream,
@@ -20,9 +24,24 @@ from dify_plugin.core.entities.plugin.io import (
 )
 from dify_plugin.core.server.__base.request_reader import RequestReader
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.core.server.__base.writer_entities import Event, StreamOutputMessage
+from dify_plugin.core.server.tcp.framing import (
+    FrameKind,
+    LengthPrefixedFramer,
+    is_msgpack_available,
+    pack_blob,
+    pack_message,
+    unpack_blob,
+    unpack_message,
+)
+from dify_plugin.core.server.tcp.outbound_queue import OutboundPriority, OutboundQueue, ReplayBuffer
+from dify_plugin.core.utils.cancellation import current_cancellation_token
+from dify_plugin.core.utils.line_framer import LineFramer
 
 logger = logging.getLogger(__name__)
 
+_json_object_adapter = TypeAdapter(dict[str, Any])
+
 
 class TCPReaderWriter(RequestReader, ResponseWriter):
     def __init__(
@@ -33,12 +52,29 @@ class TCPReaderWriter(RequestReader, ResponseWriter):
         reconnect_attempts: int = 3,
         reconnect_timeout: int = 5,
         on_connected: Optional[Callable] = None,
+        framing: RemoteFraming = RemoteFraming.JSON,
+        handshake_timeout: float = 5,
+        max_pending_bytes: int = 16 * 1024 * 1024,
+        resume: bool = False,
+        replay_buffer_size: int = 8 * 1024 * 1024,
+        shard_index: int = 0,
+        shard_count: int = 1,
     ):
         """
         Initialize the TCPStream and connect to the target, raise exception if connection failed
+
+        :param framing: preferred framing, falls back to newline delimited json if the daemon does not accept it
+        :param handshake_timeout: seconds to wait for the daemon to accept the preferred framing
+        :param max_pending_bytes: outbound session data above which writers block until it is sent
+        :param resume: ask the daemon to resume the stream after a reconnection instead of starting over
+        :param replay_buffer_size: bytes of sent frames kept to be replayed when the stream is resumed
+        :param shard_index: index of this connection when the plugin opens `shard_count` connections
         """
         super().__init__()
 
+        if framing == RemoteFraming.MSGPACK and not is_msgpack_available():
+            raise ValueError("msgpack framing requires the `msgpack` package")
+
         self.host = host
         self.port = port
         self.key = key
@@ -47,6 +83,37 @@ class TCPReaderWriter(RequestReader, ResponseWriter):
         self.alive = False
         self.on_connected = on_connected
         self.opt_lock = Lock()
+        self.preferred_framing = framing
+        self.handshake_timeout = handshake_timeout
+        # framing of the current connection, decided during the handshake
+        self.framing = RemoteFraming.JSON
+        # whether the daemon accepts binary data as blob frames, decided during the handshake
+        self.blob_frames = False
+        # blob frames received from the daemon, waiting for the message referencing them
+        self.blobs: dict[str, bytes] = {}
+        self.blobs_lock = Lock()
+        # bytes received after the handshake acknowledgement, they belong to the stream
+        self._handshake_remainder = b""
+        # outbound frames are sent by a single writer thread once the connection is launched
+        self.outbound = OutboundQueue(max_pending_bytes)
+        self._writer_thread: Optional[threading.Thread] = None
+        # set while the connection can be written to by the writer thread
+        self._writable = threading.Event()
+        # the thread running `_connect` writes the handshake and declarations directly
+        self._connecting_thread: Optional[int] = None
+        # frames of the stream are numbered implicitly in send order by both sides,
+        # the daemon tells how many it received when it resumes the stream
+        self.resume = resume
+        self.stream_id = uuid.uuid4().hex
+        self.replay = ReplayBuffer(replay_buffer_size)
+        # number of frames received from the daemon on the current stream
+        self.received_frames = 0
+        # acknowledgement of the last handshake, None if the daemon did not answer
+        self._ack: Optional[InitializeMessage.HandshakeAck] = None
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        # reader dispatching the received messages, replaced when several connections share one dispatch
+        self.dispatcher: RequestReader = self
 
         # handle SIGINT to exit the program smoothly due to the gevent limitation
         signal.signal(signal.SIGINT, lambda *args, **kwargs: os._exit(0))
@@ -56,21 +123,24 @@ class TCPReaderWriter(RequestReader, ResponseWriter):
         Launch the connection
         """
         self._launch()
+        if self._writer_thread is None:
+            self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer_thread.start()
 
     def close(self):
         """
         Close the connection
         """
+        self.outbound.close("connection is closed")
         if self.alive:
             self.sock.close()
             self.alive = False
 
-    def _write_to_sock(self, data: bytes):
+    def _write_to_sock(self, data: bytes | memoryview) -> int:
         """
-        Write data to the socket
+        Write data to the socket, the caller holds `opt_lock`
         """
-        with self.opt_lock:
-            return self.sock.send(data)
+        return self.sock.send(data)
 
     def _recv_from_sock(self, size: int) -> bytes:
         """
@@ -79,29 +149,169 @@ class TCPReaderWriter(RequestReader, ResponseWriter):
         return self.sock.recv(size)
 
     def write(self, data: str):
-        if not self.alive:
-            raise Exception("connection is dead")
+        frame = self._encode_text(data)
+        if frame:
+            self._write_bytes(frame)
 
-        try:
-            if native_socket.socket is gevent_socket.socket:
-                """
-                gevent socket is non-blocking, to avoid BlockingIOError
-                send data bytes by bytes
-                """
-                data_bytes = data.encode()
-                while data_bytes:
+    def write_session_frame(self, session_id: Optional[str], data: str):
+        frame = self._encode_text(data)
+        if frame:
+            self._write_bytes(frame, OutboundPriority.SESSION, session_id)
+
+    def _encode_text(self, data: str) -> bytes:
+        if self.framing == RemoteFraming.MSGPACK:
+            # raw json text, only whitespace separators are expected outside of a message
+            if not data.strip():
+                return b""
+            return pack_message(_json_object_adapter.validate_json(data))
+        return data.encode()
+
+    def write_message(self, message: BaseModel):
+        self._write_bytes(self._encode_message(message))
+
+    def put(
+        self,
+        event: Event,
+        session_id: Optional[str] = None,
+        data: Optional[dict | BaseModel] = None,
+    ):
+        if isinstance(data, BaseModel):
+            data = data.model_dump()
+
+        frame = self._encode_message(StreamOutputMessage(event=event, session_id=session_id, data=data))
+        if event == Event.SESSION:
+            self._write_bytes(frame, OutboundPriority.SESSION, session_id)
+        else:
+            self._write_bytes(frame)
+
+    def session_messages(self, session_id: Optional[str], data: Sequence[dict | BaseModel]):
+        # queued back to back, every message stays a frame of its own for the replay buffer
+        for item in data:
+            self.session_message(session_id, item)
+
+    def _encode_message(self, message: BaseModel) -> bytes:
+        if self.framing == RemoteFraming.MSGPACK:
+            return pack_message(message.model_dump(mode="json"))
+        return (message.model_dump_json() + "\n\n").encode()
+
+    def supports_blob_frames(self) -> bool:
+        return self.framing == RemoteFraming.MSGPACK and self.blob_frames
+
+    def write_blob(self, data: bytes, session_id: Optional[str] = None) -> str:
+        if not self.supports_blob_frames():
+            return super().write_blob(data, session_id)
+
+        blob_id = uuid.uuid4().hex
+        if session_id is None:
+            self._write_bytes(pack_blob(blob_id, data))
+        else:
+            # queued with the session messages, so it always precedes the message referencing it
+            self._write_bytes(pack_blob(blob_id, data), OutboundPriority.SESSION, session_id)
+        return blob_id
+
+    def take_blob(self, blob_id: str) -> bytes:
+        with self.blobs_lock:
+            blob = self.blobs.pop(blob_id, None)
+        if blob is None:
+            raise ValueError(f"blob `{blob_id}` not found")
+        return blob
+
+    def session_stream(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None):
+        if self.framing == RemoteFraming.MSGPACK:
+            # the single-pass json envelope does not apply to msgpack frames
+            return self.session_message(session_id=session_id, data=self.stream_object(data or {}))
+        self._write_bytes(self.session_stream_text(session_id, data).encode(), OutboundPriority.SESSION, session_id)
+
+    def _write_bytes(
+        self,
+        data_bytes: bytes,
+        priority: OutboundPriority = OutboundPriority.CONTROL,
+        session_id: Optional[str] = None,
+    ):
+        """
+        Queue a frame for the writer thread, frames are sent directly before the writer thread
+        is started and while the current thread is establishing the connection
+        """
+        if self._writer_thread is None or self._connecting_thread == threading.get_ident():
+            if not self.alive:
+                raise Exception("connection is dead")
+            self._send(data_bytes)
+            return
+
+        self.outbound.put(data_bytes, priority, session_id, current_cancellation_token())
+
+    def _send(self, data_bytes: bytes):
+        """
+        Send a frame of the stream, the whole frame is sent under the lock so that frames are never interleaved
+        """
+        with self.opt_lock:
+            self._record(data_bytes)
+            self._send_locked(data_bytes)
+
+    def _record(self, data_bytes: bytes) -> bool:
+        """
+        Keep a frame for replay when resuming is enabled, the caller holds `opt_lock`
+        """
+        # whitespace is only a separator in json framing, it is not a frame of its own
+        if not self.resume or not data_bytes or data_bytes.isspace():
+            return False
+        self.replay.append(data_bytes)
+        return True
+
+    def _send_locked(self, data_bytes: bytes):
+        """
+        Send data to the socket, the caller holds `opt_lock`
+        """
+        if native_socket.socket is gevent_socket.socket:
+            """
+            gevent socket is non-blocking, to avoid BlockingIOError
+            send data bytes by bytes
+            """
+            view = memoryview(data_bytes)
+            while view:
+                try:
+                    sent = self._write_to_sock(view)
+                    view = view[sent:]
+                except BlockingIOError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                    sleep(0)
+        else:
+            self.sock.sendall(data_bytes)
+
+    def _writer_loop(self):
+        """
+        Send queued frames one by one, a frame which failed to be sent is retried on the next connection,
+        or replayed from the replay buffer if the stream is resumed
+        """
+        while True:
+            frame = self.outbound.get()
+            if frame is None:
+                continue
+
+            while True:
+                self._writable.wait()
+                with self.opt_lock:
+                    # the connection may have been lost while waiting for the lock
+                    if not self._writable.is_set():
+                        continue
+                    recorded = self._record(frame)
                     try:
-                        sent = self._write_to_sock(data_bytes)
-                        data_bytes = data_bytes[sent:]
-                    except BlockingIOError as e:
-                        if e.errno != errno.EAGAIN:
-                            raise
-                        sleep(0)
-            else:
-                self.sock.sendall(data.encode())
-        except Exception:
-            logger.exception("Failed to write data")
-            self._launch()
+                        self._send_locked(frame)
+                        break
+                    except Exception:
+                        logger.exception("Failed to write data")
+                        self._connection_lost()
+                        if recorded:
+                            break
+
+    def _connection_lost(self):
+        """
+        Stop writing and wake up the reader, which reconnects
+        """
+        self._writable.clear()
+        with contextlib.suppress(Exception):
+            self.sock.shutdown(native_socket.SHUT_RDWR)
 
     def done(self):
         pass
@@ -118,6 +328,8 @@ class TCPReaderWriter(RequestReader, ResponseWriter):
             except Exception as e:
                 attempts += 1
                 if attempts >= self.reconnect_attempts:
+                    # nothing would ever send the queued frames, fail the sessions instead of blocking them
+                    self.outbound.close("connection is dead")
                     raise e
 
                 time.sleep(self.reconnect_timeout)
@@ -126,84 +338,219 @@ class TCPReaderWriter(RequestReader, ResponseWriter):
         """
         Connect to the target
         """
+        # wait for the writer thread to finish the frame it is sending on the previous connection
+        with self.opt_lock:
+            self._writable.clear()
+        self._connecting_thread = threading.get_ident()
         try:
             if native_socket.socket is gevent_socket.socket:
                 self.sock = gevent_socket.create_connection((self.host, self.port))
             else:
                 self.sock = native_socket.create_connection((self.host, self.port))
             self.alive = True
+            previous_framing = self.framing
+            self.framing = RemoteFraming.JSON
+            self.blob_frames = False
+            self._handshake_remainder = b""
+            self._ack = None
+            framings = None
+            if self.preferred_framing != RemoteFraming.JSON:
+                framings = [self.preferred_framing.value, RemoteFraming.JSON.value]
+
+            key = InitializeMessage.Key(key=self.key, framings=framings)
+            if self.resume:
+                key.stream_id = self.stream_id
+                key.received = self.received_frames
+            if self.shard_count > 1:
+                key.shard = self.shard_index
+                key.shards = self.shard_count
             handshake_message = InitializeMessage(
                 type=InitializeMessage.Type.HANDSHAKE,
-                data=InitializeMessage.Key(key=self.key).model_dump(),
+                data=key.model_dump(exclude_none=True),
             )
             self.sock.sendall(handshake_message.model_dump_json().encode() + b"\n")
+            if framings or self.resume:
+                self.framing = self._negotiate_framing()
             logger.info(f"\033[32mConnected to {self.host}:{self.port}\033[0m")
-            if self.on_connected:
-                self.on_connected()
-            logger.info(f"Sent key to {self.host}:{self.port}")
+
+            if self.resume and self._ack is not None and self._ack.resumed:
+                if self.framing != previous_framing:
+                    self._abandon_stream()
+                    raise OSError("framing changed while resuming the stream")
+                self._replay(self._ack.received)
+                logger.info(f"Resumed stream {self.stream_id}")
+            else:
+                # a new stream, declarations and sessions of the previous one are gone
+                self.replay.reset()
+                self.received_frames = 0
+                with self.blobs_lock:
+                    self.blobs.clear()
+                if self.on_connected:
+                    self.on_connected()
+                logger.info(f"Sent key to {self.host}:{self.port}")
+            self.outbound.reopen()
+            self._writable.set()
         except OSError as e:
             logger.exception(f"\033[31mFailed to connect to {self.host}:{self.port}\033[0m")
+            if self.alive:
+                with contextlib.suppress(Exception):
+                    self.sock.close()
+                self.alive = False
             raise e
+        finally:
+            self._connecting_thread = None
+
+    def _replay(self, received: int):
+        """
+        Send the frames of the stream the daemon did not receive
+        """
+        with self.opt_lock:
+            frames = self.replay.frames_from(received)
+            if frames is None:
+                self._abandon_stream()
+                raise OSError(f"frames after {received} are no longer buffered, the stream cannot be resumed")
+
+            logger.info(f"Replaying {len(frames)} frames")
+            for frame in frames:
+                self._send_locked(frame)
+
+    def _abandon_stream(self):
+        """
+        Start a new stream on the next connection
+        """
+        self.stream_id = uuid.uuid4().hex
+        self.replay.reset()
+        self.received_frames = 0
+
+    def _negotiate_framing(self) -> RemoteFraming:
+        """
+        Wait for the daemon to acknowledge the handshake with the framing it accepted,
+        fall back to json if it does not answer in time
+        """
+        buffer = b""
+        deadline = time.monotonic() + self.handshake_timeout
+        while b"\n" not in buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready_to_read, _, _ = select([self.sock], [], [], remaining)
+            if not ready_to_read:
+                break
+            data = self._recv_from_sock(65536)
+            if not data:
+                raise OSError("connection closed during handshake")
+            buffer += data
+
+        line, separator, remainder = buffer.partition(b"\n")
+        if not separator:
+            logger.info("Daemon did not acknowledge the framing, using json")
+            self._handshake_remainder = buffer
+            return RemoteFraming.JSON
+
+        try:
+            message = InitializeMessage.model_validate_json(line)
+            if message.type != InitializeMessage.Type.HANDSHAKE or not isinstance(message.data, dict):
+                raise ValueError("not a handshake acknowledgement")
+            ack = InitializeMessage.HandshakeAck(**message.data)
+            framing = RemoteFraming(ack.framing)
+        except ValueError:
+            logger.info("Daemon did not acknowledge the framing, using json")
+            self._handshake_remainder = buffer
+            return RemoteFraming.JSON
+
+        self._handshake_remainder = remainder
+        self._ack = ack
+        self.blob_frames = framing == RemoteFraming.MSGPACK and ack.blob_frames
+        logger.info(f"Using {framing.value} framing")
+        return framing
+
+    def _new_framer(self) -> LineFramer | LengthPrefixedFramer:
+        if self.framing == RemoteFraming.MSGPACK:
+            return LengthPrefixedFramer()
+        return LineFramer()
+
+    def _decode_frames(self, framer: LineFramer | LengthPrefixedFramer, data: bytes) -> list[PluginInStream]:
+        """
+        Decode the messages completed by data, a message which could not be decoded is logged and skipped
+        """
+        messages = []
+        if isinstance(framer, LengthPrefixedFramer):
+            for kind, payload in framer.feed(data):
+                self.received_frames += 1
+                try:
+                    if kind == FrameKind.BLOB:
+                        blob_id, blob = unpack_blob(payload)
+                        with self.blobs_lock:
+                            self.blobs[blob_id] = blob
+                        continue
+                    message = unpack_message(payload)
+                    messages.append(
+                        PluginInStream(
+                            session_id=message["session_id"],
+                            conversation_id=message.get("conversation_id"),
+                            message_id=message.get("message_id"),
+                            app_id=message.get("app_id"),
+                            endpoint_id=message.get("endpoint_id"),
+                            event=PluginInStreamEvent.value_of(message["event"]),
+                            data=message["data"],
+                            reader=self.dispatcher,
+                            writer=self,
+                        )
+                    )
+                except Exception:
+                    logger.exception("\033[31mAn error occurred while parsing a msgpack frame\033[0m")
+        else:
+            for line in framer.feed(data):
+                if not line or line.isspace():
+                    continue
+                self.received_frames += 1
+                try:
+                    messages.append(PluginInStream.from_json(line, reader=self.dispatcher, writer=self))
+                except Exception:
+                    logger.exception(f"\033[31mAn error occurred while parsing the data: {line}\033[0m")
+        return messages
 
     def _read_stream(self) -> Generator[PluginInStream, None, None]:
         """
         Read data from the target
         """
-        buffer = b""
+        framer = self._new_framer()
+        pending, self._handshake_remainder = self._handshake_remainder, b""
         while self.alive:
             try:
-                ready_to_read, _, _ = select([self.sock], [], [], 1)
-                if not ready_to_read:
-                    continue
-                try:
-                    data = self._recv_from_sock(1048576)
-                except BlockingIOError as e:
-                    if native_socket.socket is gevent_socket.socket:
-                        if e.errno != errno.EAGAIN:
-                            raise
-                        sleep(0)
+                if pending:
+                    data, pending = pending, b""
+                else:
+                    ready_to_read, _, _ = select([self.sock], [], [], 1)
+                    if not ready_to_read:
                         continue
-                    else:
-                        raise
-                if data == b"":
-                    raise Exception("Connection is closed")
+                    try:
+                        data = self._recv_from_sock(1048576)
+                    except BlockingIOError as e:
+                        if native_socket.socket is gevent_socket.socket:
+                            if e.errno != errno.EAGAIN:
+                                raise
+                            sleep(0)
+                            continue
+                        else:
+                            raise
+                    if data == b"":
+                        raise Exception("Connection is closed")
+                messages = self._decode_frames(framer, data)
             except Exception:
                 logger.exception(f"\033[31mFailed to read data from {self.host}:{self.port}\033[0m")
                 self.alive = False
                 time.sleep(self.reconnect_timeout)
                 self._launch()
+                # a partial frame from the broken connection must not be joined with the new one,
+                # and the framing may have changed during the new handshake
+                framer = self._new_framer()
+                pending, self._handshake_remainder = self._handshake_remainder, b""
                 continue
 
-            if not data:
-                continue
-
-            buffer += data
-
-            # process line by line and keep the last line if it is not complete
-            lines = buffer.split(b"\n")
-            if len(lines) == 0:
-                continue
-
-            buffer = lines[-1]
-
-            lines = lines[:-1]
-            for line in lines:
-                try:
-                    data = TypeAdapter(dict[str, Any]).validate_json(line)
-                    chunk = PluginInStream(
-                        session_id=data["session_id"],
-                        conversation_id=data.get("conversation_id"),
-                        message_id=data.get("message_id"),
-                        app_id=data.get("app_id"),
-                        endpoint_id=data.get("endpoint_id"),
-                        event=PluginInStreamEvent.value_of(data["event"]),
-                        data=data["data"],
-                        reader=self,
-                        writer=self,
-                    )
-                    yield chunk
-                    logger.info(
-                        f"Received event: \n{chunk.event}\n session_id: \n{chunk.session_id}\n data: \n{chunk.data}"
-                    )
-                except Exception:
-                    logger.exception(f"\033[31mAn error occurred while parsing the data: {line}\033[0m")
+            for chunk in messages:
+                yield chunk
+                logger.info(f"Received event: \n{chunk.event}\n session_id: \n{chunk.session_id}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    # decoding the payload is deferred to its consumer unless it is logged
+                    logger.debug(f"data: \n{chunk.data}")
@@ -0,0 +1,166 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections.abc import Callable, Generator, Sequence
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from dify_plugin.core.entities.plugin.io import PluginInStream
+from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.core.server.__base.writer_entities import Event
+from dify_plugin.core.server.tcp.request_reader import TCPReaderWriter
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(session_id: Optional[str], shards: int) -> int:
+    """
+    Index of the connection carrying a session, messages without a session use the first one
+    """
+    if session_id is None:
+        return 0
+    return zlib.crc32(session_id.encode()) % shards
+
+
+class ShardedTCPReaderWriter(RequestReader, ResponseWriter):
+    """
+    Several connections to the daemon behaving as a single stream.
+
+    Sessions are assigned to connections by `shard_of` their id, so a large response only
+    blocks the sessions sharing its connection. Declarations, heartbeats and logs use the first
+    connection. Messages received on every connection are merged into a single dispatch, a
+    session replies on the connection its request arrived on.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        key: str,
+        connections: int,
+        on_connected: Optional[Callable] = None,
+        **kwargs: Any,
+    ):
+        """
+        :param connections: number of connections to open
+        :param on_connected: called when the first connection starts a new stream
+        :param kwargs: passed to every `TCPReaderWriter`
+        """
+        super().__init__()
+
+        if connections < 1:
+            raise ValueError("at least one connection is required")
+
+        self.shards = [
+            TCPReaderWriter(
+                host,
+                port,
+                key,
+                on_connected=on_connected if index == 0 else None,
+                shard_index=index,
+                shard_count=connections,
+                **kwargs,
+            )
+            for index in range(connections)
+        ]
+        for shard in self.shards:
+            shard.dispatcher = self
+
+        self._inbound: queue.Queue[PluginInStream] = queue.Queue()
+        self._readers_started = False
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def primary(self) -> TCPReaderWriter:
+        return self.shards[0]
+
+    def shard_for(self, session_id: Optional[str]) -> TCPReaderWriter:
+        return self.shards[shard_of(session_id, len(self.shards))]
+
+    def launch(self):
+        """
+        Launch all connections
+        """
+        for shard in self.shards:
+            shard.launch()
+
+    def close(self):
+        self._closed = True
+        for shard in self.shards:
+            shard.close()
+
+    def _read_stream(self) -> Generator[PluginInStream, None, None]:
+        """
+        Read the messages of all connections, in the order they were received
+        """
+        with self._readers_lock:
+            if not self._readers_started:
+                self._readers_started = True
+                for shard in self.shards:
+                    threading.Thread(target=self._pump, args=(shard,), daemon=True).start()
+
+        while True:
+            yield self._inbound.get()
+
+    def _pump(self, shard: TCPReaderWriter):
+        """
+        Forward the messages of a connection to the merged dispatch, reconnecting it whenever its
+        stream ends until the connections are closed
+        """
+        while not self._closed:
+            try:
+                if not shard.alive:
+                    # the stream gave up reconnecting, the sessions of the shard have no other connection
+                    shard._launch()
+                for message in shard._read_stream():
+                    self._inbound.put(message)
+                if not self._closed:
+                    logger.error(f"Connection {shard.shard_index} was lost, reconnecting")
+            except Exception:
+                logger.exception(f"Error reading connection {shard.shard_index}")
+                time.sleep(shard.reconnect_timeout)
+
+    def take_blob(self, blob_id: str) -> bytes:
+        for shard in self.shards:
+            try:
+                return shard.take_blob(blob_id)
+            except ValueError:
+                continue
+        raise ValueError(f"blob `{blob_id}` not found")
+
+    def write(self, data: str):
+        self.primary.write(data)
+
+    def write_message(self, message: BaseModel):
+        self.primary.write_message(message)
+
+    def write_session_frame(self, session_id: Optional[str], data: str):
+        self.shard_for(session_id).write_session_frame(session_id, data)
+
+    def put(
+        self,
+        event: Event,
+        session_id: Optional[str] = None,
+        data: Optional[dict | BaseModel] = None,
+    ):
+        self.shard_for(session_id).put(event, session_id, data)
+
+    def session_messages(self, session_id: Optional[str], data: Sequence[dict | BaseModel]):
+        self.shard_for(session_id).session_messages(session_id, data)
+
+    def session_stream(self, session_id: Optional[str] = None, data: Optional[dict | BaseModel] = None):
+        self.shard_for(session_id).session_stream(session_id, data)
+
+    def supports_blob_frames(self) -> bool:
+        return all(shard.supports_blob_frames() for shard in self.shards)
+
+    def write_blob(self, data: bytes, session_id: Optional[str] = None) -> str:
+        return self.shard_for(session_id).write_blob(data, session_id)
+
+    def done(self):
+        pass
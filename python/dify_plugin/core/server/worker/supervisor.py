@@ -0,0 +1,284 @@
+import binascii
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field, ValidationError
+
+from dify_plugin.core.entities.message import SessionMessage
+from dify_plugin.core.entities.plugin.io import PluginInStream, PluginInStreamEvent
+from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.core.server.__base.writer_entities import Event
+from dify_plugin.core.utils.line_framer import LineFramer
+
+logger = logging.getLogger(__name__)
+
+# environment variable telling a process it is a worker and which one
+WORKER_ID_ENV = "WORKER_ID"
+
+
+class _FrameDataHeader(BaseModel):
+    # type of a session message, `end` finishes the session
+    type: Optional[str] = None
+
+
+class _FrameHeader(BaseModel):
+    """
+    Routing fields of a frame written by a worker, the payload of a session message is skipped
+    without creating python objects
+    """
+
+    event: Optional[str] = None
+    session_id: Optional[str] = None
+    data: Optional[_FrameDataHeader | Any] = Field(default=None, union_mode="left_to_right")
+
+
+class WorkerProcess:
+    """
+    A worker process speaking the stdio protocol with its supervisor
+    """
+
+    def __init__(self, index: int, command: list[str], env: dict[str, str]) -> None:
+        self.index = index
+        self.process = subprocess.Popen(  # noqa: S603
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env={**env, WORKER_ID_ENV: str(index)},
+        )
+        # sessions currently executed by the worker
+        self.sessions: set[str] = set()
+        self._stdin_lock = threading.Lock()
+
+    def send(self, line: bytes):
+        """
+        Send a json line to the worker
+        """
+        assert self.process.stdin
+        with self._stdin_lock:
+            self.process.stdin.write(line + b"\n")
+            self.process.stdin.flush()
+
+    def read(self) -> bytes:
+        """
+        Read the next chunk written by the worker, empty once it exited
+        """
+        assert self.process.stdout
+        return self.process.stdout.read1(65536)
+
+    def kill(self):
+        self.process.kill()
+
+
+class WorkerSupervisor:
+    """
+    Fan requests out to worker processes.
+
+    The supervisor owns the connection to the daemon, every worker runs the plugin with a stdio
+    stream connected to the supervisor. A request is sent to the worker with the fewest running
+    sessions, the session's output and backwards invocations are written back to the writer the
+    request arrived with, and backwards invocation responses are routed to the worker running
+    the session.
+    """
+
+    def __init__(
+        self,
+        reader: RequestReader,
+        default_writer: Optional[ResponseWriter],
+        workers: int,
+        command: Optional[list[str]] = None,
+    ) -> None:
+        """
+        :param workers: number of worker processes
+        :param command: command starting a worker, defaults to the command which started this process
+        """
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+
+        self.reader = reader
+        self.default_writer = default_writer
+        self.worker_count = workers
+        self.command = command or list(sys.orig_argv)
+        self.workers: list[WorkerProcess] = []
+        # session id -> worker running it and writer of the session
+        self.sessions: dict[str, tuple[WorkerProcess, ResponseWriter]] = {}
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        """
+        Start the worker processes and route backwards invocation responses and cancellations to them
+        """
+        self.running = True
+        for index in range(self.worker_count):
+            self._start_worker(index)
+
+        responses = self.reader.read(filter=lambda data: data.event == PluginInStreamEvent.BackwardInvocationResponse)
+        threading.Thread(target=self._forward_all, args=(responses,), daemon=True).start()
+        cancellations = self.reader.read(key=RequestReader.cancel_key())
+        threading.Thread(target=self._forward_all, args=(cancellations,), daemon=True).start()
+
+    def run(self):
+        """
+        Start the workers and dispatch requests to them, blocks forever
+        """
+        requests = self.reader.read(key=RequestReader.request_key())
+        self.start()
+        self._forward_all(requests)
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers:
+            worker.kill()
+
+    def _start_worker(self, index: int):
+        worker = WorkerProcess(index, self.command, dict(os.environ))
+        with self.lock:
+            if index < len(self.workers):
+                self.workers[index] = worker
+            else:
+                self.workers.append(worker)
+        threading.Thread(target=self._read_worker, args=(worker,), daemon=True).start()
+        logger.info(f"Started worker {index}, pid {worker.process.pid}")
+
+    def _forward_all(self, reader):
+        for data in reader.read():
+            try:
+                self.dispatch(data)
+            except Exception:
+                logger.exception(f"Failed to dispatch session {data.session_id} to a worker")
+
+    def dispatch(self, data: PluginInStream):
+        """
+        Send an inbound message to the worker running its session, requests start a session on
+        the least busy worker
+        """
+        if data.event == PluginInStreamEvent.BackwardInvocationResponse and data.writer.supports_blob_frames():
+            self._inline_blobs(data)
+
+        with self.lock:
+            if data.event == PluginInStreamEvent.Request:
+                worker = min(self.workers, key=lambda worker: len(worker.sessions))
+                worker.sessions.add(data.session_id)
+                self.sessions[data.session_id] = (worker, data.writer)
+            else:
+                entry = self.sessions.get(data.session_id)
+                if entry is None:
+                    logger.debug(f"Dropped a message of the finished session {data.session_id}")
+                    return
+                worker = entry[0]
+
+        worker.send(data.to_json())
+
+    def _inline_blobs(self, data: PluginInStream):
+        """
+        Replace the `<name>_blob_id` fields of a backwards invocation response with the hex encoded
+        `<name>` field, workers speak json lines and cannot receive blob frames
+        """
+        response = data.data.get("data")
+        if not isinstance(response, dict) or not any(key.endswith("_blob_id") for key in response):
+            return
+
+        inlined = {}
+        for key, value in response.items():
+            if key.endswith("_blob_id") and isinstance(value, str):
+                # taking the blob also releases it from the connection
+                inlined[key.removesuffix("_blob_id")] = binascii.hexlify(self.reader.take_blob(value)).decode()
+            else:
+                inlined[key] = value
+        data.data = {**data.data, "data": inlined}
+
+    def _read_worker(self, worker: WorkerProcess):
+        """
+        Forward the frames written by a worker until it exits
+        """
+        framer = LineFramer()
+        while True:
+            data = worker.read()
+            if not data:
+                break
+
+            for frame in framer.feed(data):
+                if not frame or frame.isspace():
+                    continue
+                try:
+                    self._forward(frame)
+                except Exception:
+                    logger.exception(f"Failed to forward a frame of worker {worker.index}")
+
+        worker.process.wait()
+        self._worker_exited(worker)
+
+    def _forward(self, frame: bytes):
+        """
+        Write a frame of a worker to the writer of its session
+        """
+        try:
+            header = _FrameHeader.model_validate_json(frame)
+        except ValidationError:
+            logger.debug(f"Dropped a frame which is not a json object: {frame[:100]!r}")
+            return
+
+        if header.event is None:
+            # the plugin configuration written by a worker on startup, the supervisor already sent it
+            return
+        if header.event == Event.HEARTBEAT.value:
+            # the supervisor sends its own heartbeats
+            return
+
+        if header.event == Event.SESSION.value and header.session_id is not None:
+            finished = isinstance(header.data, _FrameDataHeader) and header.data.type == SessionMessage.Type.END.value
+            with self.lock:
+                entry = self.sessions.pop(header.session_id, None) if finished else self.sessions.get(header.session_id)
+                if entry is not None and finished:
+                    entry[0].sessions.discard(header.session_id)
+
+            if entry is None:
+                logger.debug(f"Dropped a frame of the unknown session {header.session_id}")
+                return
+
+            writer = entry[1]
+            # queued with the session, under the backpressure and round-robin of the connection
+            writer.write_session_frame(header.session_id, frame.decode() + "\n\n")
+            if finished:
+                writer.done()
+            return
+
+        with self.lock:
+            entry = self.sessions.get(header.session_id or "")
+        writer = entry[1] if entry is not None else self.default_writer
+        if writer is not None:
+            writer.write(frame.decode() + "\n\n")
+
+    def _worker_exited(self, worker: WorkerProcess):
+        """
+        Fail the sessions of a worker which exited and replace it
+        """
+        with self.lock:
+            sessions = [(session_id, self.sessions.pop(session_id)[1]) for session_id in worker.sessions]
+            worker.sessions.clear()
+
+        logger.error(f"Worker {worker.index} exited with code {worker.process.returncode}")
+        for session_id, writer in sessions:
+            writer.session_message(
+                session_id=session_id,
+                data=writer.stream_error_object(
+                    data={
+                        "error_type": "WorkerExited",
+                        "message": f"plugin worker exited with code {worker.process.returncode}",
+                        "args": {},
+                    }
+                ),
+            )
+            writer.session_message(session_id=session_id, data=writer.stream_end_object())
+            writer.done()
+
+        if self.running:
+            # do not spin if the worker fails on startup
+            time.sleep(1)
+            self._start_worker(worker.index)
@@ -0,0 +1,212 @@
+import contextlib
+import logging
+import threading
+import time
+from collections.abc import Callable, Generator, Iterable
+from contextvars import ContextVar
+from typing import Any, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SessionCancelledError(Exception):
+    """
+    Raised in a session which was cancelled by the daemon
+    """
+
+
+class SessionTimeoutError(SessionCancelledError):
+    """
+    Raised in a session which outlived its deadline
+    """
+
+
+class CancellationToken:
+    """
+    Cancellation state and deadline of a session.
+
+    Long waits register a callback with `on_cancel` which interrupts them, e.g. by closing
+    the connection they read from, and check `raise_if_cancelled` once they wake up. Blocking
+    calls take their timeout from `timeout`, the token cancels itself once the deadline passes.
+    """
+
+    def __init__(self, deadline: Optional[float] = None) -> None:
+        """
+        :param deadline: `time.monotonic()` after which the session is cancelled, None for no deadline
+        """
+        self._event = threading.Event()
+        self._callbacks: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.deadline = deadline
+        self._timed_out = False
+        self._timer: Optional[threading.Timer] = None
+        if deadline is not None:
+            self._timer = threading.Timer(max(deadline - time.monotonic(), 0), self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @classmethod
+    def with_timeout(cls, seconds: float) -> "CancellationToken":
+        return cls(deadline=time.monotonic() + seconds)
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left before the deadline, None without a deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def timeout(self, default: Any) -> Any:
+        """
+        Timeout of a blocking call, `default` capped by the time left before the deadline
+
+        :param default: timeout in seconds, None or a tuple of them as accepted by requests and httpx
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        self.raise_if_cancelled()
+        # a zero timeout means no timeout to some clients
+        remaining = max(remaining, 0.001)
+        if isinstance(default, tuple):
+            return tuple(remaining if value is None else min(value, remaining) for value in default)
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+    def release(self):
+        """
+        Stop watching the deadline, called once the session ended
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def _expire(self):
+        self._timed_out = True
+        self.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """
+        Cancel the session and run the registered callbacks
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error in cancellation callback")
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise self.error()
+
+    def error(self) -> SessionCancelledError:
+        """
+        The error ending a cancelled session
+        """
+        if self._timed_out:
+            return SessionTimeoutError("session exceeded its deadline")
+        return SessionCancelledError("session was cancelled")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the session is cancelled, return whether it was
+        """
+        return self._event.wait(timeout)
+
+    @contextlib.contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Generator[None, None, None]:
+        """
+        Run callback if the session is cancelled while in the block, immediately if it already was
+        """
+        with self._lock:
+            registered = not self._event.is_set()
+            if registered:
+                self._callbacks.append(callback)
+
+        if not registered:
+            callback()
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+# token of the session executed by the current greenlet
+_current_token: ContextVar[Optional[CancellationToken]] = ContextVar("cancellation_token", default=None)
+
+
+def current_cancellation_token() -> Optional[CancellationToken]:
+    return _current_token.get()
+
+
+def request_timeout(default: Any) -> Any:
+    """
+    Timeout of a blocking call made by the current session, see `CancellationToken.timeout`
+    """
+    token = current_cancellation_token()
+    if token is None:
+        return default
+    return token.timeout(default)
+
+
+@contextlib.contextmanager
+def use_cancellation_token(token: CancellationToken) -> Generator[None, None, None]:
+    """
+    Make token the token of the current session for the duration of the block
+    """
+    reset = _current_token.set(token)
+    try:
+        yield
+    finally:
+        _current_token.reset(reset)
+
+
+def cancellable(
+    iterable: Iterable[T],
+    close: Optional[Callable[[], None]] = None,
+    token: Optional[CancellationToken] = None,
+) -> Generator[T, None, None]:
+    """
+    Iterate over a stream which stops early when the session is cancelled
+
+    :param iterable: items read from a connection
+    :param close: closes the connection, called from the cancelling thread to interrupt a blocked read
+    :param token: token of the session, defaults to the token of the current session
+    """
+    token = token or current_cancellation_token()
+    if token is None:
+        yield from iterable
+        return
+
+    with token.on_cancel(close) if close else contextlib.nullcontext():
+        try:
+            for item in iterable:
+                token.raise_if_cancelled()
+                yield item
+        except SessionCancelledError:
+            # stop the producer, e.g. run the `finally` and `with` blocks of a plugin generator
+            if isinstance(iterable, Generator):
+                iterable.close()
+            raise
+        except Exception as e:
+            # reading from a connection closed by the cancellation fails
+            if token.cancelled:
+                raise token.error() from e
+            raise e
+        token.raise_if_cancelled()
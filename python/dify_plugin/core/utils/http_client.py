@@ -0,0 +1,63 @@
+import importlib.util
+import os
+import threading
+from typing import Optional
+
+import httpx
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+_limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=5)
+_http2 = False
+
+
+def is_http2_available() -> bool:
+    # h2 is an optional dependency, only needed for HTTP/2
+    return importlib.util.find_spec("h2") is not None
+
+
+def configure_http_client(limits: httpx.Limits, http2: bool = False) -> None:
+    """
+    Set the pool limits of the shared client, the current client is closed and replaced on next use
+
+    :param http2: multiplex requests to the same host over a single HTTP/2 connection
+    """
+    global _client, _limits, _http2
+
+    if http2 and not is_http2_available():
+        raise ValueError("HTTP/2 requires the `h2` package")
+
+    with _lock:
+        client, _client = _client, None
+        _limits = limits
+        _http2 = http2
+
+    if client is not None:
+        client.close()
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Client shared by the whole process, connections to the daemon and to file servers are kept alive
+    and reused across requests. Callers pass their own timeout with every request.
+    """
+    global _client
+
+    client = _client
+    if client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(limits=_limits, http2=_http2)
+            client = _client
+    return client
+
+
+def _reset_after_fork() -> None:
+    # pooled connections are shared with the parent, a forked child opens its own
+    global _client, _lock
+
+    _lock = threading.Lock()
+    _client = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
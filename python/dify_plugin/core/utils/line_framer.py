@@ -0,0 +1,64 @@
+class LineFramer:
+    """
+    Incremental splitter for delimiter-terminated frames.
+
+    Incoming data is appended to a single bytearray and only the newly arrived bytes are
+    scanned for the delimiter, so a frame spanning many reads is neither re-copied nor
+    re-split on every read.
+    """
+
+    def __init__(self, delimiter: bytes = b"\n") -> None:
+        if not delimiter:
+            raise ValueError("delimiter must not be empty")
+
+        self.delimiter = delimiter
+        self._buffer = bytearray()
+        # position from which the delimiter has not been searched yet
+        self._scanned = 0
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Append data and return the frames it completed, without their delimiters
+
+        :param data: bytes read from the stream
+        :return: completed frames, in order
+        """
+        if not data:
+            return []
+
+        buffer = self._buffer
+        buffer += data
+
+        frames: list[bytes] = []
+        start = 0
+        delimiter_length = len(self.delimiter)
+        # a delimiter may straddle the previous and the current read
+        position = buffer.find(self.delimiter, max(self._scanned - delimiter_length + 1, 0))
+        if position == -1:
+            self._scanned = len(buffer)
+            return frames
+
+        with memoryview(buffer) as view:
+            while position != -1:
+                frames.append(bytes(view[start:position]))
+                start = position + delimiter_length
+                position = buffer.find(self.delimiter, start)
+
+        # drop consumed frames, only the incomplete tail is moved
+        del buffer[:start]
+        self._scanned = len(buffer)
+        return frames
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of buffered bytes which do not form a complete frame yet
+        """
+        return len(self._buffer)
+
+    def clear(self) -> None:
+        """
+        Drop buffered data, e.g. after the underlying connection was reset
+        """
+        self._buffer.clear()
+        self._scanned = 0
@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Optional
+
+from pydantic import BaseModel
+
+# bytes of downloaded contents cached by default, the cache is opt-in
+DEFAULT_CACHE_SIZE = 0
+# contents above this many bytes are spooled to disk and not cached by default
+DEFAULT_SPOOL_THRESHOLD = 8 * 1024 * 1024
+
+
+class FileCacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    # fetches which waited for the download of another caller instead of downloading again
+    coalesced: int
+    entries: int
+    size: int
+
+
+class _Fetch:
+    __slots__ = ("content", "done")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        # None if the fetch failed
+        self.content: Optional[bytes] = None
+
+
+class FileContentCache:
+    """
+    Process-wide LRU cache of file contents keyed by URL.
+
+    The least recently used contents are evicted once the cached contents exceed `max_size`
+    bytes, contents larger than `max_entry_size` are never cached. Concurrent fetches of a
+    URL share a single download.
+    """
+
+    def __init__(self, max_size: int, max_entry_size: int) -> None:
+        """
+        :param max_size: bytes of cached contents, 0 disables the cache
+        :param max_entry_size: bytes of the largest cached content
+        """
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        # url -> download in flight
+        self._fetches: dict[str, _Fetch] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, url: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._entries.get(url)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return content
+
+    def put(self, url: str, content: bytes) -> None:
+        size = len(content)
+        with self._lock:
+            if url in self._entries:
+                self._size -= len(self._entries.pop(url))
+            if size > self.max_entry_size or size > self.max_size:
+                return
+
+            self._entries[url] = content
+            self._size += size
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def get_or_fetch(self, url: str, fetch: Callable[[], bytes]) -> bytes:
+        """
+        Cached content of url, fetched once for all concurrent callers on a miss
+        """
+        while True:
+            with self._lock:
+                content = self._entries.get(url)
+                if content is not None:
+                    self._entries.move_to_end(url)
+                    self.hits += 1
+                    return content
+
+                pending = self._fetches.get(url)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._fetches[url] = _Fetch()
+                    owner = True
+                else:
+                    self.coalesced += 1
+                    owner = False
+
+            if owner:
+                try:
+                    content = fetch()
+                    pending.content = content
+                    self.put(url, content)
+                    return content
+                finally:
+                    with self._lock:
+                        self._fetches.pop(url, None)
+                    pending.done.set()
+
+            pending.done.wait()
+            if pending.content is not None:
+                return pending.content
+            # the download failed, the caller tries on its own and sees the error
+
+    def invalidate(self, url: Optional[str] = None) -> None:
+        """
+        Drop a url, or every url
+        """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                self._size = 0
+            elif url in self._entries:
+                self._size -= len(self._entries.pop(url))
+
+    def stats(self) -> FileCacheStats:
+        with self._lock:
+            return FileCacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                coalesced=self.coalesced,
+                entries=len(self._entries),
+                size=self._size,
+            )
+
+
+_cache = FileContentCache(DEFAULT_CACHE_SIZE, DEFAULT_SPOOL_THRESHOLD)
+_prefetch = False
+
+
+def configure_file_cache(max_size: int, spool_threshold: int, prefetch: bool = False) -> None:
+    """
+    Replace the cache shared by all files
+
+    :param max_size: bytes of cached contents, 0 disables the cache and prefetching
+    :param spool_threshold: contents above this many bytes are spooled to disk and not cached
+    :param prefetch: download the files of list parameters concurrently before a tool runs
+    """
+    global _cache, _prefetch
+
+    _cache = FileContentCache(max_size, spool_threshold)
+    _prefetch = prefetch
+
+
+def get_file_cache() -> FileContentCache:
+    return _cache
+
+
+def is_prefetch_enabled() -> bool:
+    return _prefetch and _cache.enabled
@@ -1,9 +1,33 @@
+import contextlib
+import io
+import logging
+import tempfile
+import threading
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Optional
+
 import httpx
 from pydantic import BaseModel
 
+from dify_plugin.core.utils.cancellation import request_timeout
+from dify_plugin.core.utils.http_client import get_http_client
+from dify_plugin.file.cache import FileContentCache, get_file_cache
 from dify_plugin.file.constants import DIFY_FILE_IDENTITY
 from dify_plugin.file.entities import FileType
 
+logger = logging.getLogger(__name__)
+
+# httpx defaults to 5 seconds, at most until the deadline of the current session
+_DOWNLOAD_TIMEOUT = 5
+# bytes of a chunk of `iter_bytes` and of the downloads of `open`
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# prefetched downloads running at once, shared by all sessions
+PREFETCH_WORKERS = 4
+
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetch_pool_lock = threading.Lock()
+
 
 class File(BaseModel):
     dify_model_identity: str = DIFY_FILE_IDENTITY
@@ -22,6 +46,7 @@ class File(BaseModel):
         Get the file content as a bytes object.
 
         If the file content is not loaded yet, it will be loaded from the URL and stored in the `_blob` attribute.
+        Contents are shared through a process-wide cache keyed by URL, see `dify_plugin.file.cache`.
 
         Raises:
             ValueError: If the URL uses an unsupported protocol (e.g., missing 'http://' or 'https://'),
@@ -29,15 +54,181 @@ class File(BaseModel):
             httpx.HTTPStatusError: If the request to fetch the file fails.
         """
         if self._blob is None:
-            try:
-                response = httpx.get(self.url)
-                response.raise_for_status()
-                self._blob = response.content
-            except httpx.UnsupportedProtocol as e:
-                raise ValueError(
-                    f"Invalid file URL '{self.url}': {e}. "
-                    "Ensure the `FILES_URL` environment variable is set in your .env file"
-                ) from e
+            timeout = request_timeout(_DOWNLOAD_TIMEOUT)
+            self._blob = get_file_cache().get_or_fetch(self.url, lambda: self._download(timeout))
 
         assert self._blob is not None
         return self._blob
+
+    def iter_bytes(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Generator[bytes, None, None]:
+        """
+        Iterate over the file content in chunks of chunk_size bytes, without holding the whole
+        content in memory unless it is already loaded or small enough to be cached
+        """
+        cache = get_file_cache()
+        content = self._loaded_content()
+        if content is not None:
+            for start in range(0, len(content), chunk_size):
+                yield content[start : start + chunk_size]
+            return
+
+        kept: Optional[list[bytes]] = [] if cache.enabled else None
+        kept_size = 0
+        with self._request_errors(), self._stream() as response:
+            for chunk in response.iter_bytes(chunk_size):
+                if kept is not None:
+                    kept_size += len(chunk)
+                    if kept_size <= cache.max_entry_size:
+                        kept.append(chunk)
+                    else:
+                        kept = None
+                yield chunk
+
+        if kept is not None:
+            cache.put(self.url, b"".join(kept))
+
+    def open(self) -> IO[bytes]:
+        """
+        Binary file object of the content, a content above the spool threshold of the file cache
+        is downloaded to a temporary file. Close it once done.
+        """
+        content = self._loaded_content()
+        if content is not None:
+            return io.BytesIO(content)
+
+        # a max_size of 0 would never roll over to disk
+        spooled = tempfile.SpooledTemporaryFile(max_size=max(1, get_file_cache().max_entry_size))  # noqa: SIM115
+        try:
+            for chunk in self.iter_bytes():
+                spooled.write(chunk)
+            spooled.seek(0)
+        except BaseException:
+            spooled.close()
+            raise
+        return spooled  # type: ignore[return-value]
+
+    def read_range(self, start: int, end: Optional[int] = None) -> bytes:
+        """
+        Bytes start to end (exclusive) of the content, only the range is downloaded when the content
+        is not loaded yet and the server supports range requests
+        """
+        if start < 0 or (end is not None and end < start):
+            raise ValueError(f"Invalid range {start}-{end}")
+        if end is not None and end == start:
+            return b""
+
+        content = self._loaded_content()
+        if content is not None:
+            return content[start:end]
+
+        cache = get_file_cache()
+        header = f"bytes={start}-" if end is None else f"bytes={start}-{end - 1}"
+        with (
+            self._request_errors(),
+            get_http_client().stream(
+                "GET", self.url, headers={"Range": header}, timeout=request_timeout(_DOWNLOAD_TIMEOUT)
+            ) as response,
+        ):
+            if response.status_code == httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE:
+                # the range starts after the end of the content
+                return b""
+            response.raise_for_status()
+            if response.status_code == httpx.codes.PARTIAL_CONTENT:
+                return response.read()
+
+            # the server sends the whole content, it is kept when it can be cached
+            length = response.headers.get("Content-Length")
+            if cache.enabled and length is not None and int(length) <= cache.max_entry_size:
+                content = response.read()
+                cache.put(self.url, content)
+                return content[start:end]
+            # otherwise only the range is kept while reading
+            return _read_slice(response.iter_bytes(DEFAULT_CHUNK_SIZE), start, end)
+
+    def _loaded_content(self) -> Optional[bytes]:
+        if self._blob is not None:
+            return self._blob
+        return get_file_cache().get(self.url)
+
+    def _download(self, timeout: Any) -> bytes:
+        with self._request_errors():
+            response = get_http_client().get(self.url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    @contextlib.contextmanager
+    def _stream(self) -> Generator[httpx.Response, None, None]:
+        with get_http_client().stream("GET", self.url, timeout=request_timeout(_DOWNLOAD_TIMEOUT)) as response:
+            response.raise_for_status()
+            yield response
+
+    @contextlib.contextmanager
+    def _request_errors(self) -> Generator[None, None, None]:
+        try:
+            yield
+        except httpx.UnsupportedProtocol as e:
+            raise ValueError(
+                f"Invalid file URL '{self.url}': {e}. "
+                "Ensure the `FILES_URL` environment variable is set in your .env file"
+            ) from e
+
+
+def _read_slice(chunks: Iterable[bytes], start: int, end: Optional[int]) -> bytes:
+    """
+    Bytes start to end (exclusive) of a stream, reading stops once end is reached
+    """
+    kept = bytearray()
+    offset = 0
+    for chunk in chunks:
+        chunk_end = offset + len(chunk)
+        if chunk_end > start:
+            kept += chunk[max(start - offset, 0) : None if end is None else end - offset]
+        offset = chunk_end
+        if end is not None and offset >= end:
+            break
+    return bytes(kept)
+
+
+def prefetch_files(files: Iterable[File]) -> None:
+    """
+    Start downloading files into the file cache, without waiting for them.
+
+    At most `PREFETCH_WORKERS` downloads run at once. Reading a file waits for its download in
+    flight instead of starting another one. Files of unknown size or too large to be cached are
+    left to be downloaded when they are read, and prefetching stops once the files would no
+    longer fit in the cache together.
+    """
+    cache = get_file_cache()
+    if not cache.enabled:
+        return
+
+    # the downloads run in other threads, they keep the deadline of the current session
+    timeout = request_timeout(_DOWNLOAD_TIMEOUT)
+    budget = cache.max_size
+    urls = set()
+    for file in files:
+        if file.size is None or file.size > cache.max_entry_size or file.url in urls:
+            continue
+        if file.size > budget:
+            # the next downloads would evict the contents prefetched before them
+            break
+        budget -= file.size
+        urls.add(file.url)
+        _get_prefetch_pool().submit(_prefetch, file, cache, timeout)
+
+
+def _get_prefetch_pool() -> ThreadPoolExecutor:
+    global _prefetch_pool
+
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="file-prefetch")
+        return _prefetch_pool
+
+
+def _prefetch(file: File, cache: FileContentCache, timeout: Any) -> None:
+    try:
+        cache.get_or_fetch(file.url, lambda: file._download(timeout))
+    except Exception:
+        # the error is raised again when the file is read
+        logger.debug(f"Failed to prefetch {file.url}", exc_info=True)
@@ -19,6 +19,7 @@ from dify_plugin.core.entities.plugin.request import (
     PluginAccessAction,
     PluginInvokeType,
 )
+from dify_plugin.core.utils.line_framer import LineFramer
 from dify_plugin.integration.entities import PluginGenericResponse, PluginInvokeRequest, ResponseType
 from dify_plugin.integration.exc import PluginStoppedError
 
@@ -157,7 +158,7 @@ class PluginRunner:
     def _message_reader(self, pipe: int):
         # create a scanner to read the message line by line
         """Read messages line by line from the pipe."""
-        buffer = b""
+        framer = LineFramer()
         try:
             while True:
                 try:
@@ -168,18 +169,8 @@ class PluginRunner:
                 if not data:
                     continue
 
-                buffer += data
-
-                # if no b"\n" is in data, skip to the next iteration
-                if data.find(b"\n") == -1:
-                    continue
-
-                # process line by line and keep the last line if it is not complete
-                lines = buffer.split(b"\n")
-                buffer = lines[-1]
-
-                lines = lines[:-1]
-                for line in lines:
+                # process line by line, the incomplete last line is kept by the framer
+                for line in framer.feed(data):
                     line = line.strip()
                     if not line:
                         continue
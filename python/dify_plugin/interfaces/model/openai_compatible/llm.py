@@ -10,6 +10,7 @@ from urllib.parse import urljoin
 import requests
 from pydantic import TypeAdapter, ValidationError
 
+from dify_plugin.core.utils.cancellation import cancellable, request_timeout
 from dify_plugin.entities import I18nObject
 from dify_plugin.entities.model import (
     AIModelEntity,
@@ -46,6 +47,8 @@ from dify_plugin.interfaces.model.openai_compatible.common import _CommonOaiApiC
 
 logger = logging.getLogger(__name__)
 
+_json_object_adapter = TypeAdapter(dict[str, Any])
+
 
 def _gen_tool_call_id() -> str:
     return f"chatcmpl-tool-{uuid.uuid4().hex!s}"
@@ -200,7 +203,9 @@ class OAICompatLargeLanguageModel(_CommonOaiApiCompat, LargeLanguageModel):
             if stream_mode_auth == "use":
                 data["stream"] = True
                 data["max_tokens"] = 10
-                response = requests.post(endpoint_url, headers=headers, json=data, timeout=(10, 300), stream=True)
+                response = requests.post(
+                    endpoint_url, headers=headers, json=data, timeout=request_timeout((10, 300)), stream=True
+                )
                 if response.status_code != 200:
                     raise CredentialsValidateFailedError(
                         f"Credentials validation failed with status code {response.status_code}"
@@ -208,7 +213,7 @@ class OAICompatLargeLanguageModel(_CommonOaiApiCompat, LargeLanguageModel):
                 return
 
             # send a post request to validate the credentials
-            response = requests.post(endpoint_url, headers=headers, json=data, timeout=(10, 300))
+            response = requests.post(endpoint_url, headers=headers, json=data, timeout=request_timeout((10, 300)))
 
             if response.status_code != 200:
                 raise CredentialsValidateFailedError(
@@ -410,7 +415,7 @@ class OAICompatLargeLanguageModel(_CommonOaiApiCompat, LargeLanguageModel):
                 if not json_schema:
                     raise ValueError("Must define JSON Schema when the response format is json_schema")
                 try:
-                    schema = TypeAdapter(dict[str, Any]).validate_json(json_schema)
+                    schema = _json_object_adapter.validate_json(json_schema)
                 except Exception as exc:
                     raise ValueError(f"not correct json_schema format: {json_schema}") from exc
                 model_parameters.pop("json_schema")
@@ -460,7 +465,9 @@ class OAICompatLargeLanguageModel(_CommonOaiApiCompat, LargeLanguageModel):
         if user:
             data["user"] = user
 
-        response = requests.post(endpoint_url, headers=headers, json=data, timeout=(10, 300), stream=stream)
+        response = requests.post(
+            endpoint_url, headers=headers, json=data, timeout=request_timeout((10, 300)), stream=stream
+        )
 
         if response.encoding is None or response.encoding == "ISO-8859-1":
             response.encoding = "utf-8"
@@ -521,7 +528,8 @@ class OAICompatLargeLanguageModel(_CommonOaiApiCompat, LargeLanguageModel):
         # delimiter for stream response, need unicode_escape
         delimiter = credentials.get("stream_mode_delimiter", "\n\n")
         delimiter = codecs.decode(delimiter, "unicode_escape")
-        for chunk in response.iter_lines(decode_unicode=True, delimiter=delimiter):
+        # the connection is closed early if the session is cancelled
+        for chunk in cancellable(response.iter_lines(decode_unicode=True, delimiter=delimiter), response.close):
             chunk = chunk.strip()
             if chunk:
                 # ignore sse comments
@@ -532,7 +540,7 @@ class OAICompatLargeLanguageModel(_CommonOaiApiCompat, LargeLanguageModel):
                     continue
 
                 try:
-                    chunk_json: dict = TypeAdapter(dict[str, Any]).validate_json(decoded_chunk)
+                    chunk_json: dict = _json_object_adapter.validate_json(decoded_chunk)
                 # stream ended
                 except ValidationError:
                     yield self._create_final_llm_result_chunk(
@@ -4,6 +4,7 @@ from typing import Optional
 from requests import HTTPError, post
 from yarl import URL
 
+from dify_plugin.core.utils.cancellation import request_timeout
 from dify_plugin.entities import I18nObject
 from dify_plugin.entities.model import AIModelEntity, FetchFrom, ModelType
 from dify_plugin.entities.model.rerank import RerankDocument, RerankResult
@@ -71,7 +72,7 @@ class OAICompatRerankModel(RerankModel):
         }
 
         try:
-            response = post(str(URL(url) / "rerank"), headers=headers, data=dumps(data), timeout=60)
+            response = post(str(URL(url) / "rerank"), headers=headers, data=dumps(data), timeout=request_timeout(60))
             response.raise_for_status()
             results = response.json()
 
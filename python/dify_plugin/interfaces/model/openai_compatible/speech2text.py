@@ -3,6 +3,7 @@ from urllib.parse import urljoin
 
 import requests
 
+from dify_plugin.core.utils.cancellation import request_timeout
 from dify_plugin.errors.model import (
     CredentialsValidateFailedError,
     InvokeBadRequestError,
@@ -39,7 +40,9 @@ class OAICompatSpeech2TextModel(_CommonOaiApiCompat, Speech2TextModel):
 
         payload = {"model": model}
         files = [("file", file)]
-        response = requests.post(endpoint_url, headers=headers, data=payload, files=files)  # noqa: S113
+        response = requests.post(
+            endpoint_url, headers=headers, data=payload, files=files, timeout=request_timeout(None)
+        )
 
         if response.status_code != 200:
             raise InvokeBadRequestError(response.text)
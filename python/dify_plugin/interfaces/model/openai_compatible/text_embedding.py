@@ -6,6 +6,7 @@ from urllib.parse import urljoin
 
 import requests
 
+from dify_plugin.core.utils.cancellation import request_timeout
 from dify_plugin.entities import I18nObject
 from dify_plugin.entities.model import (
     AIModelEntity,
@@ -107,7 +108,7 @@ class OAICompatEmbeddingModel(_CommonOaiApiCompat, TextEmbeddingModel):
                 endpoint_url,
                 headers=headers,
                 data=json.dumps(payload),
-                timeout=(10, 300),
+                timeout=request_timeout((10, 300)),
             )
 
             response.raise_for_status()  # Raise an exception for HTTP errors
@@ -164,7 +165,7 @@ class OAICompatEmbeddingModel(_CommonOaiApiCompat, TextEmbeddingModel):
                 url=endpoint_url,
                 headers=headers,
                 data=json.dumps(payload),
-                timeout=(10, 300),
+                timeout=request_timeout((10, 300)),
             )
 
             if response.status_code != 200:
@@ -4,6 +4,7 @@ from urllib.parse import urljoin
 
 import requests
 
+from dify_plugin.core.utils.cancellation import cancellable, request_timeout
 from dify_plugin.entities import I18nObject
 from dify_plugin.entities.model import (
     AIModelEntity,
@@ -72,13 +73,15 @@ class OAICompatText2SpeechModel(_CommonOaiApiCompat, TTSModel):
             }
 
             # Make POST request
-            response = requests.post(endpoint_url, headers=headers, json=payload, stream=True)  # noqa: S113
+            response = requests.post(
+                endpoint_url, headers=headers, json=payload, stream=True, timeout=request_timeout(None)
+            )
 
             if response.status_code != 200:
                 raise InvokeBadRequestError(response.text)
 
             # Stream the audio data
-            for chunk in response.iter_content(chunk_size=4096):
+            for chunk in cancellable(response.iter_content(chunk_size=4096), response.close):
                 if chunk:
                     yield chunk
 
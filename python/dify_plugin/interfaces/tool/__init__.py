@@ -7,9 +7,10 @@ from werkzeug import Request
 from dify_plugin.core.runtime import Session
 from dify_plugin.entities.agent import AgentInvokeMessage
 from dify_plugin.entities.tool import LogMetadata, ToolInvokeMessage, ToolParameter, ToolRuntime, ToolSelector
+from dify_plugin.file.cache import is_prefetch_enabled
 from dify_plugin.file.constants import DIFY_FILE_IDENTITY, DIFY_TOOL_SELECTOR_IDENTITY
 from dify_plugin.file.entities import FileType
-from dify_plugin.file.file import File
+from dify_plugin.file.file import File, prefetch_files
 
 T = TypeVar("T", bound=ToolInvokeMessage | AgentInvokeMessage)
 
@@ -202,7 +203,7 @@ class ToolLike(ABC, Generic[T]):
             elif isinstance(value, list) and all(
                 isinstance(item, dict) and item.get("dify_model_identity") == DIFY_FILE_IDENTITY for item in value
             ):
-                tool_parameters[parameter] = [
+                files = [
                     File(
                         url=item["url"],
                         mime_type=item.get("mime_type"),
@@ -213,6 +214,10 @@ class ToolLike(ABC, Generic[T]):
                     )
                     for item in value
                 ]
+                if len(files) > 1 and is_prefetch_enabled():
+                    # download the files concurrently while the tool starts, reading one waits for its download
+                    prefetch_files(files)
+                tool_parameters[parameter] = files
             elif isinstance(value, dict) and value.get("dify_model_identity") == DIFY_TOOL_SELECTOR_IDENTITY:
                 tool_parameters[parameter] = ToolSelector.model_validate(value)
             elif isinstance(value, list) and all(
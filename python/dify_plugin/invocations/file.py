@@ -1,11 +1,12 @@
 from enum import Enum
 from typing import Optional
 
-import requests
 from pydantic import BaseModel, model_validator
 
 from dify_plugin.core.entities.invocation import InvokeType
 from dify_plugin.core.runtime import BackwardsInvocation
+from dify_plugin.core.utils.cancellation import request_timeout
+from dify_plugin.core.utils.http_client import get_http_client
 
 
 class UploadFileResponse(BaseModel):
@@ -72,7 +73,9 @@ class File(BackwardsInvocation[dict]):
             if not url:
                 raise Exception("upload file failed, could not get signed url")
 
-            response = requests.post(url, files={"file": (filename, content, mimetype)})  # noqa: S113
+            response = get_http_client().post(
+                url, files={"file": (filename, content, mimetype)}, timeout=request_timeout(None)
+            )
             if response.status_code != 201:
                 raise Exception(f"upload file failed, status code: {response.status_code}, response: {response.text}")
 
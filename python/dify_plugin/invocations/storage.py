@@ -1,7 +1,21 @@
-from binascii import hexlify, unhexlify
+import json
+import uuid
+from binascii import unhexlify
+from collections.abc import Generator, Iterable, Mapping, Sequence
+from typing import Optional
 
 from dify_plugin.core.entities.invocation import InvokeType
-from dify_plugin.core.runtime import BackwardsInvocation
+from dify_plugin.core.runtime import BackwardsInvocation, BackwardsInvocationResult
+
+# bytes of a chunk stored by `set_stream`
+STREAM_CHUNK_SIZE = 1024 * 1024
+# chunks sent or fetched with a single round trip by the streaming methods
+STREAM_WINDOW = 4
+
+# a value stored with `set_stream` is a manifest referencing its chunks
+_STREAM_MANIFEST_PREFIX = b"\x00dify-storage-stream:"
+# suffix of the key keeping a copy of the manifest, looked up without reading the value of the key
+_STREAM_MANIFEST_SUFFIX = ".stream-manifest"
 
 
 class StorageInvocationError(Exception):
@@ -23,7 +37,8 @@ class StorageInvocation(BackwardsInvocation[dict]):
         for data in self._backwards_invoke(
             InvokeType.Storage,
             dict,
-            {"opt": "set", "key": key, "value": hexlify(val).decode()},
+            # binary values are hex encoded or sent as a blob frame by the session writer
+            {"opt": "set", "key": key, "value": val},
         ):
             if data["data"] == "ok":
                 return
@@ -45,10 +60,179 @@ class StorageInvocation(BackwardsInvocation[dict]):
                 "key": key,
             },
         ):
+            if "data_blob" in data:
+                # received as a blob frame
+                return data["data_blob"]
             return unhexlify(data["data"])
 
         raise StorageInvocationError("no data found")
 
+    def get_many(self, keys: Sequence[str]) -> list[bytes]:
+        """get several keys from persistence storage with a single round trip.
+
+        :return: the values in the order of the keys
+        :raises:
+            NotFoundError: If one of the keys does not exist.
+        """
+        return self._get_many(keys)
+
+    def set_many(self, items: Mapping[str, bytes]) -> None:
+        """set several values into persistence storage with a single round trip.
+
+        :raises:
+            StorageInvocationError: If one of the invocations returns an invalid data.
+        """
+        self._set_many(items)
+
+    def delete_many(self, keys: Sequence[str]) -> None:
+        """delete several keys from persistence storage with a single round trip.
+
+        :raises:
+            StorageInvocationError: If one of the invocations returns an invalid data.
+        """
+        self._delete_many(keys)
+
+    def set_stream(
+        self,
+        key: str,
+        chunks: Iterable[bytes],
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        window: int = STREAM_WINDOW,
+        replace: bool = True,
+    ) -> None:
+        """store a large value in chunks, at most `window` chunks are held in memory at once.
+
+        The chunks are stored under keys of their own, `key` references them once all of them
+        were stored, a value stored with `set_stream` must be read with `get_stream`.
+
+        :param chunks: the value, in pieces of any size
+        :param chunk_size: bytes of a stored chunk
+        :param window: chunks sent with a single round trip
+        :param replace: delete the chunks of a value previously stored with `set_stream`, pass False
+            when the key holds no such value to skip looking it up
+        """
+        previous = self._read_manifest(key) if replace else None
+        stream_id = uuid.uuid4().hex
+        count = 0
+        size = 0
+        batch: dict[str, bytes] = {}
+        for chunk in _rechunk(chunks, chunk_size):
+            batch[_chunk_key(key, stream_id, count)] = chunk
+            count += 1
+            size += len(chunk)
+            if len(batch) >= window:
+                self._set_many(batch)
+                batch = {}
+        if batch:
+            self._set_many(batch)
+
+        manifest = _STREAM_MANIFEST_PREFIX + json.dumps({"id": stream_id, "chunks": count, "size": size}).encode()
+        self._set_many({_manifest_key(key): manifest, key: manifest})
+        if previous is not None:
+            self._delete_chunks(key, previous, window)
+
+    def get_stream(self, key: str, window: int = STREAM_WINDOW) -> Generator[bytes, None, None]:
+        """read a value in chunks, at most `window` chunks are held in memory at once.
+
+        A value stored with `set` is yielded as a single chunk.
+
+        :raises:
+            NotFoundError: If the key does not exist.
+        """
+        value = self._get_many([key])[0]
+        manifest = _parse_manifest(value)
+        if manifest is None:
+            yield value
+            return
+
+        del value
+        for start in range(0, manifest["chunks"], window):
+            keys = [
+                _chunk_key(key, manifest["id"], index)
+                for index in range(start, min(start + window, manifest["chunks"]))
+            ]
+            yield from self._get_many(keys)
+
+    def delete_stream(self, key: str, window: int = STREAM_WINDOW) -> None:
+        """delete a value stored with `set_stream` and its chunks.
+
+        :raises:
+            StorageInvocationError: If one of the invocations returns an invalid data.
+        """
+        manifest = self._read_manifest(key)
+        self._delete_many([key])
+        if manifest is not None:
+            self._delete_many([_manifest_key(key)])
+            self._delete_chunks(key, manifest, window)
+
+    def _read_manifest(self, key: str) -> Optional[dict]:
+        # the copy under its own key is small, a large value stored with `set` is never read
+        manifest_key = _manifest_key(key)
+        for data in self._backwards_invoke(InvokeType.Storage, dict, {"opt": "exist", "key": manifest_key}):
+            if not data["data"]:
+                return None
+        return _parse_manifest(self._get_many([manifest_key])[0])
+
+    def _delete_chunks(self, key: str, manifest: dict, window: int) -> None:
+        keys = [_chunk_key(key, manifest["id"], index) for index in range(manifest["chunks"])]
+        for start in range(0, len(keys), window):
+            self._delete_many(keys[start : start + window])
+
+    def _get_many(self, keys: Sequence[str]) -> list[bytes]:
+        values = []
+        for result in self._backwards_invoke_batch(
+            [(InvokeType.Storage, {"opt": "get", "key": key}) for key in keys],
+            dict,
+        ):
+            for data in result.result():
+                values.append(data["data_blob"] if "data_blob" in data else unhexlify(data["data"]))
+                break
+            else:
+                raise StorageInvocationError("no data found")
+        return values
+
+    def _set_many(self, items: Mapping[str, bytes]) -> None:
+        errors = self._send_sets(items)
+        if errors:
+            raise next(iter(errors.values()))
+
+    def _send_sets(self, items: Mapping[str, bytes]) -> dict[str, Exception]:
+        """
+        Set a batch of values, returns the errors of the keys which were not stored, in the order of the keys
+        """
+        keys = list(items)
+        errors = self._batch_errors(
+            self._backwards_invoke_batch(
+                [(InvokeType.Storage, {"opt": "set", "key": key, "value": val}) for key, val in items.items()],
+                dict,
+            )
+        )
+        return {keys[index]: errors[index] for index in sorted(errors)}
+
+    def _delete_many(self, keys: Sequence[str]) -> None:
+        self._check_ok(
+            self._backwards_invoke_batch([(InvokeType.Storage, {"opt": "del", "key": key}) for key in keys], dict)
+        )
+
+    def _check_ok(self, results: Iterable[BackwardsInvocationResult[dict]]) -> None:
+        errors = self._batch_errors(results)
+        if errors:
+            raise errors[min(errors)]
+
+    def _batch_errors(self, results: Iterable[BackwardsInvocationResult[dict]]) -> dict[int, Exception]:
+        # wait for every invocation of the batch before reporting the failures
+        errors: dict[int, Exception] = {}
+        for result in results:
+            try:
+                responses = result.result()
+                if not responses:
+                    raise StorageInvocationError("no data found")
+                if responses[0]["data"] != "ok":
+                    raise StorageInvocationError(f"unexpected data: {responses[0]['data']}")
+            except Exception as e:
+                errors[result.index] = e
+        return errors
+
     def delete(self, key: str) -> None:
         """delete a key from persistence storage.
 
@@ -70,6 +254,9 @@ class StorageInvocation(BackwardsInvocation[dict]):
 
         raise StorageInvocationError("no data found")
 
+    def flush(self) -> None:
+        """flush the writes held back by the storage, writes are sent immediately by default."""
+
     def exist(self, key: str) -> bool:
         """Check for the existence of a key in persistence storage.
 
@@ -87,3 +274,31 @@ class StorageInvocation(BackwardsInvocation[dict]):
             return data["data"]
 
         raise StorageInvocationError("no data found")
+
+
+def _chunk_key(key: str, stream_id: str, index: int) -> str:
+    return f"{key}.chunk.{stream_id}.{index}"
+
+
+def _manifest_key(key: str) -> str:
+    return f"{key}{_STREAM_MANIFEST_SUFFIX}"
+
+
+def _parse_manifest(value: bytes) -> Optional[dict]:
+    if not value.startswith(_STREAM_MANIFEST_PREFIX):
+        return None
+    return json.loads(value[len(_STREAM_MANIFEST_PREFIX) :])
+
+
+def _rechunk(chunks: Iterable[bytes], chunk_size: int) -> Generator[bytes, None, None]:
+    """
+    Split or merge pieces of any size into chunks of chunk_size bytes, the last one may be shorter
+    """
+    buffer = bytearray()
+    for piece in chunks:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,322 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Generator, Iterable, Mapping, Sequence
+from typing import Optional
+
+from pydantic import BaseModel
+
+from dify_plugin.core.runtime import Session
+from dify_plugin.invocations.storage import STREAM_CHUNK_SIZE, STREAM_WINDOW, StorageInvocation
+
+# bytes accounted for an entry besides its key and value
+_ENTRY_OVERHEAD = 64
+
+
+class StorageCacheStats(BaseModel):
+    hits: int
+    misses: int
+    # `exist` calls answered by a cached absence
+    negative_hits: int
+    evictions: int
+    expirations: int
+    # `set` calls merged into a later one by write-behind
+    coalesced_writes: int
+    entries: int
+    size: int
+
+
+class _Entry:
+    __slots__ = ("expires_at", "size", "value")
+
+    def __init__(self, value: Optional[bytes], expires_at: float, size: int) -> None:
+        # None caches the absence of the key
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class StorageCache:
+    """
+    In-process LRU cache of storage values of a session.
+
+    Entries are keyed by the storage key only, the storage of the daemon is scoped by workspace
+    so a cache must not be shared by sessions which may belong to different workspaces.
+    Entries expire after `ttl` seconds, the least recently used entries are evicted once the
+    cached values exceed `max_size` bytes. The cache only sees the writes of its session,
+    `ttl` bounds how stale a value written by another session can get.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        negative_ttl: Optional[float] = None,
+        write_behind: bool = False,
+    ) -> None:
+        """
+        :param max_size: bytes of cached keys and values
+        :param ttl: seconds a value is cached
+        :param negative_ttl: seconds the absence of a key is cached, defaults to ttl
+        :param write_behind: hold the sets of a session until it ends, see `CachedStorageInvocation`
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.write_behind = write_behind
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced_writes = 0
+
+    def lookup(self, key: str) -> tuple[bool, Optional[bytes]]:
+        """
+        Cached state of a key, (False, None) if it is not cached, (True, None) if it is known to be absent
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            if entry.value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry.value
+
+    def put(self, key: str, value: bytes) -> None:
+        self._store(key, value, self.ttl)
+
+    def put_absent(self, key: str) -> None:
+        """
+        Cache that the key does not exist
+        """
+        self._store(key, None, self.negative_ttl)
+
+    def record_coalesced_write(self) -> None:
+        with self._lock:
+            self.coalesced_writes += 1
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """
+        Drop a key, or every key
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._size = 0
+            elif key in self._entries:
+                self._remove(key)
+
+    def stats(self) -> StorageCacheStats:
+        with self._lock:
+            return StorageCacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                negative_hits=self.negative_hits,
+                evictions=self.evictions,
+                expirations=self.expirations,
+                coalesced_writes=self.coalesced_writes,
+                entries=len(self._entries),
+                size=self._size,
+            )
+
+    def _store(self, key: str, value: Optional[bytes], ttl: float) -> None:
+        size = len(key) + len(value or b"") + _ENTRY_OVERHEAD
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if ttl <= 0 or size > self.max_size:
+                return
+
+            self._entries[key] = _Entry(value, time.monotonic() + ttl, size)
+            self._size += size
+            while self._size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        # the caller holds the lock
+        self._size -= self._entries.pop(key).size
+
+
+class CachedStorageInvocation(StorageInvocation):
+    """
+    Storage of a session behind the `StorageCache` of the session.
+
+    Reads are served from the cache when possible, writes go to the daemon and update the
+    cache. With write-behind, sets are held until `flush`, which is called when the session
+    ends: repeated sets of a key only send the last value, and a held value is dropped from the
+    cache if sending it fails.
+    """
+
+    def __init__(self, session: Session, cache: StorageCache) -> None:
+        super().__init__(session)
+        self.cache = cache
+        # key -> value of the sets held by write-behind
+        self._pending: dict[str, bytes] = {}
+        self._pending_lock = threading.Lock()
+
+    def _lookup(self, key: str) -> tuple[bool, Optional[bytes]]:
+        # the sets held by write-behind win over the cache, which may have evicted them
+        with self._pending_lock:
+            if key in self._pending:
+                return True, self._pending[key]
+        return self.cache.lookup(key)
+
+    def get(self, key: str) -> bytes:
+        _, value = self._lookup(key)
+        if value is not None:
+            return value
+
+        # a cached absence only answers `exist`, the daemon reports the missing key
+        value = super().get(key)
+        self.cache.put(key, value)
+        return value
+
+    def get_many(self, keys: Sequence[str]) -> list[bytes]:
+        values: dict[str, bytes] = {}
+        for key in keys:
+            _, value = self._lookup(key)
+            if value is not None:
+                values[key] = value
+
+        missing = [key for key in dict.fromkeys(keys) if key not in values]
+        if missing:
+            for key, value in zip(missing, super().get_many(missing), strict=True):
+                self.cache.put(key, value)
+                values[key] = value
+
+        return [values[key] for key in keys]
+
+    def set(self, key: str, val: bytes) -> None:
+        val = bytes(val)
+        if self.cache.write_behind:
+            with self._pending_lock:
+                if key in self._pending:
+                    self.cache.record_coalesced_write()
+                self._pending[key] = val
+            self.cache.put(key, val)
+            return
+
+        try:
+            super().set(key, val)
+        except Exception:
+            self.cache.invalidate(key)
+            raise
+        self.cache.put(key, val)
+
+    def set_many(self, items: Mapping[str, bytes]) -> None:
+        if self.cache.write_behind:
+            for key, val in items.items():
+                self.set(key, val)
+            return
+
+        try:
+            super().set_many(items)
+        except Exception:
+            for key in items:
+                self.cache.invalidate(key)
+            raise
+        for key, val in items.items():
+            self.cache.put(key, bytes(val))
+
+    def set_stream(
+        self,
+        key: str,
+        chunks: Iterable[bytes],
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        window: int = STREAM_WINDOW,
+        replace: bool = True,
+    ) -> None:
+        # large values are not cached, the chunks are written directly
+        self._discard_pending(key)
+        try:
+            super().set_stream(key, chunks, chunk_size, window, replace)
+        finally:
+            self.cache.invalidate(key)
+
+    def get_stream(self, key: str, window: int = STREAM_WINDOW) -> Generator[bytes, None, None]:
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            yield pending
+            return
+        yield from super().get_stream(key, window)
+
+    def exist(self, key: str) -> bool:
+        cached, value = self._lookup(key)
+        if cached:
+            return value is not None
+
+        exists = super().exist(key)
+        if not exists:
+            self.cache.put_absent(key)
+        return exists
+
+    def delete(self, key: str) -> None:
+        self._discard_pending(key)
+        try:
+            super().delete(key)
+        except Exception:
+            self.cache.invalidate(key)
+            raise
+        self.cache.put_absent(key)
+
+    def delete_many(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            self._discard_pending(key)
+        try:
+            super().delete_many(keys)
+        except Exception:
+            for key in keys:
+                self.cache.invalidate(key)
+            raise
+        for key in keys:
+            self.cache.put_absent(key)
+
+    def delete_stream(self, key: str, window: int = STREAM_WINDOW) -> None:
+        self._discard_pending(key)
+        try:
+            super().delete_stream(key, window)
+        except Exception:
+            self.cache.invalidate(key)
+            raise
+        self.cache.put_absent(key)
+
+    def _discard_pending(self, key: str) -> None:
+        with self._pending_lock:
+            self._pending.pop(key, None)
+
+    def flush(self) -> None:
+        """
+        Send the sets held by write-behind
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            errors = self._send_sets(pending)
+        except Exception:
+            for key in pending:
+                self.cache.invalidate(key)
+            raise
+
+        # the cache must not keep values which never reached the storage
+        for key in errors:
+            self.cache.invalidate(key)
+        if errors:
+            raise next(iter(errors.values()))
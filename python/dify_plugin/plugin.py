@@ -4,6 +4,7 @@ import uuid
 from collections.abc import Generator
 from typing import Any, Optional
 
+import httpx
 from pydantic import RootModel
 from yarl import URL
 
@@ -24,11 +25,16 @@ from dify_plugin.core.server.__base.request_reader import RequestReader
 from dify_plugin.core.server.__base.response_writer import ResponseWriter
 from dify_plugin.core.server.io_server import IOServer
 from dify_plugin.core.server.router import Router
-from dify_plugin.core.server.serverless.request_reader import ServerlessRequestReader
+from dify_plugin.core.server.serverless.request_reader import LoadThresholds, ServerlessRequestReader
 from dify_plugin.core.server.stdio.request_reader import StdioRequestReader
 from dify_plugin.core.server.stdio.response_writer import StdioResponseWriter
 from dify_plugin.core.server.tcp.request_reader import TCPReaderWriter
+from dify_plugin.core.server.tcp.sharded import ShardedTCPReaderWriter
+from dify_plugin.core.utils.cancellation import CancellationToken, cancellable, use_cancellation_token
+from dify_plugin.core.utils.http_client import configure_http_client
 from dify_plugin.entities.tool import ToolInvokeMessage
+from dify_plugin.file.cache import configure_file_cache
+from dify_plugin.invocations.storage_cache import StorageCache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -43,7 +49,20 @@ class Plugin(IOServer, Router):
         # load plugin configuration
         self.registration = PluginRegistration(config)
 
-        if InstallMethod.Local == config.INSTALL_METHOD:
+        configure_http_client(
+            httpx.Limits(
+                max_connections=config.HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=config.HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.HTTP_POOL_KEEPALIVE_EXPIRY,
+            ),
+            http2=config.HTTP2,
+        )
+        configure_file_cache(config.FILE_CACHE_SIZE, config.FILE_SPOOL_THRESHOLD, config.FILE_PREFETCH)
+
+        if config.WORKER_ID is not None:
+            # worker processes talk to the main process over stdio whatever the install method
+            request_reader, response_writer = self._launch_worker_stream(config)
+        elif InstallMethod.Local == config.INSTALL_METHOD:
             request_reader, response_writer = self._launch_local_stream(config)
         elif InstallMethod.Remote == config.INSTALL_METHOD:
             request_reader, response_writer = self._launch_remote_stream(config)
@@ -68,13 +87,26 @@ class Plugin(IOServer, Router):
         """
         Launch local stream
         """
-        reader = StdioRequestReader()
-        writer = StdioResponseWriter()
+        writer = StdioResponseWriter(
+            flush_interval=config.STDIO_FLUSH_INTERVAL,
+            flush_size=config.STDIO_FLUSH_SIZE,
+        )
+        reader = StdioRequestReader(writer)
         writer.write(self.registration.configuration.model_dump_json() + "\n\n")
 
         self._log_configuration()
         return reader, writer
 
+    def _launch_worker_stream(self, config: DifyPluginEnv) -> tuple[RequestReader, Optional[ResponseWriter]]:
+        """
+        Launch the stream of a worker process, connected to the main process
+        """
+        writer = StdioResponseWriter(
+            flush_interval=config.STDIO_FLUSH_INTERVAL,
+            flush_size=config.STDIO_FLUSH_SIZE,
+        )
+        return StdioRequestReader(writer), writer
+
     def _launch_remote_stream(self, config: DifyPluginEnv) -> tuple[RequestReader, Optional[ResponseWriter]]:
         """
         Launch remote stream
@@ -85,12 +117,34 @@ class Plugin(IOServer, Router):
         install_host, install_port = self._get_remote_install_host_and_port(config)
         logging.debug(f"Remote installing to {install_host}:{install_port}")
 
-        tcp_stream = TCPReaderWriter(
-            install_host,
-            install_port,
-            config.REMOTE_INSTALL_KEY,
-            on_connected=lambda: self._initialize_tcp_stream(tcp_stream),
-        )
+        options = {
+            "framing": config.REMOTE_INSTALL_FRAMING,
+            "handshake_timeout": config.REMOTE_INSTALL_HANDSHAKE_TIMEOUT,
+            "max_pending_bytes": config.REMOTE_INSTALL_WRITE_BUFFER_SIZE,
+            "resume": config.REMOTE_INSTALL_RESUME,
+            "replay_buffer_size": config.REMOTE_INSTALL_REPLAY_BUFFER_SIZE,
+        }
+
+        tcp_stream: TCPReaderWriter | ShardedTCPReaderWriter
+        if config.REMOTE_INSTALL_CONNECTIONS > 1:
+            sharded_stream = ShardedTCPReaderWriter(
+                install_host,
+                install_port,
+                config.REMOTE_INSTALL_KEY,
+                connections=config.REMOTE_INSTALL_CONNECTIONS,
+                # declarations are sent on the first connection
+                on_connected=lambda: self._initialize_tcp_stream(sharded_stream.primary),
+                **options,
+            )
+            tcp_stream = sharded_stream
+        else:
+            tcp_stream = TCPReaderWriter(
+                install_host,
+                install_port,
+                config.REMOTE_INSTALL_KEY,
+                on_connected=lambda: self._initialize_tcp_stream(tcp_stream),
+                **options,
+            )
 
         tcp_stream.launch()
 
@@ -103,55 +157,50 @@ class Plugin(IOServer, Router):
         class List(RootModel):
             root: list[Any]
 
-        tcp_stream.write(
+        tcp_stream.write_message(
             InitializeMessage(
                 type=InitializeMessage.Type.MANIFEST_DECLARATION,
                 data=self.registration.configuration.model_dump(),
-            ).model_dump_json()
-            + "\n\n"
+            )
         )
 
         if self.registration.tools_configuration:
-            tcp_stream.write(
+            tcp_stream.write_message(
                 InitializeMessage(
                     type=InitializeMessage.Type.TOOL_DECLARATION,
                     data=List(root=self.registration.tools_configuration).model_dump(),
-                ).model_dump_json()
-                + "\n\n"
+                )
             )
 
         if self.registration.models_configuration:
-            tcp_stream.write(
+            tcp_stream.write_message(
                 InitializeMessage(
                     type=InitializeMessage.Type.MODEL_DECLARATION,
                     data=List(root=self.registration.models_configuration).model_dump(),
-                ).model_dump_json()
-                + "\n\n"
+                )
             )
 
         if self.registration.endpoints_configuration:
-            tcp_stream.write(
+            tcp_stream.write_message(
                 InitializeMessage(
                     type=InitializeMessage.Type.ENDPOINT_DECLARATION,
                     data=List(root=self.registration.endpoints_configuration).model_dump(),
-                ).model_dump_json()
-                + "\n\n"
+                )
             )
 
         if self.registration.agent_strategies_configuration:
-            tcp_stream.write(
+            tcp_stream.write_message(
                 InitializeMessage(
                     type=InitializeMessage.Type.AGENT_STRATEGY_DECLARATION,
                     data=List(root=self.registration.agent_strategies_configuration).model_dump(),
-                ).model_dump_json()
-                + "\n\n"
+                )
             )
 
         for file in self.registration.files:
             # divide the file into chunks
             chunks = [file.data[i : i + 8192] for i in range(0, len(file.data), 8192)]
             for sequence, chunk in enumerate(chunks):
-                tcp_stream.write(
+                tcp_stream.write_message(
                     InitializeMessage(
                         type=InitializeMessage.Type.ASSET_CHUNK,
                         data=InitializeMessage.AssetChunk(
@@ -159,16 +208,14 @@ class Plugin(IOServer, Router):
                             data=base64.b64encode(chunk).decode(),
                             end=sequence == len(chunks) - 1,
                         ).model_dump(),
-                    ).model_dump_json()
-                    + "\n\n"
+                    )
                 )
 
-        tcp_stream.write(
+        tcp_stream.write_message(
             InitializeMessage(
                 type=InitializeMessage.Type.END,
                 data={},
-            ).model_dump_json()
-            + "\n\n"
+            )
         )
 
         self._log_configuration()
@@ -178,14 +225,24 @@ class Plugin(IOServer, Router):
         Launch Serverless stream
         """
         serverless = ServerlessRequestReader(
-            config.SERVERLESS_HOST,
-            config.SERVERLESS_PORT,
-            config.SERVERLESS_WORKER_CLASS,
-            config.SERVERLESS_WORKERS,
-            config.SERVERLESS_THREADS,
-            config.MAX_REQUEST_TIMEOUT,
+            host=config.SERVERLESS_HOST,
+            port=config.SERVERLESS_PORT,
+            worker_class=config.SERVERLESS_WORKER_CLASS,
+            workers=config.SERVERLESS_WORKERS,
+            worker_connections=config.SERVERLESS_WORKER_CONNECTIONS,
+            threads=config.SERVERLESS_THREADS,
+            max_single_connection_lifetime=config.MAX_REQUEST_TIMEOUT,
+            graceful_timeout=config.SERVERLESS_GRACEFUL_TIMEOUT,
+            coalesce_bytes=config.SERVERLESS_COALESCE_BYTES,
+            thresholds=LoadThresholds(
+                max_occupancy=config.SERVERLESS_READY_MAX_OCCUPANCY,
+                max_queued=config.SERVERLESS_READY_MAX_QUEUED,
+                max_wait=config.SERVERLESS_READY_MAX_WAIT,
+                shed_queued=config.SERVERLESS_SHED_QUEUED,
+                retry_after=config.SERVERLESS_SHED_RETRY_AFTER,
+            ),
         )
-        serverless.launch()
+        # the server is launched by `run`, after the worker processes are forked
 
         return serverless, None
 
@@ -208,98 +265,98 @@ class Plugin(IOServer, Router):
         """
         self.register_route(
             self.plugin_executer.invoke_tool,
-            lambda data: data.get("type") == PluginInvokeType.Tool.value
-            and data.get("action") == ToolActions.InvokeTool.value,
+            invoke_type=PluginInvokeType.Tool,
+            action=ToolActions.InvokeTool,
         )
 
         self.register_route(
             self.plugin_executer.validate_tool_provider_credentials,
-            lambda data: data.get("type") == PluginInvokeType.Tool.value
-            and data.get("action") == ToolActions.ValidateCredentials.value,
+            invoke_type=PluginInvokeType.Tool,
+            action=ToolActions.ValidateCredentials,
         )
 
         self.register_route(
             self.plugin_executer.invoke_agent_strategy,
-            lambda data: data.get("type") == PluginInvokeType.Agent.value
-            and data.get("action") == AgentActions.InvokeAgentStrategy.value,
+            invoke_type=PluginInvokeType.Agent,
+            action=AgentActions.InvokeAgentStrategy,
         )
 
         self.register_route(
             self.plugin_executer.invoke_llm,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.InvokeLLM.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.InvokeLLM,
         )
 
         self.register_route(
             self.plugin_executer.get_llm_num_tokens,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.GetLLMNumTokens.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.GetLLMNumTokens,
         )
 
         self.register_route(
             self.plugin_executer.invoke_text_embedding,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.InvokeTextEmbedding.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.InvokeTextEmbedding,
         )
 
         self.register_route(
             self.plugin_executer.get_text_embedding_num_tokens,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.GetTextEmbeddingNumTokens.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.GetTextEmbeddingNumTokens,
         )
 
         self.register_route(
             self.plugin_executer.invoke_rerank,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.InvokeRerank.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.InvokeRerank,
         )
 
         self.register_route(
             self.plugin_executer.invoke_tts,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.InvokeTTS.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.InvokeTTS,
         )
 
         self.register_route(
             self.plugin_executer.get_tts_model_voices,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.GetTTSVoices.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.GetTTSVoices,
         )
 
         self.register_route(
             self.plugin_executer.invoke_speech_to_text,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.InvokeSpeech2Text.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.InvokeSpeech2Text,
         )
 
         self.register_route(
             self.plugin_executer.invoke_moderation,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.InvokeModeration.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.InvokeModeration,
         )
 
         self.register_route(
             self.plugin_executer.validate_model_provider_credentials,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.ValidateProviderCredentials.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.ValidateProviderCredentials,
         )
 
         self.register_route(
             self.plugin_executer.validate_model_credentials,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.ValidateModelCredentials.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.ValidateModelCredentials,
         )
 
         self.register_route(
             self.plugin_executer.invoke_endpoint,
-            lambda data: data.get("type") == PluginInvokeType.Endpoint.value
-            and data.get("action") == EndpointActions.InvokeEndpoint.value,
+            invoke_type=PluginInvokeType.Endpoint,
+            action=EndpointActions.InvokeEndpoint,
         )
 
         self.register_route(
             self.plugin_executer.get_ai_model_schemas,
-            lambda data: data.get("type") == PluginInvokeType.Model.value
-            and data.get("action") == ModelActions.GetAIModelSchemas.value,
+            invoke_type=PluginInvokeType.Model,
+            action=ModelActions.GetAIModelSchemas,
         )
 
     def _execute_request(
@@ -312,11 +369,13 @@ class Plugin(IOServer, Router):
         message_id: Optional[str] = None,
         app_id: Optional[str] = None,
         endpoint_id: Optional[str] = None,
+        cancellation: Optional[CancellationToken] = None,
     ):
         """
         accept requests and execute
         :param session_id: session id, unique for each request
         :param data: request data
+        :param cancellation: cancelled when the daemon abandons the session
         """
 
         session = Session(
@@ -330,65 +389,100 @@ class Plugin(IOServer, Router):
             message_id=message_id,
             app_id=app_id,
             endpoint_id=endpoint_id,
+            cancellation=cancellation,
+            backwards_invocation_timeout=self.config.BACKWARDS_INVOCATION_TIMEOUT,
+            backwards_invocation_timeouts=self.config.BACKWARDS_INVOCATION_TIMEOUTS,
+            storage_cache=self._new_storage_cache(),
+        )
+        session.cancellation.raise_if_cancelled()
+        try:
+            with use_cancellation_token(session.cancellation):
+                self._write_response(session, self.dispatch(session, data))
+        except BaseException as e:
+            # the writes made before the failure are still sent, the error of the request is the one raised
+            try:
+                session.flush(self.config.STORAGE_CACHE_FLUSH_TIMEOUT)
+            except Exception as flush_error:
+                logger.exception(f"Failed to flush the storage writes of the failed session {session_id}")
+                e.add_note(f"storage writes held back by the session were lost: {flush_error}")
+            raise
+        # storage writes held back by write-behind must reach the daemon before the session ends,
+        # with a deadline of their own since the deadline of the session may have passed already
+        session.flush(self.config.STORAGE_CACHE_FLUSH_TIMEOUT)
+
+    def _new_storage_cache(self) -> Optional[StorageCache]:
+        """
+        storage cache of a session, the storage of the daemon is scoped by workspace so a cache
+        is never shared with another session, which may belong to another workspace
+        """
+        if self.config.STORAGE_CACHE_SIZE <= 0:
+            return None
+        return StorageCache(
+            max_size=self.config.STORAGE_CACHE_SIZE,
+            ttl=self.config.STORAGE_CACHE_TTL,
+            negative_ttl=self.config.STORAGE_CACHE_NEGATIVE_TTL,
+            write_behind=self.config.STORAGE_CACHE_WRITE_BEHIND,
         )
-        response = self.dispatch(session, data)
+
+    def _write_response(self, session: Session, response: Any):
+        """
+        write the response of a request to its session, a streamed response stops early
+        once the session is cancelled
+        """
+        session_id = session.session_id
+        writer = session.writer
         if response:
             if isinstance(response, Generator):
-                for message in response:
+                for message in cancellable(response, token=session.cancellation):
                     if isinstance(message, ToolInvokeMessage) and isinstance(
                         message.message, ToolInvokeMessage.BlobMessage
                     ):
-                        # convert blob to file chunks
-                        id_ = uuid.uuid4().hex
                         blob = message.message.blob
+                        if writer.supports_blob_frames():
+                            # send the whole blob as a single raw frame, the end chunk carries its id
+                            id_ = writer.write_blob(blob, session_id)
+                            chunks = []
+                        else:
+                            # convert blob to file chunks
+                            id_ = uuid.uuid4().hex
+                            # split the blob into chunks
+                            chunks = [blob[i : i + 8192] for i in range(0, len(blob), 8192)]
                         message.message.blob = id_.encode("utf-8")
-                        # split the blob into chunks
-                        chunks = [blob[i : i + 8192] for i in range(0, len(blob), 8192)]
                         for sequence, chunk in enumerate(chunks):
-                            writer.session_message(
+                            writer.session_stream(
                                 session_id=session_id,
-                                data=writer.stream_object(
-                                    data=ToolInvokeMessage(
-                                        type=ToolInvokeMessage.MessageType.BLOB_CHUNK,
-                                        message=ToolInvokeMessage.BlobChunkMessage(
-                                            id=id_,
-                                            sequence=sequence,
-                                            total_length=len(blob),
-                                            blob=chunk,
-                                            end=False,
-                                        ),
-                                        meta=message.meta,
-                                    ),
-                                ),
-                            )
-
-                        # end the file stream
-                        writer.session_message(
-                            session_id=session_id,
-                            data=writer.stream_object(
                                 data=ToolInvokeMessage(
                                     type=ToolInvokeMessage.MessageType.BLOB_CHUNK,
                                     message=ToolInvokeMessage.BlobChunkMessage(
                                         id=id_,
-                                        sequence=len(chunks),
+                                        sequence=sequence,
                                         total_length=len(blob),
-                                        blob=b"",
-                                        end=True,
+                                        blob=chunk,
+                                        end=False,
                                     ),
                                     meta=message.meta,
-                                )
+                                ),
+                            )
+
+                        # end the file stream
+                        writer.session_stream(
+                            session_id=session_id,
+                            data=ToolInvokeMessage(
+                                type=ToolInvokeMessage.MessageType.BLOB_CHUNK,
+                                message=ToolInvokeMessage.BlobChunkMessage(
+                                    id=id_,
+                                    sequence=len(chunks),
+                                    total_length=len(blob),
+                                    blob=b"",
+                                    end=True,
+                                ),
+                                meta=message.meta,
                             ),
                         )
                     else:
-                        writer.session_message(
-                            session_id=session_id,
-                            data=writer.stream_object(data=message),
-                        )
+                        writer.session_stream(session_id=session_id, data=message)
             else:
-                writer.session_message(
-                    session_id=session_id,
-                    data=writer.stream_object(data=response),
-                )
+                writer.session_stream(session_id=session_id, data=response)
 
     @staticmethod
     def _get_remote_install_host_and_port(config: DifyPluginEnv) -> tuple[str, int]:
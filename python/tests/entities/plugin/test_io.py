@@ -0,0 +1,41 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from dify_plugin.core.entities.plugin.io import PluginInStreamBase, PluginInStreamEvent
+
+
+def test_from_json_decodes_routing_fields_eagerly():
+    line = json.dumps(
+        {
+            "session_id": "1",
+            "event": "backwards_response",
+            "conversation_id": "2",
+            "data": {"backwards_request_id": "abc", "data": {"large": "x" * 1000}},
+        }
+    ).encode()
+
+    stream = PluginInStreamBase.from_json(line)
+    assert stream.session_id == "1"
+    assert stream.conversation_id == "2"
+    assert stream.event == PluginInStreamEvent.BackwardInvocationResponse
+    assert stream.backwards_request_id == "abc"
+    # data is decoded on first access
+    assert stream._raw is not None
+    assert stream.data["data"]["large"] == "x" * 1000
+    assert stream._raw is None
+
+
+def test_backwards_request_id_of_eager_stream():
+    stream = PluginInStreamBase(
+        session_id="1",
+        event=PluginInStreamEvent.BackwardInvocationResponse,
+        data={"backwards_request_id": "abc"},
+    )
+    assert stream.backwards_request_id == "abc"
+
+
+def test_from_json_rejects_missing_fields():
+    with pytest.raises(ValidationError):
+        PluginInStreamBase.from_json(b'{"event": "request", "data": {}}')
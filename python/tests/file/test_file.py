@@ -0,0 +1,145 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from dify_plugin.file.cache import DEFAULT_CACHE_SIZE, DEFAULT_SPOOL_THRESHOLD, configure_file_cache, get_file_cache
+from dify_plugin.file.entities import FileType
+from dify_plugin.file.file import File, prefetch_files
+from dify_plugin.interfaces.tool import ToolLike
+
+CONTENT = bytes(range(256)) * 64
+
+# (path, range header) of the requests the server received
+requests: list[tuple[str, str | None]] = []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa: N802
+        requests.append((self.path, self.headers.get("Range")))
+        if self.path.startswith("/slow"):
+            time.sleep(0.2)
+
+        content = CONTENT
+        status = 200
+        byte_range = self.headers.get("Range")
+        if byte_range and not self.path.startswith("/no-range"):
+            start, _, end = byte_range.removeprefix("bytes=").partition("-")
+            content = CONTENT[int(start) : int(end) + 1 if end else None]
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    requests.clear()
+    configure_file_cache(1024 * 1024, 64 * 1024)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    configure_file_cache(DEFAULT_CACHE_SIZE, DEFAULT_SPOOL_THRESHOLD)
+    server.shutdown()
+    server.server_close()
+
+
+def test_files_of_the_same_url_are_downloaded_once(url):
+    first = File(url=f"{url}/file", type=FileType.DOCUMENT)
+    second = File(url=f"{url}/file", type=FileType.DOCUMENT)
+
+    assert first.blob == CONTENT
+    assert second.blob == CONTENT
+    assert b"".join(second.iter_bytes(1000)) == CONTENT
+    assert len(requests) == 1
+
+
+def test_iter_bytes_streams_and_caches_the_content(url):
+    file = File(url=f"{url}/file", type=FileType.DOCUMENT)
+    chunks = list(file.iter_bytes(4096))
+
+    assert [len(chunk) for chunk in chunks] == [4096] * 4
+    assert b"".join(chunks) == CONTENT
+    assert get_file_cache().get(f"{url}/file") == CONTENT
+
+
+def test_open_spools_large_contents_without_caching_them(url):
+    configure_file_cache(1024 * 1024, 1024)
+    file = File(url=f"{url}/file", type=FileType.DOCUMENT)
+
+    with file.open() as f:
+        assert f._rolled  # type: ignore[attr-defined]
+        assert f.read() == CONTENT
+    assert get_file_cache().get(f"{url}/file") is None
+
+
+def test_read_range_downloads_the_range_only(url):
+    file = File(url=f"{url}/file", type=FileType.DOCUMENT)
+
+    assert file.read_range(10, 20) == CONTENT[10:20]
+    assert file.read_range(16000) == CONTENT[16000:]
+    assert requests == [("/file", "bytes=10-19"), ("/file", "bytes=16000-")]
+    assert file.read_range(5, 5) == b""
+
+
+def test_read_range_without_server_support(url):
+    file = File(url=f"{url}/no-range", type=FileType.DOCUMENT)
+
+    assert file.read_range(10, 20) == CONTENT[10:20]
+    # the whole content was sent and cached
+    assert file.read_range(30, 40) == CONTENT[30:40]
+    assert len(requests) == 1
+
+
+def test_read_range_without_server_support_keeps_only_the_range(url):
+    configure_file_cache(0, 0)
+    file = File(url=f"{url}/no-range", type=FileType.DOCUMENT)
+
+    assert file.read_range(5000, 10000) == CONTENT[5000:10000]
+    assert file.read_range(16000) == CONTENT[16000:]
+    assert len(requests) == 2
+
+
+def test_cache_evicts_least_recently_used_contents(url):
+    configure_file_cache(len(CONTENT) * 2, len(CONTENT))
+    for name in ("a", "b", "a", "c"):
+        assert File(url=f"{url}/{name}", type=FileType.DOCUMENT).blob == CONTENT
+
+    cache = get_file_cache()
+    assert cache.get(f"{url}/a") is not None
+    assert cache.get(f"{url}/b") is None
+    assert cache.stats().evictions == 1
+
+
+def test_file_lists_are_prefetched_concurrently(url):
+    configure_file_cache(1024 * 1024, 64 * 1024, prefetch=True)
+    files = [
+        {"dify_model_identity": "__dify__file__", "url": f"{url}/slow/{i}", "type": "document", "size": len(CONTENT)}
+        for i in range(5)
+    ]
+    start = time.monotonic()
+    converted = ToolLike._convert_parameters({"files": files})["files"]
+
+    assert all(file.blob == CONTENT for file in converted)
+    # the downloads ran concurrently, and reading a file waited for its download
+    assert time.monotonic() - start < 0.2 * 3
+    assert len(requests) == 5
+
+
+def test_prefetching_stops_at_the_cache_size(url):
+    configure_file_cache(len(CONTENT) * 2, len(CONTENT), prefetch=True)
+    prefetch_files(File(url=f"{url}/{i}", type=FileType.DOCUMENT, size=len(CONTENT)) for i in range(4))
+
+    deadline = time.monotonic() + 5
+    while get_file_cache().stats().entries < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert sorted(path for path, _ in requests) == ["/0", "/1"]
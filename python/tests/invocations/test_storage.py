@@ -1,9 +1,11 @@
-from collections.abc import Generator
+from binascii import hexlify
+from collections.abc import Generator, Sequence
 from typing import Any
 
 import pytest
 
 from dify_plugin.core.entities.invocation import InvokeType
+from dify_plugin.core.runtime import BackwardsInvocationResult
 from dify_plugin.invocations.storage import (
     StorageInvocation,
     StorageInvocationError,
@@ -62,6 +64,10 @@ class TestStorageInvocation:
         storage = DummyStorageInvocation([{"data": b"68656c6c6f"}])
         assert storage.get("test_key") == b"hello"
 
+    def test_get_should_return_blob_frame_value(self):
+        storage = DummyStorageInvocation([{"data_blob": b"hello"}])
+        assert storage.get("test_key") == b"hello"
+
     def test_set_should_set_value(self):
         storage = DummyStorageInvocation([{"data": "ok"}])
         storage.set("test_key", b"test_value")
@@ -76,3 +82,94 @@ class TestStorageInvocation:
 
         storage = DummyStorageInvocation([{"data": False}])
         assert not storage.exist("test_key")
+
+
+class InMemoryStorageInvocation(StorageInvocation):
+    """
+    Storage backed by a dict, records the size of every batch and the operations sent
+    """
+
+    def __init__(self):
+        self.values: dict[str, bytes] = {}
+        self.batch_sizes: list[int] = []
+        self.operations: list[tuple[str, str]] = []
+
+    def _backwards_invoke(self, type: InvokeType, data_type: Any, data: dict) -> Generator[dict, None, None]:  # noqa: A002
+        key = data["key"]
+        self.operations.append((data["opt"], key))
+        if data["opt"] == "get":
+            if key not in self.values:
+                raise Exception("key not found")
+            yield {"data": hexlify(self.values[key]).decode()}
+        elif data["opt"] == "set":
+            self.values[key] = bytes(data["value"])
+            yield {"data": "ok"}
+        elif data["opt"] == "del":
+            self.values.pop(key, None)
+            yield {"data": "ok"}
+        else:
+            yield {"data": key in self.values}
+
+    def _backwards_invoke_batch(
+        self, requests: Sequence[tuple[InvokeType, dict]], data_type: Any, ordered: bool = True
+    ) -> Generator[BackwardsInvocationResult[dict], None, None]:
+        self.batch_sizes.append(len(requests))
+        for index, (invoke_type, data) in enumerate(requests):
+            result = BackwardsInvocationResult[dict](index)
+            try:
+                result.responses = list(self._backwards_invoke(invoke_type, data_type, data))
+            except Exception as e:
+                result.error = e
+            yield result
+
+
+class TestStorageBulkAndStreaming:
+    def test_bulk_operations(self):
+        storage = InMemoryStorageInvocation()
+        storage.set_many({"a": b"1", "b": b"2"})
+        assert storage.get_many(["b", "a"]) == [b"2", b"1"]
+
+        storage.delete_many(["a"])
+        assert storage.values == {"b": b"2"}
+        with pytest.raises(Exception, match="not found"):
+            storage.get_many(["a", "b"])
+
+    def test_stream_round_trip_in_bounded_batches(self):
+        storage = InMemoryStorageInvocation()
+        pieces = [bytes([i]) * 700 for i in range(10)]
+        storage.set_stream("index", iter(pieces), chunk_size=1000, window=2)
+
+        assert max(storage.batch_sizes) <= 2
+        chunks = list(storage.get_stream("index", window=2))
+        assert all(len(chunk) <= 1000 for chunk in chunks)
+        assert b"".join(chunks) == b"".join(pieces)
+        assert len(storage.values) == 2 + 7
+
+    def test_stream_overwrite_and_delete_remove_chunks(self):
+        storage = InMemoryStorageInvocation()
+        storage.set_stream("index", [b"x" * 5000], chunk_size=1000)
+        storage.set_stream("index", [b"y" * 2000], chunk_size=1000)
+        assert len(storage.values) == 2 + 2
+        assert b"".join(storage.get_stream("index")) == b"y" * 2000
+
+        storage.delete_stream("index")
+        assert storage.values == {}
+
+    def test_get_stream_of_a_plain_value(self):
+        storage = InMemoryStorageInvocation()
+        storage.set("key", b"value")
+        assert list(storage.get_stream("key")) == [b"value"]
+
+    def test_set_stream_over_a_plain_value_does_not_read_it(self):
+        storage = InMemoryStorageInvocation()
+        storage.set("key", b"x" * 5000)
+        storage.set_stream("key", [b"y" * 2000], chunk_size=1000)
+
+        assert ("get", "key") not in storage.operations
+        assert b"".join(storage.get_stream("key")) == b"y" * 2000
+
+    def test_set_stream_without_replace_skips_the_lookup(self):
+        storage = InMemoryStorageInvocation()
+        storage.set_stream("key", [b"y" * 2000], chunk_size=1000, replace=False)
+
+        assert [opt for opt, _ in storage.operations] == ["set"] * 4
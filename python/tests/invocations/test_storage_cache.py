@@ -0,0 +1,143 @@
+from binascii import hexlify
+from collections.abc import Generator, Sequence
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+
+from dify_plugin.core.entities.invocation import InvokeType
+from dify_plugin.core.runtime import BackwardsInvocationResult
+from dify_plugin.invocations.storage_cache import CachedStorageInvocation, StorageCache
+
+
+class FakeStorage(CachedStorageInvocation):
+    """
+    Cached storage in front of an in-memory daemon which records the invocations and batches
+    """
+
+    def __init__(self, cache: StorageCache, values: dict[str, bytes]):
+        super().__init__(MagicMock(), cache)
+        self.values = values
+        self.invocations: list[dict] = []
+        self.batch_sizes: list[int] = []
+
+    def _backwards_invoke(self, type: InvokeType, data_type: Any, data: dict) -> Generator[dict, None, None]:  # noqa: A002
+        self.invocations.append(data)
+        key = data["key"]
+        if data["opt"] == "get":
+            if key not in self.values:
+                raise Exception("key not found")
+            yield {"data": hexlify(self.values[key]).decode()}
+        elif data["opt"] == "set":
+            if key.startswith("readonly"):
+                raise Exception("key is read only")
+            self.values[key] = data["value"]
+            yield {"data": "ok"}
+        elif data["opt"] == "del":
+            self.values.pop(key, None)
+            yield {"data": "ok"}
+        else:
+            yield {"data": key in self.values}
+
+    def _backwards_invoke_batch(
+        self, requests: Sequence[tuple[InvokeType, dict]], data_type: Any, ordered: bool = True
+    ) -> Generator[BackwardsInvocationResult[dict], None, None]:
+        self.batch_sizes.append(len(requests))
+        for index, (invoke_type, data) in enumerate(requests):
+            result = BackwardsInvocationResult[dict](index)
+            try:
+                result.responses = list(self._backwards_invoke(invoke_type, data_type, data))
+            except Exception as e:
+                result.error = e
+            yield result
+
+
+def test_reads_are_served_from_the_cache():
+    cache = StorageCache(max_size=1024, ttl=60)
+    storage = FakeStorage(cache, {"a": b"1", "b": b"2"})
+
+    assert storage.get("a") == b"1"
+    assert storage.get("a") == b"1"
+    assert storage.get_many(["a", "b"]) == [b"1", b"2"]
+    assert storage.exist("b")
+    assert [invocation["key"] for invocation in storage.invocations] == ["a", "b"]
+
+    stats = cache.stats()
+    assert stats.hits == 3
+    assert stats.misses == 2
+
+
+def test_missing_keys_are_cached_for_exist():
+    cache = StorageCache(max_size=1024, ttl=60)
+    storage = FakeStorage(cache, {})
+
+    assert not storage.exist("a")
+    assert not storage.exist("a")
+    assert len(storage.invocations) == 1
+    assert cache.stats().negative_hits == 1
+
+    # the plugin's own writes invalidate the cached absence
+    storage.set("a", b"1")
+    assert storage.exist("a")
+    storage.delete("a")
+    assert not storage.exist("a")
+    with pytest.raises(Exception, match="not found"):
+        storage.get("a")
+
+
+def test_entries_expire_and_are_evicted():
+    cache = StorageCache(max_size=300, ttl=60)
+    storage = FakeStorage(cache, dict.fromkeys("abc", b"x" * 50))
+    for key in "abc":
+        storage.get(key)
+    # only two entries fit, the least recently used one was evicted
+    assert cache.stats().evictions == 1
+    assert cache.lookup("a") == (False, None)
+    assert cache.lookup("c") == (True, b"x" * 50)
+
+    cache = StorageCache(max_size=1024, ttl=0.01)
+    cache.put("a", b"1")
+    cache._entries["a"].expires_at = 0
+    assert cache.lookup("a") == (False, None)
+    assert cache.stats().expirations == 1
+
+
+def test_write_behind_coalesces_sets():
+    cache = StorageCache(max_size=1024, ttl=60, write_behind=True)
+    storage = FakeStorage(cache, {})
+
+    for value in (b"1", b"2", b"3"):
+        storage.set("a", value)
+    assert storage.get("a") == b"3"
+    assert storage.invocations == []
+
+    storage.flush()
+    assert storage.values == {"a": b"3"}
+    assert len(storage.invocations) == 1
+    assert cache.stats().coalesced_writes == 2
+
+
+def test_write_behind_flushes_in_one_batch_and_drops_failed_keys():
+    cache = StorageCache(max_size=1024, ttl=60, write_behind=True)
+    storage = FakeStorage(cache, {})
+
+    storage.set("a", b"1")
+    storage.set("readonly", b"2")
+    with pytest.raises(Exception, match="read only"):
+        storage.flush()
+
+    assert storage.batch_sizes == [2]
+    assert storage.values == {"a": b"1"}
+    assert cache.lookup("a") == (True, b"1")
+    assert cache.lookup("readonly") == (False, None)
+
+
+def test_streamed_values_bypass_the_cache():
+    cache = StorageCache(max_size=1024 * 1024, ttl=60)
+    storage = FakeStorage(cache, {})
+
+    storage.set("a", b"small")
+    storage.set_stream("a", [b"x" * 3000], chunk_size=1000)
+    assert cache.lookup("a") == (False, None)
+    assert b"".join(storage.get_stream("a")) == b"x" * 3000
+    assert cache.stats().entries == 0
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from dify_plugin.core.server.tcp.outbound_queue import (
+    OutboundPriority,
+    OutboundQueue,
+    OutboundQueueClosedError,
+    ReplayBuffer,
+)
+from dify_plugin.core.utils.cancellation import CancellationToken, SessionCancelledError, SessionTimeoutError
+
+
+def test_control_frames_go_first():
+    queue = OutboundQueue()
+    queue.put(b"data", OutboundPriority.SESSION, "1")
+    queue.put(b"heartbeat", OutboundPriority.CONTROL)
+
+    assert queue.get() == b"heartbeat"
+    assert queue.get() == b"data"
+
+
+def test_sessions_are_served_round_robin_in_order():
+    queue = OutboundQueue()
+    for i in range(3):
+        queue.put(f"a{i}".encode(), OutboundPriority.SESSION, "a")
+    queue.put(b"b0", OutboundPriority.SESSION, "b")
+
+    assert [queue.get() for _ in range(4)] == [b"a0", b"b0", b"a1", b"a2"]
+    assert queue.get(timeout=0.01) is None
+
+
+def test_session_producers_block_when_full():
+    queue = OutboundQueue(max_pending_bytes=4)
+    queue.put(b"1234", OutboundPriority.SESSION, "a")
+
+    done = threading.Event()
+
+    def produce():
+        queue.put(b"5678", OutboundPriority.SESSION, "a")
+        done.set()
+
+    threading.Thread(target=produce, daemon=True).start()
+    time.sleep(0.05)
+    assert not done.is_set()
+
+    # control frames are never blocked
+    queue.put(b"heartbeat", OutboundPriority.CONTROL)
+
+    assert queue.get() == b"heartbeat"
+    assert queue.get() == b"1234"
+    assert done.wait(1)
+    assert queue.get() == b"5678"
+
+
+def test_blocked_producers_give_up_with_their_session():
+    queue = OutboundQueue(max_pending_bytes=4)
+    queue.put(b"1234", OutboundPriority.SESSION, "a")
+
+    with pytest.raises(SessionTimeoutError):
+        queue.put(b"5678", OutboundPriority.SESSION, "b", CancellationToken.with_timeout(0.05))
+
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel).start()
+    with pytest.raises(SessionCancelledError):
+        queue.put(b"5678", OutboundPriority.SESSION, "b", token)
+
+
+def test_closing_fails_blocked_producers():
+    queue = OutboundQueue(max_pending_bytes=4)
+    queue.put(b"1234", OutboundPriority.SESSION, "a")
+
+    threading.Timer(0.05, queue.close, args=("connection is dead",)).start()
+    with pytest.raises(OutboundQueueClosedError, match="connection is dead"):
+        queue.put(b"5678", OutboundPriority.SESSION, "a")
+    with pytest.raises(OutboundQueueClosedError):
+        queue.put(b"heartbeat", OutboundPriority.CONTROL)
+
+    queue.reopen()
+    queue.put(b"heartbeat", OutboundPriority.CONTROL)
+
+
+def test_replay_buffer_returns_frames_from_sequence():
+    replay = ReplayBuffer()
+    assert [replay.append(frame) for frame in (b"a", b"b", b"c")] == [0, 1, 2]
+
+    assert replay.frames_from(1) == [b"b", b"c"]
+    assert replay.frames_from(3) == []
+    assert replay.frames_from(4) is None
+
+
+def test_replay_buffer_evicts_oldest_frames():
+    replay = ReplayBuffer(max_bytes=4)
+    for frame in (b"aa", b"bb", b"cc"):
+        replay.append(frame)
+
+    # the first frame was evicted, the stream cannot be resumed before it
+    assert replay.frames_from(0) is None
+    assert replay.frames_from(1) == [b"bb", b"cc"]
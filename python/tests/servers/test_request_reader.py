@@ -0,0 +1,79 @@
+from collections.abc import Generator
+from unittest.mock import MagicMock
+
+import pytest
+
+from dify_plugin.core.entities.plugin.io import PluginInStream, PluginInStreamEvent
+from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.stdio.response_writer import StdioResponseWriter
+
+
+class DummyRequestReader(RequestReader):
+    def _read_stream(self) -> Generator[PluginInStream, None, None]:
+        yield from ()
+
+
+def _backwards_response(reader: RequestReader, backwards_request_id: str) -> PluginInStream:
+    return PluginInStream(
+        session_id="1",
+        event=PluginInStreamEvent.BackwardInvocationResponse,
+        data={"backwards_request_id": backwards_request_id, "event": "end", "message": "", "data": None},
+        reader=reader,
+        writer=StdioResponseWriter(),
+    )
+
+
+def test_keyed_readers_receive_only_their_lines():
+    reader = DummyRequestReader()
+    first = reader.read(key=RequestReader.backwards_response_key("a"))
+    second = reader.read(key=RequestReader.backwards_response_key("b"))
+
+    reader._process_line(_backwards_response(reader, "a"))
+    reader._process_line(_backwards_response(reader, "c"))
+
+    assert first.queue.qsize() == 1
+    assert first.queue.get().data["backwards_request_id"] == "a"
+    assert second.queue.qsize() == 0
+
+
+def test_request_slot_and_predicate_fallback():
+    reader = DummyRequestReader()
+    requests = reader.read(key=RequestReader.request_key())
+    fallback = reader.read(lambda data: data.session_id == "1")
+
+    reader._process_line(
+        PluginInStream(
+            session_id="1",
+            event=PluginInStreamEvent.Request,
+            data={},
+            reader=reader,
+            writer=StdioResponseWriter(),
+        )
+    )
+    reader._process_line(_backwards_response(reader, "a"))
+
+    assert requests.queue.qsize() == 1
+    assert fallback.queue.qsize() == 2
+
+
+def test_closed_keyed_reader_is_unregistered():
+    reader = DummyRequestReader()
+    with reader.read(key=RequestReader.backwards_response_key("a")):
+        assert RequestReader.backwards_response_key("a") in reader.keyed_readers
+
+    assert reader.keyed_readers == {}
+
+
+def test_filter_cannot_be_combined_with_keys():
+    reader = DummyRequestReader()
+    with pytest.raises(ValueError, match="filter cannot be combined"):
+        reader.read(filter=lambda _: True, key=RequestReader.request_key())
+
+
+def test_reader_registered_under_several_keys_is_closed_once():
+    reader = DummyRequestReader()
+    filter_reader = reader.read(keys=[RequestReader.request_key(), RequestReader.cancel_key()])
+    filter_reader.close_callback = MagicMock(wraps=filter_reader.close_callback)
+
+    reader.close()
+    filter_reader.close_callback.assert_called_once()
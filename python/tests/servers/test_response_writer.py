@@ -0,0 +1,42 @@
+import pytest
+
+from dify_plugin.core.server.stdio.response_writer import StdioResponseWriter
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+
+@pytest.mark.parametrize(
+    ("session_id", "data"),
+    [
+        ("1", {"result": True, "nested": {"list": [1, 2.5, None, "é\n"]}}),
+        (None, {}),
+        (
+            "2",
+            ToolInvokeMessage(
+                type=ToolInvokeMessage.MessageType.TEXT,
+                message=ToolInvokeMessage.TextMessage(text='quoted "text"'),
+            ),
+        ),
+        (
+            "3",
+            ToolInvokeMessage(
+                type=ToolInvokeMessage.MessageType.BLOB_CHUNK,
+                message=ToolInvokeMessage.BlobChunkMessage(
+                    id="id", sequence=0, total_length=2, blob=b"\xff\x00", end=False
+                ),
+            ),
+        ),
+    ],
+)
+def test_session_stream_matches_session_message(session_id, data):
+    writer = StdioResponseWriter()
+    assert writer.session_stream_text(session_id, data) == writer.session_message_text(
+        session_id, writer.stream_object(data)
+    )
+
+
+def test_writers_without_blob_frames_encode_binary_fields_inline():
+    writer = StdioResponseWriter()
+    assert not writer.supports_blob_frames()
+    assert writer.binary_field("data", b"\x00\xff") == {"data": "00ff"}
+    with pytest.raises(ValueError, match="blob frames are not supported"):
+        writer.write_blob(b"data")
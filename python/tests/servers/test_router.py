@@ -0,0 +1,55 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pydantic import ValidationError
+
+from dify_plugin.core.entities.plugin.request import PluginInvokeType, ToolActions, ToolInvokeRequest
+from dify_plugin.core.server.router import Router
+
+TOOL_REQUEST = {
+    "type": "tool",
+    "action": "invoke_tool",
+    "user_id": "user",
+    "provider": "provider",
+    "tool": "tool",
+    "credentials": {},
+    "tool_parameters": {"query": "dify"},
+}
+
+
+def invoke_tool(session, request: ToolInvokeRequest):
+    return request
+
+
+def test_dispatch_by_type_and_action():
+    router = Router(MagicMock(), None)
+    router.register_route(invoke_tool, invoke_type=PluginInvokeType.Tool, action=ToolActions.InvokeTool)
+
+    request = router.dispatch(MagicMock(), TOOL_REQUEST)
+    assert isinstance(request, ToolInvokeRequest)
+    assert request.tool_parameters == {"query": "dify"}
+    assert router.dispatch(MagicMock(), {**TOOL_REQUEST, "action": "validate_tool_credentials"}) is None
+
+
+def test_filter_routes_are_still_supported():
+    router = Router(MagicMock(), None)
+    router.register_route(invoke_tool, invoke_type=PluginInvokeType.Tool, action=ToolActions.InvokeTool)
+    router.register_route(invoke_tool, lambda data: data.get("action") == "validate_tool_credentials")
+
+    request = router.dispatch(MagicMock(), {**TOOL_REQUEST, "action": "validate_tool_credentials"})
+    assert request.action == ToolActions.ValidateCredentials
+
+
+def test_invalid_request_fails_the_session():
+    router = Router(MagicMock(), None)
+    router.register_route(invoke_tool, invoke_type=PluginInvokeType.Tool, action=ToolActions.InvokeTool)
+
+    with pytest.raises(ValidationError):
+        router.dispatch(MagicMock(), {"type": "tool", "action": "invoke_tool"})
+
+
+def test_duplicate_route_is_rejected():
+    router = Router(MagicMock(), None)
+    router.register_route(invoke_tool, invoke_type=PluginInvokeType.Tool, action=ToolActions.InvokeTool)
+    with pytest.raises(ValueError, match="already registered"):
+        router.register_route(invoke_tool, invoke_type=PluginInvokeType.Tool, action=ToolActions.InvokeTool)
@@ -0,0 +1,123 @@
+import json
+import threading
+from collections.abc import Callable
+from unittest.mock import MagicMock
+
+import pytest
+
+from dify_plugin.config.config import DifyPluginEnv, RequestClassConfig
+from dify_plugin.core.server.io_server import IOServer
+from dify_plugin.core.server.scheduler import RequestRejectedError, RequestScheduler, classify_request
+
+
+class _ManualExecutor:
+    """
+    Executor running submitted tasks only when asked to
+    """
+
+    def __init__(self):
+        self.tasks: list[tuple[Callable, tuple]] = []
+
+    def submit(self, fn: Callable, *args):
+        self.tasks.append((fn, args))
+
+    def run_next(self):
+        fn, args = self.tasks.pop(0)
+        fn(*args)
+
+
+def test_requests_are_classified_by_action():
+    assert classify_request({"type": "model", "action": "get_llm_num_tokens"}) == "control"
+    assert classify_request({"type": "model", "action": "invoke_llm"}) == "interactive"
+    assert classify_request({"type": "tool", "action": "invoke_tool"}) == "bulk"
+    assert classify_request({}) == "bulk"
+    # an action is only classified under its own invoke type
+    assert classify_request({"type": "tool", "action": "invoke_llm"}) == "bulk"
+
+
+def test_weighted_fair_order():
+    executor = _ManualExecutor()
+    scheduler = RequestScheduler(
+        executor,  # type: ignore[arg-type]
+        max_concurrency=1,
+        classes={"control": RequestClassConfig(weight=2), "bulk": RequestClassConfig(weight=1)},
+    )
+    started: list[str] = []
+    for i in range(6):
+        scheduler.submit({"type": "tool", "action": "invoke_tool"}, started.append, f"b{i}")
+    for i in range(6):
+        scheduler.submit({"type": "model", "action": "get_llm_num_tokens"}, started.append, f"c{i}")
+
+    while executor.tasks:
+        executor.run_next()
+
+    # the first bulk request started before any control request arrived, then control requests
+    # get two slots for every bulk one until they are drained
+    assert started == ["b0", "c0", "c1", "c2", "c3", "b1", "c4", "c5", "b2", "b3", "b4", "b5"]
+    stats = scheduler.stats()
+    assert stats["bulk"].submitted == 6
+    assert stats["control"].queued == 0
+    assert stats["control"].running == 0
+
+
+def test_bulkhead_and_rejection():
+    executor = _ManualExecutor()
+    scheduler = RequestScheduler(
+        executor,  # type: ignore[arg-type]
+        max_concurrency=4,
+        classes={"bulk": RequestClassConfig(max_concurrency=1, max_queue=1)},
+    )
+    scheduler.submit({"type": "tool", "action": "invoke_tool"}, lambda: None)
+    scheduler.submit({"type": "tool", "action": "invoke_tool"}, lambda: None)
+    with pytest.raises(RequestRejectedError, match="bulk"):
+        scheduler.submit({"type": "tool", "action": "invoke_tool"}, lambda: None)
+
+    # other classes are not blocked by the bulkhead
+    scheduler.submit({"type": "model", "action": "invoke_llm"}, lambda: None)
+    assert len(executor.tasks) == 2
+
+    stats = scheduler.stats()["bulk"]
+    assert (stats.running, stats.queued, stats.rejected) == (1, 1, 1)
+
+
+def test_load_reports_occupancy_queue_and_recent_latency(monkeypatch: pytest.MonkeyPatch):
+    now = [100.0]
+    monkeypatch.setattr("dify_plugin.core.server.scheduler.time.monotonic", lambda: now[0])
+    executor = _ManualExecutor()
+    scheduler = RequestScheduler(executor, max_concurrency=2)  # type: ignore[arg-type]
+    for i in range(3):
+        scheduler.submit({"type": "model", "action": "invoke_llm"}, lambda _: None, i)
+
+    load = scheduler.load()
+    assert (load.running, load.queued, load.occupancy) == (2, 1, 1.0)
+
+    now[0] += 2
+    executor.run_next()
+    load = scheduler.load()
+    assert load.queued == 0
+    # the third request waited 2 seconds, the first one took 2 seconds
+    assert load.recent_wait == pytest.approx(2 / 3)
+    assert load.recent_latency == pytest.approx(2)
+
+    # the recent wait and latency only cover the last minute
+    now[0] += 61
+    load = scheduler.load()
+    assert (load.recent_wait, load.recent_latency) == (0, 0)
+
+
+def test_scheduler_stats_are_logged_periodically():
+    class Server(IOServer):
+        def _execute_request(self, *args, **kwargs):
+            pass
+
+    logs = []
+    logged = threading.Event()
+    writer = MagicMock(log=lambda data: logs.append(data) or logged.set())
+    server = Server(DifyPluginEnv(SCHEDULER_STATS_INTERVAL=0.01), MagicMock(), writer)
+    threading.Thread(target=server._report_scheduler_stats, daemon=True).start()
+
+    assert logged.wait(5)
+    message = logs[0]["message"]
+    stats = json.loads(message.removeprefix("scheduler stats: "))
+    assert stats["load"]["max_concurrency"] == server.config.MAX_WORKER
+    assert set(stats["classes"]) == {"control", "interactive", "bulk"}
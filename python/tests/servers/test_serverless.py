@@ -0,0 +1,121 @@
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+from dify_plugin.core.entities.plugin.io import PluginInStream
+from dify_plugin.core.server.scheduler import SchedulerLoad
+from dify_plugin.core.server.serverless.request_reader import LoadThresholds, ServerlessRequestReader
+
+REQUEST = {"event": "request", "session_id": "session", "data": {"type": "tool"}}
+
+
+def test_requests_are_dispatched_by_the_handler():
+    reader = ServerlessRequestReader()
+    dispatched: list[PluginInStream] = []
+
+    def dispatch(data: PluginInStream):
+        dispatched.append(data)
+        data.writer.write("first\n\n")
+        data.writer.write("second\n\n")
+        data.writer.done()
+
+    reader.set_dispatcher(dispatch)
+    response = reader.app.test_client().post("/invoke", json=REQUEST)
+
+    assert response.status_code == 200
+    assert response.data == b"first\n\nsecond\n\n"
+    assert dispatched[0].session_id == "session"
+    assert dispatched[0].data == {"type": "tool"}
+    assert reader.request_queue.empty()
+
+
+def test_requests_are_queued_without_dispatcher():
+    reader = ServerlessRequestReader()
+    with reader.app.test_request_context("/invoke", method="POST", json=REQUEST):
+        stream, status = reader.handler()
+
+    assert status == 200
+    data = reader.request_queue.get_nowait()
+    assert data.session_id == "session"
+    data.writer.write("output\n\n")
+    data.writer.done()
+    assert list(stream) == ["output\n\n"]
+
+
+def test_written_chunks_are_coalesced():
+    reader = ServerlessRequestReader(coalesce_bytes=10)
+    queue = Queue[str | None]()
+    for chunk in ("aaaa", "bbbb", "cccc", "dd"):
+        queue.put(chunk)
+    queue.put(None)
+
+    assert list(reader._stream(queue)) == ["aaaabbbbcccc", "dd"]
+
+
+def test_chunks_are_written_one_by_one_without_coalescing():
+    reader = ServerlessRequestReader(coalesce_bytes=0)
+    queue = Queue[str | None]()
+    for chunk in ("aaaa", "bbbb", None):
+        queue.put(chunk)
+
+    assert list(reader._stream(queue)) == ["aaaa", "bbbb"]
+
+
+def test_chunks_are_written_as_they_are_produced():
+    reader = ServerlessRequestReader()
+    queue = Queue[str | None]()
+    stream = reader._stream(queue)
+
+    threading.Timer(0.05, queue.put, args=("first",)).start()
+    assert next(stream) == "first"
+    queue.put(None)
+    assert list(stream) == []
+
+
+def test_idle_connection_is_closed_after_its_lifetime():
+    reader = ServerlessRequestReader(max_single_connection_lifetime=0.2)  # type: ignore[arg-type]
+    queue = Queue[str | None]()
+    queue.put("first")
+
+    start = time.monotonic()
+    assert list(reader._stream(queue)) == ["first"]
+    assert 0.2 <= time.monotonic() - start < 1
+
+
+def reader_with_load(**load) -> ServerlessRequestReader:
+    reader = ServerlessRequestReader(thresholds=LoadThresholds(max_queued=10, shed_queued=100, retry_after=3))
+    defaults = {"running": 0, "queued": 0, "max_concurrency": 10, "occupancy": 0, "recent_wait": 0, "recent_latency": 0}
+    reader.set_load_reporter(lambda: SchedulerLoad(**{**defaults, **load}))
+    return reader
+
+
+def test_ready_reports_the_load():
+    response = reader_with_load(running=5, occupancy=0.5).app.test_client().get("/ready")
+
+    assert response.status_code == 200
+    assert response.json["ready"] is True
+    assert response.json["running"] == 5
+    assert response.json["occupancy"] == 0.5
+
+
+def test_not_ready_above_thresholds():
+    client = reader_with_load(running=10, occupancy=1, queued=10).app.test_client()
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json["ready"] is False
+    assert len(response.json["reasons"]) == 2
+    # the instance is still alive
+    assert client.get("/health").status_code == 200
+
+
+def test_invoke_sheds_load_above_the_hard_limit():
+    reader = reader_with_load(queued=100)
+    reader.set_dispatcher(lambda data: pytest.fail("shed request was dispatched"))
+    response = reader.app.test_client().post("/invoke", json=REQUEST)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert reader.shed == 1
@@ -0,0 +1,117 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import httpx
+import pytest
+
+WORKER = textwrap.dedent(
+    """
+    import os
+    import socket
+    import sys
+    import time
+
+    from dify_plugin.core.server.serverless.prefork import PreforkSupervisor
+    from dify_plugin.core.server.serverless.request_reader import ServerlessRequestReader
+
+    reader = ServerlessRequestReader(host="127.0.0.1", port=int(sys.argv[1]), workers=2, graceful_timeout=5)
+    reader.app.route("/pid")(lambda: str(os.getpid()))
+
+    def slow():
+        time.sleep(1)
+        return "done"
+
+    reader.app.route("/slow")(slow)
+    if sys.argv[2] == "shared":
+        # as on platforms without SO_REUSEPORT
+        del socket.SO_REUSEPORT
+        reader.bind_for_workers()
+    PreforkSupervisor(reader.workers, reader.graceful_timeout).run()
+    reader.launch()
+    while True:
+        time.sleep(1)
+    """
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_pids(url: str, attempts: int = 100) -> set[str]:
+    pids = set()
+    with httpx.Client(limits=httpx.Limits(max_keepalive_connections=0)) as client:
+        for _ in range(attempts):
+            # a new connection for every request, connections are spread across the workers
+            pids.add(client.get(f"{url}/pid").text)
+    return pids
+
+
+@pytest.fixture
+def server(request):
+    port = free_port()
+    process = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-c", WORKER, str(port), getattr(request, "param", "reuseport")],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            if len(worker_pids(url, attempts=20)) == 2:
+                break
+        except httpx.TransportError:
+            pass
+        assert time.monotonic() < deadline, "workers did not start"
+        time.sleep(0.1)
+
+    yield process, url
+
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.parametrize("server", ["reuseport", "shared"], indirect=True)
+def test_workers_share_the_port(server):
+    _, url = server
+    pids = worker_pids(url)
+    assert len(pids) == 2
+    assert str(os.getpid()) not in pids
+
+
+def test_exited_worker_is_restarted(server):
+    _, url = server
+    pids = worker_pids(url)
+    os.kill(int(pids.pop()), signal.SIGKILL)
+
+    deadline = time.monotonic() + 10
+    while True:
+        restarted = worker_pids(url, attempts=20)
+        if len(restarted) == 2 and pids < restarted:
+            break
+        assert time.monotonic() < deadline, "worker was not restarted"
+        time.sleep(0.1)
+
+
+def test_sigterm_drains_in_flight_requests(server):
+    process, url = server
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(httpx.get(f"{url}/slow", timeout=10)))
+    request.start()
+    time.sleep(0.3)
+
+    process.send_signal(signal.SIGTERM)
+    request.join()
+    assert responses[0].status_code == 200
+    assert responses[0].text == "done"
+    assert process.wait(timeout=10) == 0
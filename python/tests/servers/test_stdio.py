@@ -1,7 +1,11 @@
 import json
+import os
+import sys
+import time
 
 from dify_plugin.core.entities.plugin.io import PluginInStreamEvent
 from dify_plugin.core.server.stdio.request_reader import StdioRequestReader
+from dify_plugin.core.server.stdio.response_writer import StdioResponseWriter
 
 
 def test_stdio(monkeypatch):
@@ -74,3 +78,48 @@ def test_stdio_with_empty_line(monkeypatch):
             break
 
     assert iters == 300
+
+
+def _stdout_pipe(monkeypatch) -> int:
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    monkeypatch.setattr(sys, "stdout", os.fdopen(write_fd, "w"))
+    return read_fd
+
+
+def _read_pipe(fd: int) -> bytes:
+    try:
+        return os.read(fd, 65536)
+    except BlockingIOError:
+        return b""
+
+
+def test_stdio_writer_writes_each_frame_once(monkeypatch):
+    fd = _stdout_pipe(monkeypatch)
+    writer = StdioResponseWriter()
+
+    writer.session_message(session_id="1", data={"type": "end", "data": {}})
+    writer.heartbeat()
+
+    frames = [frame for frame in _read_pipe(fd).split(b"\n\n") if frame]
+    assert [json.loads(frame)["event"] for frame in frames] == ["session", "heartbeat"]
+
+
+def test_stdio_writer_coalesces_within_flush_interval(monkeypatch):
+    fd = _stdout_pipe(monkeypatch)
+    writer = StdioResponseWriter(flush_interval=0.05)
+
+    writer.heartbeat()
+    writer.heartbeat()
+    assert _read_pipe(fd) == b""
+
+    time.sleep(0.2)
+    assert _read_pipe(fd).count(b"heartbeat") == 2
+
+
+def test_stdio_writer_flushes_when_size_is_reached(monkeypatch):
+    fd = _stdout_pipe(monkeypatch)
+    writer = StdioResponseWriter(flush_interval=60, flush_size=1)
+
+    writer.heartbeat()
+    assert b"heartbeat" in _read_pipe(fd)
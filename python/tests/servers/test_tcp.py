@@ -0,0 +1,141 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from dify_plugin.config.config import RemoteFraming
+from dify_plugin.core.entities.message import InitializeMessage
+from dify_plugin.core.entities.plugin.io import PluginInStreamEvent
+from dify_plugin.core.server.tcp.framing import (
+    FrameKind,
+    LengthPrefixedFramer,
+    pack_blob,
+    pack_message,
+    unpack_blob,
+    unpack_message,
+)
+from dify_plugin.core.server.tcp.request_reader import TCPReaderWriter
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def _reader_with_socket(framing: RemoteFraming) -> tuple[TCPReaderWriter, socket.socket]:
+    plugin_side, daemon_side = socket.socketpair()
+    reader = TCPReaderWriter(host="", port=0, key="key", framing=framing, handshake_timeout=0.5)
+    reader.sock = plugin_side
+    reader.alive = True
+    return reader, daemon_side
+
+
+def _ack(framing: str, blob_frames: bool = False) -> bytes:
+    message = InitializeMessage(
+        type=InitializeMessage.Type.HANDSHAKE,
+        data={"framing": framing, "blob_frames": blob_frames},
+    )
+    return message.model_dump_json().encode()
+
+
+def test_length_prefixed_framer_across_reads():
+    frames = pack_message({"a": 1}) + pack_message({"b": b"\x00\n" * 10})
+    framer = LengthPrefixedFramer()
+    decoded = []
+    for i in range(len(frames)):
+        decoded.extend(unpack_message(payload) for _, payload in framer.feed(frames[i : i + 1]))
+
+    assert decoded == [{"a": 1}, {"b": b"\x00\n" * 10}]
+
+
+def test_negotiate_msgpack_framing_keeps_remainder():
+    reader, daemon = _reader_with_socket(RemoteFraming.MSGPACK)
+    daemon.sendall(_ack("msgpack") + b"\n" + pack_message({"event": "request"}))
+
+    assert reader._negotiate_framing() == RemoteFraming.MSGPACK
+    assert reader._handshake_remainder == pack_message({"event": "request"})
+
+
+def test_negotiate_falls_back_to_json_without_ack():
+    reader, _ = _reader_with_socket(RemoteFraming.MSGPACK)
+    assert reader._negotiate_framing() == RemoteFraming.JSON
+
+
+def test_msgpack_round_trip():
+    reader, daemon = _reader_with_socket(RemoteFraming.MSGPACK)
+    reader.framing = RemoteFraming.MSGPACK
+
+    reader.session_message(session_id="1", data={"type": "stream", "data": {"text": "hello"}})
+    framer = LengthPrefixedFramer()
+    ((_, payload),) = framer.feed(daemon.recv(65536))
+    assert unpack_message(payload) == {
+        "event": "session",
+        "session_id": "1",
+        "data": {"type": "stream", "data": {"text": "hello"}},
+    }
+
+    daemon.sendall(pack_message({"session_id": "2", "event": "request", "data": {"type": "tool"}}))
+    chunk = next(reader._read_stream())
+    assert chunk.session_id == "2"
+    assert chunk.event == PluginInStreamEvent.Request
+    assert chunk.data == {"type": "tool"}
+
+
+def test_json_framing_is_unchanged():
+    reader, daemon = _reader_with_socket(RemoteFraming.JSON)
+    reader.session_message(session_id="1", data={"type": "end", "data": {}})
+
+    line = daemon.recv(65536)
+    assert line.endswith(b"\n\n")
+    assert json.loads(line)["session_id"] == "1"
+
+
+def test_blob_frames_are_negotiated():
+    reader, daemon = _reader_with_socket(RemoteFraming.MSGPACK)
+    daemon.sendall(_ack("msgpack", blob_frames=True) + b"\n")
+    reader.framing = reader._negotiate_framing()
+    assert reader.supports_blob_frames()
+
+    field = reader.binary_field("result", b"\x00\xff" * 4)
+    ((kind, payload),) = LengthPrefixedFramer().feed(daemon.recv(65536))
+    assert kind == FrameKind.BLOB
+    assert unpack_blob(payload) == (field["result_blob_id"], b"\x00\xff" * 4)
+
+
+def test_binary_field_falls_back_to_hex():
+    reader, _ = _reader_with_socket(RemoteFraming.MSGPACK)
+    reader.framing = RemoteFraming.MSGPACK
+    assert not reader.supports_blob_frames()
+    assert reader.binary_field("result", b"\x00\xff") == {"result": "00ff"}
+
+
+def test_inbound_blob_is_taken_once():
+    reader, daemon = _reader_with_socket(RemoteFraming.MSGPACK)
+    reader.framing = RemoteFraming.MSGPACK
+    blob_id = "0" * 32
+
+    daemon.sendall(
+        pack_blob(blob_id, b"value")
+        + pack_message({"session_id": "1", "event": "backwards_response", "data": {"data_blob_id": blob_id}})
+    )
+    chunk = next(reader._read_stream())
+    assert chunk.data == {"data_blob_id": blob_id}
+    assert reader.take_blob(blob_id) == b"value"
+    with pytest.raises(ValueError, match="not found"):
+        reader.take_blob(blob_id)
+
+
+def test_writer_thread_sends_queued_frames():
+    reader, daemon = _reader_with_socket(RemoteFraming.JSON)
+    reader._writer_thread = threading.Thread(target=reader._writer_loop, daemon=True)
+    reader._writer_thread.start()
+    reader._writable.set()
+
+    reader.session_message(session_id="1", data={"type": "end", "data": {}})
+    reader.heartbeat()
+
+    received = b""
+    daemon.settimeout(1)
+    while received.count(b"\n\n") < 2:
+        received += daemon.recv(65536)
+
+    events = sorted(json.loads(frame)["event"] for frame in received.split(b"\n\n") if frame)
+    assert events == ["heartbeat", "session"]
@@ -0,0 +1,95 @@
+import json
+import socket
+import threading
+import time
+
+from dify_plugin.core.entities.message import InitializeMessage
+from dify_plugin.core.server.tcp.request_reader import TCPReaderWriter
+
+
+class _FakeDaemon:
+    """
+    Daemon which resumes known streams and kills the first connection after `kill_after` frames
+    """
+
+    def __init__(self, kill_after: int) -> None:
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.kill_after = kill_after
+        self.killed = threading.Event()
+        self.handshakes: list[dict] = []
+        self.frames: list[dict] = []
+        # number of frames received per stream
+        self.streams: dict[str, int] = {}
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket):
+        buffer = b""
+        while b"\n" not in buffer:
+            buffer += conn.recv(65536)
+        line, _, buffer = buffer.partition(b"\n")
+        key = json.loads(line)["data"]
+        self.handshakes.append(key)
+
+        stream_id = key["stream_id"]
+        resumed = stream_id in self.streams
+        self.streams.setdefault(stream_id, 0)
+        ack = InitializeMessage(
+            type=InitializeMessage.Type.HANDSHAKE,
+            data={"framing": "json", "resumed": resumed, "received": self.streams[stream_id]},
+        )
+        conn.sendall(ack.model_dump_json().encode() + b"\n")
+
+        while True:
+            *frames, buffer = buffer.split(b"\n\n")
+            for frame in frames:
+                self.frames.append(json.loads(frame))
+                self.streams[stream_id] += 1
+
+            if not self.killed.is_set() and self.streams[stream_id] >= self.kill_after:
+                self.killed.set()
+                conn.close()
+                return
+
+            data = conn.recv(65536)
+            if not data:
+                return
+            buffer += data
+
+
+def test_stream_is_resumed_after_connection_is_killed():
+    daemon = _FakeDaemon(kill_after=3)
+    connected = []
+    stream = TCPReaderWriter(
+        "127.0.0.1",
+        daemon.port,
+        "key",
+        reconnect_timeout=0,
+        on_connected=lambda: connected.append(True),
+        handshake_timeout=1,
+        resume=True,
+    )
+    stream.launch()
+    threading.Thread(target=lambda: list(stream._read_stream()), daemon=True).start()
+
+    for i in range(3):
+        stream.session_message(session_id="1", data={"i": i})
+    assert daemon.killed.wait(5)
+    # written while the connection is being lost, replayed once the stream is resumed
+    for i in range(3, 6):
+        stream.session_message(session_id="1", data={"i": i})
+
+    deadline = time.monotonic() + 5
+    while len(daemon.frames) < 6 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert [frame["data"]["i"] for frame in daemon.frames] == list(range(6))
+    assert len(daemon.handshakes) == 2
+    assert daemon.handshakes[1]["stream_id"] == daemon.handshakes[0]["stream_id"]
+    # declarations are not sent again on a resumed stream
+    assert connected == [True]
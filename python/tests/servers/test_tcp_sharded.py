@@ -0,0 +1,123 @@
+import json
+import socket
+import threading
+import time
+
+from dify_plugin.core.entities.plugin.io import PluginInStreamEvent
+from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.tcp.sharded import ShardedTCPReaderWriter, shard_of
+
+
+class _FakeDaemon:
+    """
+    Daemon recording the frames received on every connection by shard index
+    """
+
+    def __init__(self) -> None:
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.connections: dict[int, socket.socket] = {}
+        self.frames: dict[int, list[dict]] = {}
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket):
+        buffer = b""
+        while b"\n" not in buffer:
+            buffer += conn.recv(65536)
+        line, _, buffer = buffer.partition(b"\n")
+        shard = json.loads(line)["data"]["shard"]
+        self.frames[shard] = []
+        self.connections[shard] = conn
+
+        while True:
+            *frames, buffer = buffer.split(b"\n\n")
+            self.frames[shard].extend(json.loads(frame) for frame in frames)
+            data = conn.recv(65536)
+            if not data:
+                return
+            buffer += data
+
+
+def _wait(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_sessions_are_spread_across_connections():
+    daemon = _FakeDaemon()
+    connected = []
+    stream = ShardedTCPReaderWriter(
+        "127.0.0.1", daemon.port, "key", connections=3, on_connected=lambda: connected.append(True)
+    )
+    stream.launch()
+    _wait(lambda: len(daemon.frames) == 3)
+
+    session_ids = [f"session-{i}" for i in range(12)]
+    for session_id in session_ids:
+        stream.session_message(session_id=session_id, data={"type": "end", "data": {}})
+    stream.heartbeat()
+
+    _wait(lambda: sum(len(frames) for frames in daemon.frames.values()) == len(session_ids) + 1)
+    for shard, frames in daemon.frames.items():
+        for frame in frames:
+            if frame["event"] == "session":
+                assert shard_of(frame["session_id"], 3) == shard
+            else:
+                assert shard == 0
+    assert connected == [True]
+
+
+def test_reads_are_merged_into_one_dispatch():
+    daemon = _FakeDaemon()
+    stream = ShardedTCPReaderWriter("127.0.0.1", daemon.port, "key", connections=2)
+    stream.launch()
+    _wait(lambda: len(daemon.connections) == 2)
+    threading.Thread(target=stream.event_loop, daemon=True).start()
+
+    requests = stream.read(key=RequestReader.request_key())
+    for shard, conn in daemon.connections.items():
+        request = {"session_id": f"s{shard}", "event": "request", "data": {}}
+        conn.sendall(json.dumps(request).encode() + b"\n")
+
+    received = {}
+    for message in requests.read():
+        received[message.session_id] = message
+        if len(received) == 2:
+            break
+    requests.close()
+
+    for shard in range(2):
+        message = received[f"s{shard}"]
+        assert message.event == PluginInStreamEvent.Request
+        assert message.reader is stream
+        # a session replies on the connection its request arrived on
+        assert message.writer is stream.shards[shard]
+
+
+def test_a_connection_whose_stream_ended_is_reconnected():
+    daemon = _FakeDaemon()
+    stream = ShardedTCPReaderWriter("127.0.0.1", daemon.port, "key", connections=2, reconnect_timeout=0)
+    stream.launch()
+    _wait(lambda: len(daemon.connections) == 2)
+    threading.Thread(target=stream.event_loop, daemon=True).start()
+    requests = stream.read(key=RequestReader.request_key())
+
+    # the stream of the connection ends without an error, as once it gave up reconnecting
+    lost = daemon.connections[1]
+    stream.shards[1].alive = False
+    _wait(lambda: daemon.connections[1] is not lost)
+
+    request = {"session_id": "s1", "event": "request", "data": {}}
+    daemon.connections[1].sendall(json.dumps(request).encode() + b"\n")
+    for message in requests.read():
+        assert message.session_id == "s1"
+        break
+    requests.close()
+    stream.close()
@@ -0,0 +1,160 @@
+import queue
+import sys
+import threading
+import time
+from collections.abc import Generator
+from unittest.mock import MagicMock
+
+from dify_plugin.core.entities.plugin.io import PluginInStream, PluginInStreamEvent
+from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.core.server.worker.supervisor import WorkerSupervisor
+
+# answers every request with its pid and echoes backwards responses, exits on `crash`
+_WORKER = """
+import json, os, sys
+from dify_plugin.core.server.__base.response_writer import ResponseWriter
+
+class Writer(ResponseWriter):
+    def write(self, data):
+        sys.stdout.write(data)
+        sys.stdout.flush()
+
+    def done(self):
+        pass
+
+writer = Writer()
+writer.write('{"configuration": {}}\\n\\n')
+writer.heartbeat()
+for line in sys.stdin:
+    message = json.loads(line)
+    if message["data"].get("crash"):
+        os._exit(3)
+    writer.session_stream(message["session_id"], {"pid": os.getpid(), "echo": message["data"]})
+    if message["event"] == "backwards_response" or not message["data"].get("wait"):
+        writer.session_message(message["session_id"], writer.stream_end_object())
+"""
+
+
+class _QueueReader(RequestReader):
+    def __init__(self):
+        super().__init__()
+        self.inbound: queue.Queue[PluginInStream] = queue.Queue()
+        self.blobs: dict[str, bytes] = {}
+
+    def _read_stream(self) -> Generator[PluginInStream, None, None]:
+        while True:
+            yield self.inbound.get()
+
+    def take_blob(self, blob_id: str) -> bytes:
+        return self.blobs.pop(blob_id)
+
+
+class _RecordingWriter(ResponseWriter):
+    def __init__(self, blob_frames: bool = False):
+        self.frames: list[str] = []
+        # sessions of the frames written with `write_session_frame`
+        self.session_frames: list[str] = []
+        self.finished = threading.Event()
+        self.blob_frames = blob_frames
+
+    def write(self, data: str):
+        self.frames.append(data)
+
+    def write_session_frame(self, session_id, data: str):
+        self.session_frames.append(session_id)
+        self.write(data)
+
+    def supports_blob_frames(self) -> bool:
+        return self.blob_frames
+
+    def done(self):
+        self.finished.set()
+
+
+def _supervisor(workers: int) -> tuple[WorkerSupervisor, _QueueReader]:
+    reader = _QueueReader()
+    threading.Thread(target=reader.event_loop, daemon=True).start()
+    supervisor = WorkerSupervisor(reader, None, workers, command=[sys.executable, "-c", _WORKER])
+    threading.Thread(target=supervisor.run, daemon=True).start()
+    while RequestReader.request_key() not in reader.keyed_readers:
+        time.sleep(0.01)
+    return supervisor, reader
+
+
+def _send(reader: _QueueReader, session_id: str, event: PluginInStreamEvent, data: dict, writer: ResponseWriter):
+    reader.inbound.put(PluginInStream(session_id=session_id, event=event, data=data, reader=reader, writer=writer))
+
+
+def test_requests_are_spread_across_workers():
+    supervisor, reader = _supervisor(workers=2)
+    writers = {f"s{i}": _RecordingWriter() for i in range(4)}
+    for session_id, writer in writers.items():
+        _send(reader, session_id, PluginInStreamEvent.Request, {"wait": True}, writer)
+
+    deadline = time.monotonic() + 10
+    while any(not writer.frames for writer in writers.values()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    pids = {writer.frames[0].split('"pid":')[1].split(",")[0] for writer in writers.values()}
+    assert len(pids) == 2
+
+    # backwards invocation responses reach the worker running the session
+    _send(reader, "s0", PluginInStreamEvent.BackwardInvocationResponse, {"result": 1}, writers["s0"])
+    assert writers["s0"].finished.wait(10)
+    assert '"echo":{"result":1}' in writers["s0"].frames[1]
+    assert writers["s0"].frames[-1].endswith('"data":{"type":"end","data":{}}}\n\n')
+    assert "s0" not in supervisor.sessions
+    # session frames are queued with their session by the writer
+    assert writers["s0"].session_frames == ["s0"] * len(writers["s0"].frames)
+    supervisor.stop()
+
+
+def test_blob_frames_are_inlined_for_workers():
+    supervisor, reader = _supervisor(workers=1)
+    writer = _RecordingWriter(blob_frames=True)
+    reader.blobs["blob"] = b"\x00\xff"
+    _send(reader, "s0", PluginInStreamEvent.Request, {"wait": True}, writer)
+    deadline = time.monotonic() + 10
+    while not writer.frames and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    _send(
+        reader,
+        "s0",
+        PluginInStreamEvent.BackwardInvocationResponse,
+        {"event": "response", "data": {"data_blob_id": "blob"}},
+        writer,
+    )
+
+    assert writer.finished.wait(10)
+    assert '"echo":{"event":"response","data":{"data":"00ff"}}' in writer.frames[1]
+    assert not reader.blobs
+    supervisor.stop()
+
+
+def test_sessions_of_exited_worker_fail():
+    supervisor, reader = _supervisor(workers=1)
+    writer = _RecordingWriter()
+    _send(reader, "s0", PluginInStreamEvent.Request, {"crash": True}, writer)
+
+    assert writer.finished.wait(10)
+    assert "WorkerExited" in writer.frames[0]
+    supervisor.stop()
+
+
+def test_session_frames_are_routed_by_their_parsed_header():
+    supervisor = WorkerSupervisor(_QueueReader(), None, 1, command=[sys.executable, "-c", ""])
+    worker = MagicMock(sessions={'a"b'})
+    writer = _RecordingWriter()
+    supervisor.sessions['a"b'] = (worker, writer)
+
+    # an escaped session id, and fields in another order than the writers of the sdk use
+    supervisor._forward(b'{"event":"session","session_id":"a\\"b","data":{"type":"stream","data":{"end":1}}}')
+    assert 'a"b' in supervisor.sessions
+    supervisor._forward(b'{"data":{"data":{},"type":"end"},"session_id":"a\\"b","event":"session"}')
+
+    assert writer.session_frames == ['a"b', 'a"b']
+    assert writer.finished.is_set()
+    assert 'a"b' not in supervisor.sessions
+    assert not worker.sessions
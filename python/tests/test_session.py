@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from dify_plugin.config.config import InstallMethod
+from dify_plugin.core.entities.invocation import InvokeType
+from dify_plugin.core.entities.plugin.io import PluginInStream
+from dify_plugin.core.runtime import BackwardsInvocation, Session
+from dify_plugin.core.server.__base.request_reader import RequestReader
+from dify_plugin.core.server.__base.response_writer import ResponseWriter
+from dify_plugin.core.server.stdio.request_reader import StdioRequestReader
+from dify_plugin.invocations.storage import StorageInvocation
+
+
+def make_session() -> Session:
+    return Session(
+        session_id="session",
+        executor=MagicMock(),
+        reader=MagicMock(),
+        writer=MagicMock(),
+        install_method=None,
+    )
+
+
+def test_invocations_are_created_on_first_use():
+    session = make_session()
+    assert session._storage is None
+    assert session._model is None
+
+    storage = session.storage
+    assert isinstance(storage, StorageInvocation)
+    assert storage.session is session
+    assert session.storage is storage
+    assert session.model.llm.session is session
+    assert session._app is None
+
+
+def test_session_has_no_instance_dict():
+    assert not hasattr(make_session(), "__dict__")
+
+
+def backwards_response(
+    reader: RequestReader,
+    event: str,
+    data: dict | None = None,
+    backwards_request_id: str = "request",
+    message: str = "",
+) -> PluginInStream:
+    line = json.dumps(
+        {
+            "session_id": "session",
+            "event": "backwards_response",
+            "data": {"backwards_request_id": backwards_request_id, "event": event, "message": message, "data": data},
+        }
+    )
+    return PluginInStream.from_json(line, reader=reader, writer=MagicMock())
+
+
+def test_backwards_invocation_wakes_up_on_response():
+    reader = StdioRequestReader(writer=MagicMock())
+    session = Session(session_id="session", executor=MagicMock(), reader=reader, writer=MagicMock())
+    invocation = BackwardsInvocation(session)
+
+    def respond():
+        while not reader.keyed_readers:
+            time.sleep(0.001)
+        reader._process_line(backwards_response(reader, "response", {"value": 1}))
+        reader._process_line(backwards_response(reader, "end"))
+
+    threading.Thread(target=respond).start()
+    started = time.monotonic()
+    assert list(invocation._full_duplex_backwards_invoke("request", InvokeType.Storage, dict, {})) == [{"value": 1}]
+    assert time.monotonic() - started < 0.5
+
+
+def test_backwards_invocation_inactivity_timeout_per_invoke_type():
+    reader = StdioRequestReader(writer=MagicMock())
+    session = Session(
+        session_id="session",
+        executor=MagicMock(),
+        reader=reader,
+        writer=MagicMock(),
+        backwards_invocation_timeouts={"storage": 0.05},
+    )
+    assert session.inactivity_timeout(InvokeType.Storage) == 0.05
+    assert session.inactivity_timeout(InvokeType.LLM) == 250
+
+    started = time.monotonic()
+    with pytest.raises(Exception, match="without response"):
+        list(BackwardsInvocation(session)._full_duplex_backwards_invoke("request", InvokeType.Storage, dict, {}))
+    assert time.monotonic() - started < 0.5
+    assert not reader.keyed_readers
+
+
+class RecordingWriter(ResponseWriter):
+    def __init__(self) -> None:
+        self.writes: list[str] = []
+
+    def write(self, data: str):
+        self.writes.append(data)
+
+    def done(self):
+        pass
+
+
+def serve_storage(reader: StdioRequestReader, writer: RecordingWriter, values: dict[str, str]):
+    """
+    Answer the storage gets of a single write in reverse order, unknown keys fail
+    """
+    while not writer.writes:
+        time.sleep(0.001)
+    assert len(writer.writes) == 1
+    invocations = [json.loads(frame)["data"]["data"] for frame in writer.writes[0].split("\n\n") if frame]
+    for invocation in reversed(invocations):
+        request_id = invocation["backwards_request_id"]
+        key = invocation["request"]["key"]
+        if key in values:
+            reader._process_line(backwards_response(reader, "response", {"data": values[key]}, request_id))
+            reader._process_line(backwards_response(reader, "end", backwards_request_id=request_id))
+        else:
+            reader._process_line(backwards_response(reader, "error", None, request_id, "not found"))
+
+
+def make_duplex_session() -> tuple[Session, StdioRequestReader, RecordingWriter]:
+    reader = StdioRequestReader(writer=MagicMock())
+    writer = RecordingWriter()
+    session = Session(
+        session_id="session",
+        executor=MagicMock(),
+        reader=reader,
+        writer=writer,
+        install_method=InstallMethod.Local,
+    )
+    return session, reader, writer
+
+
+def test_batch_invoke_yields_in_order_or_as_completed():
+    requests = [(InvokeType.Storage, {"opt": "get", "key": key}) for key in ("a", "b", "missing")]
+    values = {"a": "61", "b": "62"}
+
+    session, reader, writer = make_duplex_session()
+    threading.Thread(target=serve_storage, args=(reader, writer, values)).start()
+    results = list(session.batch_invoke(requests))
+    assert [result.index for result in results] == [0, 1, 2]
+    assert results[0].result() == [{"data": "61"}]
+    assert results[1].result() == [{"data": "62"}]
+    with pytest.raises(Exception, match="not found"):
+        results[2].result()
+    assert not reader.keyed_readers
+
+    session, reader, writer = make_duplex_session()
+    threading.Thread(target=serve_storage, args=(reader, writer, values)).start()
+    assert [result.index for result in session.batch_invoke(requests, ordered=False)] == [2, 1, 0]
+
+
+def test_storage_get_many():
+    session, reader, writer = make_duplex_session()
+    threading.Thread(target=serve_storage, args=(reader, writer, {"a": "61", "b": "62"})).start()
+    assert session.storage.get_many(["a", "b"]) == [b"a", b"b"]
+
+
+def test_flush_runs_once_the_session_was_cancelled():
+    session = make_session()
+    session.cancellation.cancel()
+    tokens = []
+    session._storage = MagicMock(flush=lambda: tokens.append(session.cancellation))
+
+    session.flush(timeout=5)
+    assert not tokens[0].cancelled
+    assert tokens[0].remaining() <= 5
+    assert session.cancellation.cancelled
@@ -0,0 +1,105 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from dify_plugin.core.entities.invocation import InvokeType
+from dify_plugin.core.runtime import BackwardsInvocation, Session
+from dify_plugin.core.server.stdio.request_reader import StdioRequestReader
+from dify_plugin.core.utils.cancellation import (
+    CancellationToken,
+    SessionCancelledError,
+    SessionTimeoutError,
+    cancellable,
+    current_cancellation_token,
+    request_timeout,
+    use_cancellation_token,
+)
+
+
+def test_cancellable_closes_the_producer():
+    token = CancellationToken()
+    closed = []
+
+    def produce():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    received = []
+
+    def consume():
+        for item in cancellable(produce(), token=token):
+            received.append(item)
+            if item == 2:
+                token.cancel()
+
+    with pytest.raises(SessionCancelledError):
+        consume()
+
+    assert received == [0, 1, 2]
+    assert closed == [True]
+
+
+def test_cancellable_interrupts_a_blocked_read():
+    token = CancellationToken()
+    unblock = threading.Event()
+
+    def read():
+        yield 1
+        unblock.wait()
+        raise ConnectionError("connection closed")
+
+    threading.Thread(target=lambda: (time.sleep(0.05), token.cancel())).start()
+    with use_cancellation_token(token), pytest.raises(SessionCancelledError):
+        list(cancellable(read(), close=unblock.set))
+    assert current_cancellation_token() is None
+
+
+def test_on_cancel_runs_immediately_when_already_cancelled():
+    token = CancellationToken()
+    token.cancel()
+    callback = MagicMock()
+    with token.on_cancel(callback):
+        callback.assert_called_once()
+
+
+def test_backwards_invocation_wait_is_cancelled():
+    reader = StdioRequestReader(writer=MagicMock())
+    session = Session(
+        session_id="session",
+        executor=MagicMock(),
+        reader=reader,
+        writer=MagicMock(),
+        install_method=None,
+    )
+    invocation = BackwardsInvocation(session)
+
+    threading.Thread(target=lambda: (time.sleep(0.05), session.cancellation.cancel())).start()
+    started = time.monotonic()
+    with pytest.raises(SessionCancelledError):
+        list(invocation._full_duplex_backwards_invoke("request", InvokeType.Storage, dict, {}))
+    # woken up by the cancellation instead of the one second polling round
+    assert time.monotonic() - started < 0.5
+    assert not reader.keyed_readers
+
+
+def test_token_expires_at_its_deadline():
+    token = CancellationToken.with_timeout(0.05)
+    assert token.wait(1)
+    with pytest.raises(SessionTimeoutError):
+        token.raise_if_cancelled()
+
+
+def test_timeouts_are_capped_by_the_deadline():
+    token = CancellationToken.with_timeout(10)
+    assert token.timeout((5, 300)) == (5, pytest.approx(10, abs=0.5))
+    assert token.timeout(None) == pytest.approx(10, abs=0.5)
+    assert CancellationToken().timeout(60) == 60
+
+    with use_cancellation_token(token):
+        assert request_timeout(300) <= 10
+    assert request_timeout(300) == 300
+    token.release()
@@ -0,0 +1,58 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from dify_plugin.core.utils.http_client import configure_http_client, get_http_client, is_http2_available
+from dify_plugin.file.entities import FileType
+from dify_plugin.file.file import File
+
+# client ports of the connections the server accepted
+ports: set[int] = set()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa: N802
+        ports.add(self.client_address[1])
+        self.send_response(200)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        self.wfile.write(b"blob")
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_file_downloads_reuse_the_connection(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}/file"
+    ports.clear()
+    for _ in range(3):
+        assert File(url=url, type=FileType.DOCUMENT).blob == b"blob"
+    assert len(ports) == 1
+
+
+def test_configure_replaces_the_client():
+    client = get_http_client()
+    assert get_http_client() is client
+
+    configure_http_client(httpx.Limits(max_connections=10))
+    assert get_http_client() is not client
+    assert client.is_closed
+
+
+@pytest.mark.skipif(is_http2_available(), reason="h2 is installed")
+def test_http2_requires_h2():
+    with pytest.raises(ValueError, match="h2"):
+        configure_http_client(httpx.Limits(), http2=True)
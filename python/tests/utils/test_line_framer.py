@@ -0,0 +1,45 @@
+import pytest
+
+from dify_plugin.core.utils.line_framer import LineFramer
+
+
+def test_feed_splits_complete_lines():
+    framer = LineFramer()
+    assert framer.feed(b"a\nb\nc") == [b"a", b"b"]
+    assert framer.pending == 1
+    assert framer.feed(b"d\n") == [b"cd"]
+    assert framer.pending == 0
+
+
+def test_feed_keeps_frames_spanning_many_reads():
+    framer = LineFramer()
+    payload = b"x" * 1_000_000
+    chunks = [payload[i : i + 65536] for i in range(0, len(payload), 65536)]
+    for chunk in chunks:
+        assert framer.feed(chunk) == []
+
+    assert framer.feed(b"\n") == [payload]
+
+
+def test_feed_handles_empty_lines_and_empty_data():
+    framer = LineFramer()
+    assert framer.feed(b"") == []
+    assert framer.feed(b"\n\na\n") == [b"", b"", b"a"]
+
+
+def test_multi_byte_delimiter_across_reads():
+    framer = LineFramer(b"\n\n")
+    assert framer.feed(b"a\n") == []
+    assert framer.feed(b"\nb\n\n") == [b"a", b"b"]
+
+
+def test_clear_drops_partial_frame():
+    framer = LineFramer()
+    framer.feed(b"partial")
+    framer.clear()
+    assert framer.feed(b"a\n") == [b"a"]
+
+
+def test_empty_delimiter_is_rejected():
+    with pytest.raises(ValueError, match="delimiter"):
+        LineFramer(b"")